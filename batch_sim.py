@@ -0,0 +1,418 @@
+"""Slice City balance simulator.
+
+By default every run is a scripted player driving the real
+``game_core.step`` on its own seeded city, with the enemies patrolling
+the streets and the rival drivers (their stolen customers cost
+``RIVAL_STEAL_SECONDS`` each, catching one is a fight) exactly as the
+game ships them. That is scalar Python at roughly 20 ms per run on the
+default 20x15 city, about 50 runs/s per process, so the default 2000
+runs take around 40 s per setting on one core; ``--jobs`` spreads the
+runs of a sweep over worker processes and scales close to linearly.
+
+``--dice-model`` instead advances many runs in lockstep, one 60 Hz tick
+at a time, with every per-run quantity (route position, health,
+pepperonis, timer, enemy HP, pizzas in flight) held in a NumPy array.
+It manages about 100,000 runs/s but models the per-move encounter dice
+the game used before patrolling enemies (``game_core.ROAMING_ENEMIES``
+off) and has no rival drivers, so its rows are labelled "dice" and describe that older game.
+``--check`` compares it with ``game_core`` under the same dice rules.
+
+    python batch_sim.py --runs 2000 --time-limit 15 20 25 --shop-cost 10 20 30 --jobs 8
+    python batch_sim.py --dice-model --runs 100000 --time-limit 15 20 25 --check 2000
+"""
+import argparse
+import concurrent.futures
+import itertools
+import random
+import time
+
+import numpy as np
+
+import game_core as core
+
+OVERWORLD, COMBAT, VICTORY, GAMEOVER = 0, 1, 2, 3
+FPS = core.SIM_HZ
+SHIPPED_RUNS = 2000  # default runs per point through game_core
+DICE_RUNS = 100_000  # default runs per point with --dice-model
+
+# A pizza is thrown at x=PIZZA_START and hits on the first tick it passes PIZZA_HIT_X
+HIT_AGE = int((core.PIZZA_HIT_X - core.PIZZA_START[0]) // (core.PIZZA_SPEED * core.SIM_DT)) + 1
+
+# Scripted player used by both the vectorised and the reference simulation
+DEFAULT_POLICY = {
+    "move_interval": 6,  # ticks between key presses in the overworld
+    "throw_interval": 12,  # ticks between F presses in combat
+    "run_below": 0,  # press R instead of F at or below this health
+    "buy_below": 60,  # open the shop and buy at or below this health when affordable
+}
+
+def scripted_next_tile(tile, delivered):
+    """The scripted player walks toward the nearest customer it has not served yet, x first."""
+    px, py = tile
+    best = None
+    for cx, cy in core.customer_positions:
+        if (cx, cy) in delivered:
+            continue
+        d = abs(cx - px) + abs(cy - py)
+        if best is None or d < best[0]:
+            best = (d, cx, cy)
+    _, cx, cy = best
+    if cx != px:
+        return (px + (1 if cx > px else -1), py)
+    return (px, py + (1 if cy > py else -1))
+
+def plan_route():
+    """Precompute the scripted walk once: per step, the tile and what happens on it.
+
+    Buildings do not block movement and the scripted player's choice depends
+    only on which customers it has served, so every run walks the same route
+    and only its position along it (``Runs.step``) has to be stored per run.
+    """
+    tiles, deliveries, boosts, important = [core.pizzeria_pos], [0], [False], [True]
+    delivered = set()
+    while len(delivered) < core.deliveries_needed:
+        tile = scripted_next_tile(tiles[-1], delivered)
+        if tile in core.customer_positions:
+            delivered.add(tile)
+        tiles.append(tile)
+        deliveries.append(len(delivered))
+        boosts.append(tile in core.time_booster_positions)
+        important.append(tile in core.important_tiles)
+    return (np.array(tiles, dtype=np.int16), np.array(deliveries, dtype=np.int16),
+            np.array(boosts), np.array(important))
+
+ROUTE_TILES, ROUTE_DELIVERIES, ROUTE_BOOSTS, ROUTE_IMPORTANT = plan_route()
+
+class Runs:
+    """Struct-of-arrays state for a batch of runs that are still being played."""
+    FIELDS = ("index", "mode", "step", "health", "pepperonis", "elapsed", "extra", "moves",
+              "deliveries", "booster", "enemy_health", "enemy_attack", "enemy_reward",
+              "pizzas", "in_flight", "encounters", "defeated")
+
+    def __init__(self, n, pizza_slots, start_health):
+        self.index = np.arange(n)
+        self.mode = np.full(n, OVERWORLD, dtype=np.int8)
+        self.step = np.zeros(n, dtype=np.int16)  # index into ROUTE_TILES
+        self.health = np.full(n, start_health, dtype=np.int32)
+        self.pepperonis = np.zeros(n, dtype=np.int32)
+        self.elapsed = np.zeros(n, dtype=np.int32)  # ticks on the clock when the run ended
+        self.extra = np.zeros(n, dtype=np.int32)  # ticks
+        self.moves = np.zeros(n, dtype=np.int32)
+        self.deliveries = np.zeros(n, dtype=np.int16)
+        self.booster = np.ones(n, dtype=bool)
+        self.enemy_health = np.zeros(n, dtype=np.int32)
+        self.enemy_attack = np.zeros(n, dtype=np.int32)
+        self.enemy_reward = np.zeros(n, dtype=np.int32)
+        # Throws happen on a fixed tick grid, so a slot is just (throw tick // interval) % slots
+        self.pizzas = np.zeros((n, pizza_slots), dtype=bool)
+        self.in_flight = np.zeros(n, dtype=np.int8)
+        self.encounters = np.zeros(n, dtype=np.int32)
+        self.defeated = np.zeros(n, dtype=np.int32)
+
+    def keep(self, mask):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name)[mask])
+
+    def clear_pizzas(self, runs):
+        self.pizzas[runs] = False
+        self.in_flight[runs] = 0
+
+def simulate(runs, seed=None, base_time_limit=core.base_time_limit,
+             health_replenish_cost=core.health_replenish_cost, enemy_templates=None,
+             policy=None, compact_every=32):
+    """Play ``runs`` independent games under the dice model and return per-run result arrays.
+
+    The scripted player never spends time in the shop (opening it pauses
+    the clock), so every live run has been on the clock for exactly
+    ``tick`` ticks and only runs that end need their time recorded.
+    """
+    policy = {**DEFAULT_POLICY, **(policy or {})}
+    templates = list((enemy_templates or core.enemy_templates).values())
+    enemy_health = np.array([t["health"] for t in templates], dtype=np.int32)
+    enemy_attack = np.array([t["attack"] for t in templates], dtype=np.int32)
+    enemy_reward = np.array([t["pepperonis"] for t in templates], dtype=np.int32)
+
+    rng = np.random.default_rng(seed)
+    limit = int(base_time_limit * FPS)
+    boost = core.TIME_BOOST_SECONDS * FPS
+    move_interval = policy["move_interval"]
+    throw_interval = policy["throw_interval"]
+    pizza_slots = HIT_AGE // throw_interval + 1
+    damage_low, damage_high = core.PIZZA_DAMAGE
+
+    s = Runs(runs, pizza_slots, core.PLAYER_MAX_HEALTH)
+    results = {
+        "victory": np.zeros(runs, dtype=bool),
+        "pepperonis": np.zeros(runs, dtype=np.int32),
+        "time_left": np.zeros(runs, dtype=np.float32),
+        "deliveries": np.zeros(runs, dtype=np.int16),
+        "health": np.zeros(runs, dtype=np.int32),
+        "encounters": np.zeros(runs, dtype=np.int32),
+        "defeated": np.zeros(runs, dtype=np.int32),
+        "ticks": np.zeros(runs, dtype=np.int32),
+        "stolen": np.zeros(runs, dtype=np.int32),  # no rivals in the dice model
+    }
+
+    def finish(mask):
+        idx = s.index[mask]
+        results["victory"][idx] = s.mode[mask] == VICTORY
+        results["pepperonis"][idx] = s.pepperonis[mask]
+        left = (limit + s.extra[mask] - s.elapsed[mask]) / FPS
+        results["time_left"][idx] = np.maximum(left, 0)
+        results["deliveries"][idx] = s.deliveries[mask]
+        results["health"][idx] = s.health[mask]
+        results["encounters"][idx] = s.encounters[mask]
+        results["defeated"][idx] = s.defeated[mask]
+        results["ticks"][idx] = s.elapsed[mask]
+
+    max_ticks = limit + boost * len(core.time_booster_positions) + 2
+    for tick in range(max_ticks):
+        if tick % compact_every == 0:
+            done = s.mode >= VICTORY
+            if done.any():
+                finish(done)
+                s.keep(~done)
+            if not len(s.index):
+                break
+
+        # ---- player input, same order as the reference: shop, then move / throw / run
+        walking = tick % move_interval == 0
+        throwing = tick % throw_interval == 0
+        if walking or throwing:
+            walk = np.flatnonzero(s.mode == OVERWORLD) if walking else None
+            act = np.flatnonzero(s.mode == COMBAT) if throwing else None
+            for w in (walk, act):
+                if w is None or not len(w):
+                    continue
+                buy = w[(s.health[w] <= policy["buy_below"]) & (s.pepperonis[w] >= health_replenish_cost)]
+                s.pepperonis[buy] -= health_replenish_cost
+                s.health[buy] = core.PLAYER_MAX_HEALTH
+
+            if walk is not None and len(walk):
+                w = walk
+                step = s.step[w] + 1
+                s.step[w] = step
+                s.moves[w] += 1
+                s.deliveries[w] = ROUTE_DELIVERIES[step]
+                won = ROUTE_DELIVERIES[step] >= core.deliveries_needed
+                s.mode[w[won]] = VICTORY
+                s.elapsed[w[won]] = tick
+
+                boosted = w[ROUTE_BOOSTS[step] & s.booster[w]]
+                s.extra[boosted] += boost
+                s.booster[boosted] = False
+
+                fight = (~ROUTE_IMPORTANT[step] & (s.moves[w] >= core.ENCOUNTER_COOLDOWN_MOVES)
+                         & (rng.random(len(w), dtype=np.float32) < core.ENEMY_ENCOUNTER_CHANCE))
+                f = w[fight]
+                if len(f):
+                    kind = rng.integers(0, len(templates), len(f))
+                    s.mode[f] = COMBAT
+                    s.enemy_health[f] = enemy_health[kind]
+                    s.enemy_attack[f] = enemy_attack[kind]
+                    s.enemy_reward[f] = enemy_reward[kind]
+                    s.clear_pizzas(f)
+                    s.moves[f] = 0
+                    s.encounters[f] += 1
+
+            if act is not None and len(act):
+                c = act
+                flee = s.health[c] <= policy["run_below"]
+                r = c[flee]
+                if len(r):
+                    escaped = r[rng.random(len(r), dtype=np.float32) < core.RUN_AWAY_CHANCE]
+                    s.mode[escaped] = OVERWORLD
+                    s.clear_pizzas(escaped)
+                    s.moves[escaped] = 0
+                t = c[~flee]
+                s.pizzas[t, (tick // throw_interval) % pizza_slots] = True
+                s.in_flight[t] += 1
+
+        # ---- TICK: timer, enemy attack, pizzas in flight
+        if tick + 1 > limit:
+            timeout = np.flatnonzero((s.mode <= COMBAT) & (tick + 1 > limit + s.extra))
+            s.mode[timeout] = GAMEOVER
+            s.elapsed[timeout] = tick + 1
+
+        c = np.flatnonzero(s.mode == COMBAT)
+        if not len(c):
+            continue
+        idle = c[s.in_flight[c] == 0]
+        a = idle[rng.random(len(idle), dtype=np.float32) < core.ENEMY_ATTACK_RATE * core.SIM_DT]
+        if len(a):
+            s.health[a] -= s.enemy_attack[a]
+            dead = a[s.health[a] <= 0]
+            s.mode[dead] = GAMEOVER
+            s.elapsed[dead] = tick + 1
+
+        # Pizzas thrown HIT_AGE - 1 ticks ago arrive on this tick
+        thrown = tick + 1 - HIT_AGE
+        if thrown >= 0 and thrown % throw_interval == 0:
+            slot = (thrown // throw_interval) % pizza_slots
+            h = c[s.pizzas[c, slot] & (s.mode[c] == COMBAT)]
+            if len(h):
+                s.pizzas[h, slot] = False
+                s.in_flight[h] -= 1
+                s.enemy_health[h] -= rng.integers(damage_low, damage_high + 1, len(h))
+                down = h[s.enemy_health[h] <= 0]
+                s.pepperonis[down] += s.enemy_reward[down]
+                s.defeated[down] += 1
+                s.mode[down] = OVERWORLD
+                s.clear_pizzas(down)
+
+    live = s.mode <= COMBAT
+    s.elapsed[live] = max_ticks
+    s.mode[live] = GAMEOVER
+    finish(np.ones(len(s.index), dtype=bool))
+    return results
+
+# ==========================
+# SHIPPED GAME - THE SAME SCRIPTED PLAYER DRIVING THE REAL game_core
+# ==========================
+def play_reference(seed=None, base_time_limit=core.base_time_limit,
+                   health_replenish_cost=core.health_replenish_cost, enemy_templates=None, policy=None, dice=False):
+    """One run through ``game_core``; ``dice`` swaps in the rules ``simulate`` models, for ``--check``."""
+    policy = {**DEFAULT_POLICY, **(policy or {})}
+    saved = core.base_time_limit, core.health_replenish_cost, core.enemy_templates, core.ROAMING_ENEMIES, core.RIVAL_DRIVERS
+    core.base_time_limit, core.health_replenish_cost = base_time_limit, health_replenish_cost
+    core.ROAMING_ENEMIES = core.RIVAL_DRIVERS = not dice
+    core.enemy_templates = enemy_templates or core.enemy_templates
+    try:
+        state = core.GameState(seed)
+        core.step(state, core.START)
+        encounters = defeated = stolen = 0
+        tick = 0
+        while state.state in ("overworld", "combat"):
+            overworld = state.state == "overworld"
+            acting = tick % (policy["move_interval"] if overworld else policy["throw_interval"]) == 0
+            events = []
+            if acting:
+                player = state.player
+                if player.health <= policy["buy_below"] and player.pepperonis >= health_replenish_cost:
+                    core.step(state, core.OPEN_SHOP)
+                    core.step(state, core.BUY)
+                    core.step(state, core.CLOSE_SHOP)
+                if overworld:
+                    events += core.step(state, _reference_move(state))
+                elif player.health <= policy["run_below"]:
+                    events += core.step(state, core.RUN)
+                elif len(state.pizzas) < HIT_AGE // policy["throw_interval"] + 1:
+                    events += core.step(state, core.THROW)
+            events += core.step(state, core.TICK, core.SIM_DT)
+            encounters += sum(kind == "encounter" for kind, _ in events)
+            defeated += sum(kind == "defeat" for kind, _ in events)
+            stolen += sum(kind == "stolen" for kind, _ in events)
+            tick += 1
+        return {
+            "victory": state.state == "victory",
+            "pepperonis": state.player.pepperonis,
+            "time_left": core.time_remaining(state),
+            "deliveries": state.deliveries_made,
+            "health": state.player.health,
+            "encounters": encounters,
+            "defeated": defeated,
+            "ticks": round(state.elapsed * FPS),
+            "stolen": stolen,
+        }
+    finally:
+        core.base_time_limit, core.health_replenish_cost, core.enemy_templates, core.ROAMING_ENEMIES, core.RIVAL_DRIVERS = saved
+
+def simulate_shipped(runs, seed=None, base_time_limit=core.base_time_limit,
+                     health_replenish_cost=core.health_replenish_cost, enemy_templates=None, policy=None):
+    """``runs`` games of the shipped rules as result arrays like ``simulate``'s, one city per seed.
+
+    Runs use seeds ``seed``, ``seed + 1``, ...; every point of a sweep with
+    the same ``seed`` plays the same cities.
+    """
+    seed = random.getrandbits(32) if seed is None else seed
+    played = [play_reference(seed + i, base_time_limit, health_replenish_cost, enemy_templates, policy)
+              for i in range(runs)]
+    return {key: np.array([r[key] for r in played]) for key in played[0]}
+
+def _reference_move(state):
+    px, py = core.player_tile(state)
+    nx, ny = scripted_next_tile((px, py), state.delivered_customers)
+    return {(1, 0): core.MOVE_RIGHT, (-1, 0): core.MOVE_LEFT, (0, 1): core.MOVE_DOWN, (0, -1): core.MOVE_UP}[(nx - px, ny - py)]
+
+# ==========================
+# COMMAND LINE
+# ==========================
+def summarize(results):
+    won = results["victory"]
+    return {
+        "win_rate": won.mean(),
+        "pepperonis": results["pepperonis"].mean(),
+        "time_left_on_win": results["time_left"][won].mean() if won.any() else 0.0,
+        "deliveries": results["deliveries"].mean(),
+        "encounters": results["encounters"].mean(),
+        "defeated": results["defeated"].mean(),
+        "stolen": results["stolen"].mean(),
+    }
+
+def print_row(label, summary):
+    print(f"{label:<28} win {summary['win_rate']:6.1%}  pep {summary['pepperonis']:6.1f}  "
+          f"left {summary['time_left_on_win']:5.2f}s  del {summary['deliveries']:4.2f}  "
+          f"enc {summary['encounters']:4.2f}  kills {summary['defeated']:4.2f}  stolen {summary['stolen']:4.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Slice City balance parameters over scripted runs.")
+    parser.add_argument("--runs", type=int, default=None,
+                        help=f"runs per parameter combination (default {SHIPPED_RUNS}, {DICE_RUNS} with --dice-model)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, nargs="+", default=[core.base_time_limit])
+    parser.add_argument("--shop-cost", type=int, nargs="+", default=[core.health_replenish_cost])
+    parser.add_argument("--enemy-health-scale", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--enemy-attack-scale", type=float, nargs="+", default=[1.0])
+    for name, value in DEFAULT_POLICY.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=int, default=value)
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes for a multi-point sweep")
+    parser.add_argument("--dice-model", action="store_true",
+                        help="vectorised model of the old per-move encounter dice instead of the shipped game")
+    parser.add_argument("--check", type=int, default=0, metavar="N",
+                        help="with --dice-model, also play N game_core runs under the dice rules and compare")
+    args = parser.parse_args()
+    if args.check and not args.dice_model:
+        parser.error("--check compares the dice model with game_core; it needs --dice-model")
+    if args.runs is None:
+        args.runs = DICE_RUNS if args.dice_model else SHIPPED_RUNS
+    policy = {name: getattr(args, name) for name in DEFAULT_POLICY}
+
+    if args.dice_model:
+        print("[WARNING] Dice model: per-move encounter rolls, no patrolling enemies or rival drivers; not the game as shipped")
+    start = time.perf_counter()
+    combos = list(itertools.product(args.time_limit, args.shop_cost, args.enemy_health_scale, args.enemy_attack_scale))
+    points = [(args.runs, args.seed, combo, policy, args.dice_model) for combo in combos]
+    if args.jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+            rows = list(pool.map(sweep_point, points))
+    else:
+        rows = map(sweep_point, points)
+    for label, summary in rows:
+        print_row(label, summary)
+    elapsed = time.perf_counter() - start
+    total_runs = args.runs * len(combos)
+    print(f"{total_runs} runs in {elapsed:.2f}s ({total_runs / elapsed:,.0f} runs/s)")
+
+    if args.check:
+        time_limit, shop_cost, hp_scale, atk_scale = combos[0]
+        seed = args.seed or 0
+        reference = [play_reference(seed + i, time_limit, shop_cost, scaled_templates(hp_scale, atk_scale), policy, dice=True)
+                     for i in range(args.check)]
+        merged = {key: np.array([r[key] for r in reference]) for key in reference[0]}
+        print_row("dice game_core reference", summarize(merged))
+
+def sweep_point(point):
+    runs, seed, (time_limit, shop_cost, hp_scale, atk_scale), policy, dice = point
+    play = simulate if dice else simulate_shipped
+    results = play(runs, seed, time_limit, shop_cost, scaled_templates(hp_scale, atk_scale), policy)
+    label = f"t={time_limit:g} cost={shop_cost} hp×{hp_scale:g} atk×{atk_scale:g}"
+    return ("dice " if dice else "") + label, summarize(results)
+
+def scaled_templates(hp_scale, atk_scale):
+    return {
+        key: {**t, "health": int(t["health"] * hp_scale), "attack": int(t["attack"] * atk_scale)}
+        for key, t in core.enemy_templates.items()
+    }
+
+if __name__ == "__main__":
+    main()
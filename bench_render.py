@@ -0,0 +1,293 @@
+"""Headless rendering benchmark for every Slice City screen.
+
+Each scene puts the game into one fixed state (seeded, so the map,
+enemy and shake offsets repeat run to run) and times its ``draw_*``
+function alone for N frames under the dummy SDL video driver. A second,
+shorter pass under tracemalloc measures how much Python heap each frame
+allocates; SDL pixel buffers are not on that heap, so a surface created
+per frame shows up only as its Python wrapper.
+
+    python bench_render.py                      # compare with bench_baseline.json
+    python bench_render.py --save               # record a new baseline on this machine
+    python bench_render.py --scenes combat_50 --frames 2000
+    python bench_render.py --check-dirty        # only check dirty rectangles against full redraws
+
+Baselines are only comparable on the machine that recorded them. The exit
+status is 1 when any scene's mean or p95 is slower than the baseline by
+more than --tolerance (and by more than --min-delta-ms, so sub-0.1 ms
+screens do not fail on timer noise).
+
+``--check-dirty`` plays a few scripted sequences through ``draw_screen``
+and ``dirty.present`` with the display replaced by a plain surface, and
+fails when any frame pushed to it differs from the canvas drawn that
+frame, i.e. when something changed on screen without being marked.
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import pygame
+
+import game_core as core
+import slice_city as game
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# ==========================
+# SCENES - EACH ONE SETS UP game_state AND RETURNS THE draw_* FUNCTION TO TIME
+# ==========================
+def reset(seed, state):
+    game.new_session(seed)
+    game.game_state.state = state
+
+def intro(expanded):
+    def setup(seed):
+        reset(seed, "intro")
+        game.game_state.intro_instructions_expanded = expanded
+        return game.draw_intro
+    return setup
+
+def overworld(seed):
+    reset(seed, "overworld")
+    return game.draw_overworld
+
+def combat(pizzas):
+    def setup(seed):
+        reset(seed, "combat")
+        game.game_state.current_enemy = core.Enemy(core.enemy_templates["Rat King"])
+        game.game_state.screen_shake = core.HIT_SHAKE
+        game.game_state.combat_message = "-42!"
+        game.game_state.combat_message_timer = core.MESSAGE_SECONDS
+        start, end = core.PIZZA_START[0], core.PIZZA_HIT_X
+        for i in range(pizzas):
+            game.game_state.pizzas.spawn(start + (end - start) * i / max(1, pizzas), core.PIZZA_START[1], core.PIZZA_SPEED)
+        game.game_state.pizzas.advance(core.SIM_DT, end + core.PIZZA_SPEED)
+        game.render_alpha = 0.5
+        return game.draw_combat
+    return setup
+
+def particles(pool):
+    """A full particle pool, stepped and drawn every frame, refilled as it burns out."""
+    def setup(seed):
+        draw = combat(5)(seed) if pool == "combat" else overworld(seed)
+        particles = game.combat_particles if pool == "combat" else game.city_particles
+        x, y = (core.PIZZA_HIT_X, core.PIZZA_START[1]) if pool == "combat" else (game.player.x, game.player.y)
+        particles.clear()
+
+        def frame():
+            particles.spawn("spark", len(particles.x), x, y, 300, 0.5)
+            game.update_particles(core.SIM_DT)
+            draw()
+        return frame
+    return setup
+
+def shop(seed):
+    reset(seed, "shop")
+    game.game_state.shop_message = "Health Fully Restored!"
+    game.game_state.shop_message_timer = core.SHOP_MESSAGE_SECONDS
+    return game.draw_shop
+
+def victory(seed):
+    reset(seed, "victory")
+    return game.draw_victory
+
+def gameover(seed):
+    reset(seed, "gameover")
+    return game.draw_gameover
+
+SCENES = {
+    "intro": intro(False),
+    "intro_expanded": intro(True),
+    "overworld": overworld,
+    "combat_0": combat(0),
+    "combat_5": combat(5),
+    "combat_50": combat(50),
+    "combat_particles": particles("combat"),
+    "overworld_particles": particles("city"),
+    "shop": shop,
+    "victory": victory,
+    "gameover": gameover,
+}
+
+# ==========================
+# MEASUREMENT
+# ==========================
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, len(ordered) * q // 100)]
+
+def bench_scene(name, frames, warmup, seed):
+    """Mean / p50 / p95 / p99 / max milliseconds per frame and Python KB allocated per frame."""
+    draw = SCENES[name](seed)
+    for _ in range(warmup):
+        draw()
+
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        draw()
+        times.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(times)
+
+    alloc_frames = max(1, frames // 10)
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_frames):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            draw()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "mean_ms": sum(times) / len(times),
+        "p50_ms": percentile(ordered, 50),
+        "p95_ms": percentile(ordered, 95),
+        "p99_ms": percentile(ordered, 99),
+        "max_ms": ordered[-1],
+        "alloc_kb": allocated / alloc_frames / 1024,
+    }
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Names of the scenes that got slower than ``baseline`` allows."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("scenes", {}).get(name)
+        if not old:
+            continue
+        for key in ("mean_ms", "p95_ms"):
+            if result[key] > old[key] * (1 + tolerance) and result[key] - old[key] > min_delta_ms:
+                regressions.append(name)
+                break
+    return regressions
+
+def print_row(name, result, old=None):
+    line = (f"{name:<16} mean {result['mean_ms']:7.3f}  p50 {result['p50_ms']:7.3f}  p95 {result['p95_ms']:7.3f}"
+            f"  p99 {result['p99_ms']:7.3f}  max {result['max_ms']:7.3f} ms  alloc {result['alloc_kb']:7.1f} KB/frame")
+    if old:
+        change = (result["mean_ms"] / old["mean_ms"] - 1) * 100 if old["mean_ms"] else 0.0
+        line += f"  mean {change:+6.1f}% vs baseline"
+    print(line)
+
+# ==========================
+# DIRTY RECT CHECK - WHAT REACHES THE DISPLAY MUST MATCH A FULL REDRAW
+# ==========================
+def shop_buy_down(seed):
+    """Buy once a second with money for three purchases, until the page says the player cannot afford another."""
+    reset(seed, "shop")
+    game.player.pepperonis = core.health_replenish_cost * 3 + 1
+
+    def frame(i):
+        if i % core.SIM_HZ == core.SIM_HZ // 2:
+            game.apply_game_events(core.step(game.game_state, core.BUY))
+    return frame
+
+def overworld_walk(seed):
+    """Walk in a square while roamers and rivals move; fights are skipped to stay on the map."""
+    reset(seed, "overworld")
+    moves = [core.MOVE_RIGHT, core.MOVE_DOWN, core.MOVE_LEFT, core.MOVE_UP]
+
+    def frame(i):
+        if i % 20 == 0:
+            game.apply_game_events(core.step(game.game_state, moves[i // 20 % len(moves)]))
+        if game.game_state.state != "overworld":
+            game.game_state.state = "overworld"
+            game.game_state.current_enemy = None
+    return frame
+
+def overworld_walk_unsprited(seed):
+    """``overworld_walk`` with the roamer and rival sprites missing, so their fallback circles are drawn."""
+    game.roamer_images.clear()
+    return overworld_walk(seed)
+
+DIRTY_CHECKS = {
+    "shop_buy_down": shop_buy_down,
+    "overworld_walk": overworld_walk,
+    "overworld_walk_unsprited": overworld_walk_unsprited,
+}
+
+def check_dirty(name, frames, seed):
+    """Frames of one check whose display differs from the canvas; needs the canvas to be the window."""
+    shadow = pygame.Surface(game.screen.get_size())
+    update, flip = pygame.display.update, pygame.display.flip
+    pygame.display.update = lambda rects: [shadow.blit(game.screen, r, r) for r in rects]
+    pygame.display.flip = lambda: shadow.blit(game.screen, (0, 0))
+    try:
+        frame = DIRTY_CHECKS[name](seed)
+        game.dirty.invalidate()
+        mismatches = 0
+        for i in range(frames):
+            frame(i)
+            game.apply_game_events(core.step(game.game_state, core.TICK))
+            game.update_particles(core.SIM_DT)
+            game.draw_screen()
+            game.dirty.present(game.frame_key())
+            if pygame.image.tobytes(shadow, "RGB") != pygame.image.tobytes(game.screen, "RGB"):
+                mismatches += 1
+    finally:
+        pygame.display.update, pygame.display.flip = update, flip
+        game.build_combat_sprites()
+    return mismatches
+
+def run_dirty_checks(frames, seed):
+    if not game.viewport.direct:
+        print("[ERROR] --check-dirty needs the canvas drawn straight to the window")
+        return 1
+    failures = 0
+    for name in DIRTY_CHECKS:
+        mismatches = check_dirty(name, frames, seed)
+        print(f"{name:<26} {mismatches:5d} of {frames} frames differ from a full redraw")
+        failures += mismatches > 0
+    return 1 if failures else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each Slice City screen headlessly and compare with a baseline.")
+    parser.add_argument("--frames", type=int, default=500, help="timed frames per scene")
+    parser.add_argument("--warmup", type=int, default=30, help="untimed frames first, to fill caches")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenes", nargs="+", choices=list(SCENES), default=list(SCENES))
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare with or --save to")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    parser.add_argument("--check-dirty", action="store_true", help="check dirty rectangles against full redraws instead")
+    args = parser.parse_args()
+
+    game.load_assets()
+    if args.check_dirty:
+        return run_dirty_checks(args.frames, args.seed)
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for name in args.scenes:
+        results[name] = bench_scene(name, args.frames, args.warmup, args.seed)
+        print_row(name, results[name], baseline.get("scenes", {}).get(name))
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({"frames": args.frames, "seed": args.seed, "scenes": results}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print(f"[ERROR] Slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    status = main()
+    pygame.quit()
+    sys.exit(status)
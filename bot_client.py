@@ -0,0 +1,176 @@
+"""Headless bot clients for server.py, to load it and to check what it sends.
+
+Each bot is a thin client: it keeps only the state the server streams to
+it (a ``Mirror`` of the map, the ``FIELDS`` values and the actor tiles)
+and presses keys from that, the way a booth station would. With
+``--check DIR`` (the server's ``--record-dir``) every bot afterwards
+replays its session's recording through ``game_core`` and compares the
+replayed state at the last tick it saw with its mirror, so a bad delta
+shows up as a mismatch.
+
+    python server.py --seed 1 --record-dir sessions &
+    python bot_client.py --bots 200 --seconds 20 --check sessions
+"""
+import argparse
+import asyncio
+import glob
+import os
+import random
+import struct
+import sys
+import time
+
+import numpy as np
+
+import game_core as core
+import server
+from replay import Recording, replay
+
+ACTION_INTERVAL = 0.15  # seconds between a bot's key presses
+RECORDING_WAIT = 5.0  # seconds to wait for the server to save a finished session
+
+class Mirror:
+    """A client's copy of one session, rebuilt from map and frame messages."""
+    def __init__(self):
+        self.session = None
+        self.seed = None
+        self.game_map = None
+        self.kinds = []
+        self.fields = dict.fromkeys(server.FIELDS, 0)
+        self.actors = []
+        self.tick = 0
+        self.events = []  # (kind, value) decoded since the caller last cleared them
+        self.bytes = 0
+
+    def apply(self, kind, payload):
+        self.bytes += server.HEADER.size + len(payload)
+        if kind == ord("M"):
+            self.session, self.seed, _, width, height, roamers, rivals = server.MAP_HEADER.unpack_from(payload)
+            offset = server.MAP_HEADER.size
+            self.kinds = [server.ENEMY_KINDS[k] for k in payload[offset:offset + roamers]]
+            offset += roamers
+            self.game_map = np.frombuffer(payload[offset:offset + width * height], dtype=np.uint8).reshape(height, width)
+            self.actors = [None] * (roamers + rivals)
+            return
+        tick, mask = server.FRAME_HEADER.unpack_from(payload)
+        offset = server.FRAME_HEADER.size
+        changed = [name for i, name in enumerate(server.FIELDS) if mask >> i & 1]
+        for name, value in zip(changed, struct.unpack_from(f"<{len(changed)}i", payload, offset)):
+            self.fields[name] = value
+        offset += 4 * len(changed)
+        (moved,) = struct.unpack_from("<I", payload, offset)
+        offset += 4
+        for actor, x, y in server.MOVE.iter_unpack(payload[offset:offset + moved * server.MOVE.size]):
+            self.actors[actor] = (x, y)
+        offset += moved * server.MOVE.size
+        (count,) = struct.unpack_from("<I", payload, offset)
+        offset += 4
+        for kind, value in server.EVENT.iter_unpack(payload[offset:offset + count * server.EVENT.size]):
+            self.events.append((server.EVENT_KINDS[kind], value))
+        self.tick = tick
+
+    @property
+    def state(self):
+        return server.STATES[self.fields["state"]]
+
+def choose_action(mirror, rng):
+    """A key press for what the mirror shows: start, deliver at random, fight, restart."""
+    state = mirror.state
+    if state == "intro":
+        return core.START
+    if state in ("victory", "gameover"):
+        return core.RESTART
+    if state == "combat":
+        return core.RUN if mirror.fields["health"] < 40 else core.THROW
+    if state == "shop":
+        return core.CLOSE_SHOP
+    return rng.choice(list(core.MOVES))
+
+async def run_bot(host, port, seconds, seed):
+    """Play for ``seconds`` and return the mirror as it was when the bot hung up."""
+    reader, writer = await asyncio.open_connection(host, port)
+    mirror = Mirror()
+    rng = random.Random(seed)
+
+    async def receive():
+        while True:
+            length, kind = server.HEADER.unpack(await reader.readexactly(server.HEADER.size))
+            mirror.apply(kind, await reader.readexactly(length))
+
+    receiver = asyncio.create_task(receive())
+    end = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < end and not receiver.done():
+            await asyncio.sleep(ACTION_INTERVAL * rng.uniform(0.5, 1.5))
+            if mirror.session is not None:
+                writer.write(bytes([choose_action(mirror, rng)]))
+    finally:
+        receiver.cancel()
+        writer.close()
+    if receiver.done() and not receiver.cancelled() and receiver.exception():
+        print(f"[ERROR] Bot lost its connection: {receiver.exception()}")
+    return mirror
+
+def find_recording(record_dir, mirror):
+    pattern = os.path.join(record_dir, f"session-{mirror.session}-{mirror.seed}.scr")
+    deadline = time.perf_counter() + RECORDING_WAIT
+    while time.perf_counter() < deadline:
+        paths = glob.glob(pattern)
+        if paths:
+            return paths[0]
+        time.sleep(0.05)
+    return None
+
+def check(mirror, path):
+    """Differences between ``mirror`` and the recorded session replayed to the mirror's last tick."""
+    recording = Recording.load(path)
+    seen = {}
+
+    def capture(state):
+        seen["fields"] = dict(zip(server.FIELDS, server.snapshot(state)))
+        seen["actors"] = server.actor_tiles(state)
+
+    state = core.GameState(recording.seed)
+    if mirror.tick == 0:
+        capture(state)
+    replay(recording, state, on_tick=lambda tick: capture(state) if tick + 1 == mirror.tick else None)
+    if not seen:
+        return [f"recording stops at tick {recording.ticks}, the client saw tick {mirror.tick}"]
+    problems = [f"{name}: client {mirror.fields[name]}, replay {value}"
+                for name, value in seen["fields"].items() if mirror.fields[name] != value]
+    if seen["actors"] != mirror.actors:
+        problems.append("actor tiles differ")
+    return problems
+
+async def run_bots(args):
+    bots = [run_bot(args.host, args.port, args.seconds, i) for i in range(args.bots)]
+    return await asyncio.gather(*bots)
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect bot players to a Slice City server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=server.DEFAULT_PORT)
+    parser.add_argument("--bots", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--check", metavar="DIR", help="the server's --record-dir; replay each session and compare")
+    args = parser.parse_args()
+
+    mirrors = asyncio.run(run_bots(args))
+    received = sum(m.bytes for m in mirrors)
+    print(f"{len(mirrors)} bots, {received / 1024:.1f} KB received"
+          f" ({received / max(1, len(mirrors)) / args.seconds:.0f} B/s per bot)")
+    if not args.check:
+        return 0
+
+    failures = 0
+    for mirror in mirrors:
+        path = find_recording(args.check, mirror)
+        problems = check(mirror, path) if path else [f"no recording for session {mirror.session}"]
+        if problems:
+            failures += 1
+            print(f"[ERROR] Session {mirror.session}: {'; '.join(problems)}")
+    print(f"{len(mirrors) - failures}/{len(mirrors)} sessions match their replay")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""Pack every asset Slice City loads into one indexed bundle file.
+
+The game reads ``slice_city.bundle`` by offset through its table of
+contents when the file exists and falls back to the loose files when it
+does not, so run this again after changing art:
+
+    python build_bundle.py
+    python build_bundle.py --output dist/slice_city.bundle
+    python build_bundle.py --web web && pygbag web
+
+``--web DIR`` also stages a browser build: the game's modules (the
+entry point as ``main.py``, which pygbag requires) and nothing else go
+in DIR, so pygbag packs only code, and the bundle goes in DIR/static,
+which pygbag copies beside index.html without packing it. The game then
+streams the bundle over HTTP and starts on the title art while the rest
+is still downloading.
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import shutil
+import sys
+
+import slice_city as game
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def game_modules():
+    """(module file, name in the web build) for every project module the game imports."""
+    modules = []
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR and module.__name__ != "__main__":
+            modules.append((path, "main.py" if module is game else os.path.basename(path)))
+    return sorted(modules)
+
+def stage_web(web_dir, bundle_path):
+    os.makedirs(web_dir, exist_ok=True)
+    for path, name in game_modules():
+        shutil.copyfile(path, os.path.join(web_dir, name))
+    static_dir = os.path.join(web_dir, "static")
+    os.makedirs(static_dir, exist_ok=True)
+    shutil.copyfile(bundle_path, os.path.join(static_dir, game.ASSET_BUNDLE_URL))
+    return [name for _, name in game_modules()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack Slice City's assets into one bundle file.")
+    parser.add_argument("--output", default=game.ASSET_BUNDLE_PATH)
+    parser.add_argument("--web", metavar="DIR", help="also stage a pygbag build of the code alone in DIR, serving the bundle")
+    args = parser.parse_args()
+
+    files = {}
+    for path in game.asset_files():
+        full_path = game.assets.find(path)
+        if full_path is None:
+            print(f"[WARNING] {path} not found, the game will use its fallback")
+            continue
+        with open(full_path, "rb") as f:
+            files[path] = f.read()
+    game.write_asset_bundle(args.output, files)
+    size = sum(len(data) for data in files.values())
+    print(f"{len(files)} assets, {size / 1024 / 1024:.1f} MB -> {args.output}")
+
+    if args.web:
+        if os.path.abspath(args.web) == PROJECT_DIR:
+            print("[ERROR] --web needs its own directory; the project folder holds the loose assets")
+            return 1
+        names = stage_web(args.web, args.output)
+        print(f"{len(names)} modules ({', '.join(names)}) + static/{game.ASSET_BUNDLE_URL} -> {args.web}; run pygbag {args.web}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
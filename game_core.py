@@ -0,0 +1,810 @@
+"""Slice City game rules, free of pygame and of any display.
+
+Everything that decides the outcome of a run lives here: movement,
+deliveries, the time booster, random encounters, rival drivers, combat
+and the shop.
+``slice_city.py`` turns key presses into actions, feeds them to ``step``
+and renders whatever state comes back; ``batch_sim.py`` drives it with a
+scripted player for balancing sweeps.
+"""
+import os
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import mapgen
+
+# ==========================
+# WORLD LAYOUT
+# ==========================
+TILE_SIZE = 40
+BUILDING_DENSITY = 0.45
+
+pizzeria_pos = (7, 10)
+customer_positions = [(3,5), (12,13), (5,12), (15,8), (10,3)]
+important_tiles = [pizzeria_pos] + customer_positions
+
+# Only one +3 second booster
+time_booster_positions = [(10, 8)]
+TIME_BOOST_SECONDS = 3
+
+# The landmarks sit at fixed tiles, so no map may be smaller than the box around them
+MIN_MAP_WIDTH = max(x for x, _ in important_tiles + time_booster_positions) + 1
+MIN_MAP_HEIGHT = max(y for _, y in important_tiles + time_booster_positions) + 1
+
+def parse_map_size(text):
+    """(width, height) from "WxH"; ValueError when malformed or too small for the landmarks."""
+    try:
+        width, height = (int(n) for n in text.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"SLICE_CITY_MAP_SIZE must look like 200x150, not {text!r}") from None
+    if width < MIN_MAP_WIDTH or height < MIN_MAP_HEIGHT:
+        raise ValueError(f"SLICE_CITY_MAP_SIZE={text} is too small: the pizzeria, customers and booster "
+                         f"need at least {MIN_MAP_WIDTH}x{MIN_MAP_HEIGHT}")
+    return width, height
+
+# One screen of city by default; SLICE_CITY_MAP_SIZE=200x150 plays a much larger one
+MAP_WIDTH, MAP_HEIGHT = parse_map_size(os.environ.get("SLICE_CITY_MAP_SIZE", "20x15"))
+
+# ==========================
+# BALANCE
+# ==========================
+deliveries_needed = 5
+base_time_limit = 20
+health_replenish_cost = 20
+
+PLAYER_MAX_HEALTH = 120
+
+enemy_templates = {
+    "Thug": {"name": "Street Thug", "health": 96, "attack": 16, "pepperonis": 10},
+    "Driver": {"name": "Rival Driver", "health": 120, "attack": 21, "pepperonis": 18},
+    "Gangster": {"name": "Gang Enforcer", "health": 192, "attack": 32, "pepperonis": 40},
+    "Rat King": {"name": "Rat King", "health": 264, "attack": 40, "pepperonis": 90},
+}
+
+ENCOUNTER_COOLDOWN_MOVES = 3  # player must move at least 3 tiles before next encounter
+
+# Encounters come from enemies patrolling the streets; with ROAMING_ENEMIES off
+# (batch_sim --dice-model) each move instead rolls ENEMY_ENCOUNTER_CHANCE
+ROAMING_ENEMIES = True
+ENEMY_ENCOUNTER_CHANCE = 0.12
+ROAMERS_PER_TILE = 1 / 15
+ROAMER_MIN_COUNT = 6
+ROAMER_STEP_TICKS = 15  # ticks between one roamer's steps
+ROAMER_CHASE_TILES = 4
+ROAMER_SPAWN_DISTANCE = 4  # tiles from the player, so nothing appears on top of them
+ROAMER_DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+SPATIAL_CELL_TILES = 8
+# Rival delivery drivers race the player to the customers
+RIVAL_DRIVERS = True
+RIVAL_COUNT = 2
+RIVAL_STEP_TICKS = 20  # ticks between one rival's steps
+RIVAL_STEAL_SECONDS = 1.0  # clock the player loses each time a rival serves a customer first
+ROUTE_CACHE_MAPS = 4  # maps whose route fields stay cached
+PREPARED_RUNS = 2  # upcoming runs a front end may build ahead of time
+ENEMY_ATTACK_RATE = 2.1  # expected attacks per second, only while no pizza is in flight
+RUN_AWAY_CHANCE = 0.7
+
+PIZZA_START = (80, 340)
+PIZZA_SPEED = 1920  # pixels per second
+PIZZA_HIT_X = 650
+PIZZA_DAMAGE = (30, 50)
+PIZZA_SPIN = 7  # degrees of rotation per pixel travelled
+PIZZA_POOL_SIZE = 64  # starting capacity; the pool doubles when a volley needs more
+
+# Presentation timers, in seconds
+HIT_FLASH = 0.3
+HIT_SHAKE = 0.4
+DAMAGE_SHAKE = 0.5
+MESSAGE_SECONDS = 1.5
+DEFEAT_MESSAGE_SECONDS = 2.7
+SHOP_MESSAGE_SECONDS = 2.0
+
+# The rules always advance in steps of SIM_DT, however fast the screen redraws
+SIM_HZ = 60
+SIM_DT = 1.0 / SIM_HZ
+
+# ==========================
+# ACTIONS
+# ==========================
+(TICK, START, TOGGLE_INSTRUCTIONS, MOVE_LEFT, MOVE_RIGHT, MOVE_UP, MOVE_DOWN,
+ THROW, RUN, OPEN_SHOP, CLOSE_SHOP, BUY, RESTART) = range(13)
+
+MOVES = {
+    MOVE_LEFT: (-1, 0),
+    MOVE_RIGHT: (1, 0),
+    MOVE_UP: (0, -1),
+    MOVE_DOWN: (0, 1),
+}
+
+# ==========================
+# MAP GENERATION
+# ==========================
+def generate_map(seed):
+    """The city for ``seed``: a uint8 NumPy grid indexed ``game_map[y][x]``, all landmarks reachable."""
+    return mapgen.generate_map(seed, MAP_WIDTH, MAP_HEIGHT, pizzeria_pos, customer_positions,
+                               time_booster_positions, BUILDING_DENSITY)
+
+# ==========================
+# STATE
+# ==========================
+class Player:
+    __slots__ = ("x", "y", "health", "max_health", "pepperonis")
+
+    def __init__(self):
+        self.x = pizzeria_pos[0] * TILE_SIZE
+        self.y = pizzeria_pos[1] * TILE_SIZE
+        self.health = PLAYER_MAX_HEALTH
+        self.max_health = PLAYER_MAX_HEALTH
+        self.pepperonis = 0
+
+class Enemy:
+    """The enemy in the current fight, made from one of ``enemy_templates``."""
+    __slots__ = ("name", "health", "max_health", "attack", "pepperonis", "flash")
+
+    def __init__(self, template):
+        self.name = template["name"]
+        self.health = self.max_health = template["health"]
+        self.attack = template["attack"]
+        self.pepperonis = template["pepperonis"]
+        self.flash = 0.0
+
+class ProjectilePool:
+    """Pizzas in flight, one slot each in preallocated NumPy arrays.
+
+    ``advance`` moves every live slot in one vectorised pass. Freed slots
+    go on a free list and are reused without moving the others, and the
+    arrays double when every slot is taken. ``seq`` numbers the throws so
+    hits still resolve in the order the pizzas were thrown.
+    """
+    __slots__ = ("x", "y", "prev_x", "vel", "angle", "seq", "alive", "free", "count", "next_seq")
+
+    def __init__(self, capacity=PIZZA_POOL_SIZE):
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)  # where the last step left it, for interpolated drawing
+        self.vel = np.zeros(capacity)
+        self.angle = np.zeros(capacity)
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.count = 0
+        self.next_seq = 0
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        capacity = len(self.alive)
+        for name in ("x", "y", "prev_x", "vel", "angle", "seq", "alive"):
+            old = getattr(self, name)
+            grown = np.zeros(capacity * 2, dtype=old.dtype)
+            grown[:capacity] = old
+            setattr(self, name, grown)
+        self.free.extend(range(capacity * 2 - 1, capacity - 1, -1))
+
+    def spawn(self, x, y, vel):
+        if not self.free:
+            self._grow()
+        i = self.free.pop()
+        self.x[i] = self.prev_x[i] = x
+        self.y[i] = y
+        self.vel[i] = vel
+        self.angle[i] = -PIZZA_SPIN * x
+        self.seq[i] = self.next_seq
+        self.next_seq += 1
+        self.alive[i] = True
+        self.count += 1
+
+    def kill(self, i):
+        self.alive[i] = False
+        self.free.append(i)
+        self.count -= 1
+
+    def clear(self):
+        self.alive[:] = False
+        self.free = list(range(len(self.alive) - 1, -1, -1))
+        self.count = 0
+
+    def live(self):
+        return np.flatnonzero(self.alive)
+
+    def advance(self, dt, hit_x):
+        """Move every live pizza by ``dt`` seconds; returns the slots now past ``hit_x``, in throw order."""
+        if not self.count:
+            return []
+        alive = self.alive
+        np.copyto(self.prev_x, self.x, where=alive)
+        np.add(self.x, self.vel * dt, out=self.x, where=alive)
+        np.multiply(self.x, -PIZZA_SPIN, out=self.angle, where=alive)
+        hits = np.flatnonzero(alive & (self.x > hit_x))
+        if len(hits) > 1:
+            hits = hits[np.argsort(self.seq[hits])]
+        return hits.tolist()
+
+# ==========================
+# ROAMING ENEMIES
+# ==========================
+class SpatialHash:
+    """Uniform grid over the map: each ``cell`` x ``cell`` block of tiles keeps the ids standing in it.
+
+    Moving an id touches at most two buckets and a query only visits the
+    buckets its rectangle overlaps, so neither depends on how many other
+    entities are on the map.
+    """
+    __slots__ = ("cell", "buckets")
+
+    def __init__(self, cell=SPATIAL_CELL_TILES):
+        self.cell = cell
+        self.buckets = {}
+
+    def key(self, x, y):
+        return (x // self.cell, y // self.cell)
+
+    def insert(self, i, x, y):
+        self.buckets.setdefault(self.key(x, y), set()).add(i)
+
+    def remove(self, i, x, y):
+        key = self.key(x, y)
+        bucket = self.buckets[key]
+        bucket.discard(i)
+        if not bucket:
+            del self.buckets[key]
+
+    def move(self, i, old_x, old_y, x, y):
+        if self.key(old_x, old_y) != self.key(x, y):
+            self.remove(i, old_x, old_y)
+            self.insert(i, x, y)
+
+    def candidates(self, x0, y0, x1, y1):
+        """Ids in every bucket overlapping tiles x0..x1, y0..y1 (inclusive); callers check exact tiles."""
+        c = self.cell
+        for cy in range(y0 // c, y1 // c + 1):
+            for cx in range(x0 // c, x1 // c + 1):
+                yield from self.buckets.get((cx, cy), ())
+
+class Roamers:
+    """Enemies patrolling the streets, one list entry per enemy, indexed through a ``SpatialHash``.
+
+    Each roamer steps one tile every ``ROAMER_STEP_TICKS`` overworld ticks,
+    staggered so only that fraction of them moves on any one tick. It keeps
+    walking the way it faces until blocked, then turns at random; within
+    ``ROAMER_CHASE_TILES`` of the player it heads for the player instead.
+    Roamers stay on street tiles, so the pizzeria and customers are safe.
+    """
+    __slots__ = ("xs", "ys", "dirs", "kinds", "hash", "schedule", "tick", "street")
+
+    def __init__(self):
+        self.xs, self.ys, self.dirs, self.kinds = [], [], [], []
+        self.hash = SpatialHash()
+        self.schedule = [[] for _ in range(ROAMER_STEP_TICKS)]  # ids moving on tick % ROAMER_STEP_TICKS
+        self.tick = 0
+        self.street = b""  # one byte per tile, row-major: 1 where roamers may walk
+
+    def __len__(self):
+        return len(self.xs)
+
+    def populate(self, state):
+        self.__init__()
+        self.street = (state.game_map == mapgen.STREET).tobytes()
+        count = max(ROAMER_MIN_COUNT, int(MAP_WIDTH * MAP_HEIGHT * ROAMERS_PER_TILE))
+        kinds = list(enemy_templates)
+        for i in range(count):
+            x, y = self.spawn_tile(state)
+            self.xs.append(x)
+            self.ys.append(y)
+            self.dirs.append(state.roam_rng.randrange(4))
+            self.kinds.append(state.roam_rng.choice(kinds))
+            self.hash.insert(i, x, y)
+            self.schedule[i % ROAMER_STEP_TICKS].append(i)
+
+    def spawn_tile(self, state):
+        """A random street tile out of sight of the player."""
+        px, py = player_tile(state)
+        for attempt in range(1000):
+            x = state.roam_rng.randrange(MAP_WIDTH)
+            y = state.roam_rng.randrange(MAP_HEIGHT)
+            # Far enough away, unless the map is too cramped to find such a tile
+            far = max(abs(x - px), abs(y - py)) > ROAMER_SPAWN_DISTANCE or attempt >= 500
+            if self.street[y * MAP_WIDTH + x] and far:
+                return x, y
+        return px, py
+
+    def at(self, x, y):
+        """Id of a roamer standing on tile (x, y), or None."""
+        for i in self.hash.candidates(x, y, x, y):
+            if self.xs[i] == x and self.ys[i] == y:
+                return i
+        return None
+
+    def in_rect(self, x0, y0, x1, y1):
+        """Ids of the roamers on tiles x0..x1, y0..y1 (inclusive)."""
+        xs, ys = self.xs, self.ys
+        return [i for i in self.hash.candidates(x0, y0, x1, y1) if x0 <= xs[i] <= x1 and y0 <= ys[i] <= y1]
+
+    def respawn(self, state, i):
+        x, y = self.spawn_tile(state)
+        self.hash.move(i, self.xs[i], self.ys[i], x, y)
+        self.xs[i], self.ys[i] = x, y
+
+    def step(self, state):
+        """Advance one overworld tick; returns the id of a roamer that walked into the player, or None."""
+        movers = self.schedule[self.tick % ROAMER_STEP_TICKS]
+        self.tick += 1
+        if not movers:
+            return None
+        px, py = player_tile(state)
+        r = ROAMER_CHASE_TILES
+        chasers = set(self.in_rect(px - r, py - r, px + r, py + r))
+        street = self.street
+        rng = state.roam_rng
+        contact = None
+        for i in movers:
+            x, y = self.xs[i], self.ys[i]
+            if i in chasers:
+                dx, dy = px - x, py - y
+                options = [(1 if dx > 0 else -1, 0)] if dx else []
+                options += [(0, 1 if dy > 0 else -1)] if dy else []
+                if abs(dy) > abs(dx):
+                    options.reverse()
+            else:
+                options = [ROAMER_DIRECTIONS[self.dirs[i]]]
+            options += [ROAMER_DIRECTIONS[rng.randrange(4)]]
+            for dx, dy in options:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < MAP_WIDTH and 0 <= ny < MAP_HEIGHT and street[ny * MAP_WIDTH + nx]:
+                    self.hash.move(i, x, y, nx, ny)
+                    self.xs[i], self.ys[i] = nx, ny
+                    self.dirs[i] = ROAMER_DIRECTIONS.index((dx, dy))
+                    if nx == px and ny == py and contact is None:
+                        contact = i
+                    break
+            else:
+                self.dirs[i] = rng.randrange(4)
+        return contact
+
+# ==========================
+# ROUTES AND RIVAL DRIVERS
+# ==========================
+class Routes:
+    """One distance field and one flow field per important tile, over the streets of one map.
+
+    ``dist[k, y, x]`` is the number of steps from (x, y) to
+    ``targets[k]`` and ``flow[k, y, x]`` indexes ``mapgen.DIRECTIONS`` with
+    the first of them, so following a route is a lookup per step however
+    many things follow it. Routes for the same map seed are shared; the
+    first change to a shared map's tiles takes a private copy.
+    """
+    __slots__ = ("targets", "dist", "flow", "shared")
+
+    def __init__(self, grid, targets):
+        self.targets = list(targets)
+        self.dist = np.stack([mapgen.distance_field(grid, t) for t in self.targets])
+        self.flow = np.stack([mapgen.flow_field(d) for d in self.dist])
+        self.shared = False
+
+    def copy(self):
+        routes = Routes.__new__(Routes)
+        routes.targets = list(self.targets)
+        routes.dist = self.dist.copy()
+        routes.flow = self.flow.copy()
+        routes.shared = False
+        return routes
+
+    def repair(self, grid, tiles):
+        """Patch every field after ``tiles`` changed in ``grid``; returns the union of the regions redone."""
+        rects = [mapgen.repair_fields(grid, self.dist[k], self.flow[k], tiles) for k in range(len(self.targets))]
+        return (min(r[0] for r in rects), min(r[1] for r in rects), max(r[2] for r in rects), max(r[3] for r in rects))
+
+    def next_tile(self, k, x, y):
+        """The tile one step from (x, y) toward ``targets[k]``, or None when there or cut off."""
+        d = self.flow[k, y, x]
+        if d == mapgen.NO_STEP:
+            return None
+        dx, dy = mapgen.DIRECTIONS[d]
+        return x + dx, y + dy
+
+_route_cache = OrderedDict()  # map seed -> Routes, most recently used last
+# Guards _route_cache and _prepared_runs, so a GameState may be built on any thread
+_cache_lock = threading.Lock()
+
+def remember_routes(map_seed, routes):
+    routes.shared = True
+    with _cache_lock:
+        _route_cache[map_seed] = routes
+        _route_cache.move_to_end(map_seed)
+        if len(_route_cache) > ROUTE_CACHE_MAPS:
+            _route_cache.popitem(last=False)
+
+def routes_for(map_seed, grid):
+    """Routes to every important tile of the map generated from ``map_seed``, cached for a few maps."""
+    with _cache_lock:
+        routes = _route_cache.get(map_seed)
+    if routes is None:
+        routes = Routes(grid, important_tiles)
+    remember_routes(map_seed, routes)
+    return routes
+
+def tiles_changed(state, tiles):
+    """Call after writing new codes into ``state.game_map`` at ``tiles``; only the routes through them are redone."""
+    if state.routes.shared:
+        state.routes = state.routes.copy()
+    state.roamers.street = (state.game_map == mapgen.STREET).tobytes()
+    return state.routes.repair(state.game_map, list(tiles))
+
+# ==========================
+# RUN PREPARATION
+# ==========================
+_prepared_runs = OrderedDict()  # upcoming_run key -> GameState holding that run's city
+
+def upcoming_run(state):
+    """Key of the city ``state``'s next ``new_run`` rolls; fixed while the rules are idle on an end screen."""
+    return (state.seed, state.map_rng.getstate(), state.roam_rng.getstate())
+
+def build_run(key):
+    """A scratch GameState holding the city, roamers and rivals of the run ``key`` names.
+
+    Works on copies of the two streams a new city draws from, so it may run
+    on a worker thread while the real state sits on the victory or game
+    over screen.
+    """
+    seed, map_state, roam_state = key
+    run = GameState.__new__(GameState)
+    run.seed = seed
+    run.map_rng = random.Random()
+    run.map_rng.setstate(map_state)
+    run.roam_rng = random.Random()
+    run.roam_rng.setstate(roam_state)
+    run.player = Player()
+    run.roamers = Roamers()
+    run.rivals = Rivals()
+    run.delivered_customers = set()
+    run.rival_customers = set()
+    run.roll_city()
+    return run
+
+def add_prepared_run(key, run):
+    """Hand a ``build_run`` result to the ``new_run`` that would roll the same city."""
+    with _cache_lock:
+        _prepared_runs[key] = run
+        if len(_prepared_runs) > PREPARED_RUNS:
+            _prepared_runs.popitem(last=False)
+
+def run_is_prepared(key):
+    return key in _prepared_runs
+
+# Step per flow value; the last row is NO_STEP, which stays put
+RIVAL_STEPS = np.array(mapgen.DIRECTIONS + [(0, 0)], dtype=np.int32)
+
+class Rivals:
+    """Rival delivery drivers as NumPy arrays: tile, route being followed and step phase per driver.
+
+    A driver leaves the pizzeria for the nearest customer nobody has
+    served yet, preferring one no other driver is heading for, and comes
+    back for the next order once it gets there; each customer can be
+    lost to a rival once. Every tick the drivers
+    whose phase is due step together through one gather from the shared
+    flow fields, so the cost per tick barely changes with their number.
+    """
+    __slots__ = ("xs", "ys", "routes", "phase", "tick")
+
+    def __init__(self, count=0):
+        self.xs = np.full(count, pizzeria_pos[0], dtype=np.int32)
+        self.ys = np.full(count, pizzeria_pos[1], dtype=np.int32)
+        self.routes = np.zeros(count, dtype=np.int32)  # index into Routes.targets; 0 is the pizzeria
+        self.phase = np.arange(count, dtype=np.int32) * RIVAL_STEP_TICKS // max(1, count)
+        self.tick = 0
+
+    def __len__(self):
+        return len(self.xs)
+
+    def populate(self, state, count=RIVAL_COUNT):
+        self.__init__(count)
+        for i in range(count):
+            self.next_order(state, i)
+
+    def next_order(self, state, i):
+        """Send driver ``i`` at the pizzeria to the closest open customer, or leave it waiting there."""
+        dist = state.routes.dist
+        x, y = self.xs[i], self.ys[i]
+        taken = set(self.routes.tolist())
+        best = None
+        for k in range(1, len(state.routes.targets)):
+            customer = state.routes.targets[k]
+            if customer in state.delivered_customers or customer in state.rival_customers or dist[k, y, x] >= mapgen.FAR:
+                continue
+            key = (k in taken, dist[k, y, x])
+            if best is None or key < best[0]:
+                best = (key, k)
+        if best is None:
+            self.routes[i] = 0
+            self.phase[i] = -1  # every order is taken, so it never moves again this run
+        else:
+            self.routes[i] = best[1]
+
+    def at(self, x, y):
+        """Id of a driver on tile (x, y), or None."""
+        hits = np.flatnonzero((self.xs == x) & (self.ys == y))
+        return int(hits[0]) if len(hits) else None
+
+    def send_home(self, i):
+        self.xs[i], self.ys[i] = pizzeria_pos
+        self.routes[i] = 0
+
+    def step(self, state, events):
+        movers = np.flatnonzero(self.phase == self.tick % RIVAL_STEP_TICKS)
+        self.tick += 1
+        if not len(movers):
+            return
+        routes = self.routes[movers]
+        flow = state.routes.flow[routes, self.ys[movers], self.xs[movers]]
+        steps = RIVAL_STEPS[np.minimum(flow, len(mapgen.DIRECTIONS))]
+        self.xs[movers] += steps[:, 0]
+        self.ys[movers] += steps[:, 1]
+        arrived = state.routes.dist[routes, self.ys[movers], self.xs[movers]] == 0
+        for i in movers[arrived].tolist():
+            k = int(self.routes[i])
+            if k == 0:
+                self.next_order(state, i)
+                continue
+            customer = state.routes.targets[k]
+            if customer not in state.delivered_customers and customer not in state.rival_customers:
+                state.rival_customers.add(customer)
+                state.elapsed += RIVAL_STEAL_SECONDS
+                events.append(("stolen", customer))
+            self.routes[i] = 0
+
+class GameState:
+    """One run of the game. Every rule in ``step`` reads and writes only this object.
+
+    Each subsystem draws from its own stream derived from ``seed``, so the
+    seed plus the actions fed to ``step`` reproduce a session exactly, and
+    a change to how often one subsystem rolls leaves the others untouched.
+    """
+    __slots__ = (
+        "seed", "map_rng", "encounter_rng", "combat_rng", "roam_rng", "player", "pizzas", "roamers", "rivals", "state", "previous_state",
+        "current_enemy", "screen_shake", "combat_message", "combat_message_timer", "shop_message",
+        "shop_message_timer", "deliveries_made", "extra_time_bought", "elapsed", "intro_instructions_expanded",
+        "delivered_customers", "rival_customers", "time_boosters_active", "last_encounter_tile", "moves_since_encounter",
+        "map_seed", "game_map", "routes",
+    )
+
+    def __init__(self, seed=None):
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.map_rng = random.Random(f"{self.seed}:map")
+        self.encounter_rng = random.Random(f"{self.seed}:encounter")
+        self.combat_rng = random.Random(f"{self.seed}:combat")
+        self.roam_rng = random.Random(f"{self.seed}:roam")
+        self.player = Player()
+        self.pizzas = ProjectilePool()
+        self.roamers = Roamers()
+        self.rivals = Rivals()
+        self.new_run()
+
+    def new_run(self):
+        """Fresh map and counters; like the original restart, this returns to the title screen."""
+        self.state = "intro"
+        self.previous_state = None
+        self.current_enemy = None
+        self.pizzas.clear()
+        self.screen_shake = 0.0
+        self.combat_message = ""
+        self.combat_message_timer = 0.0
+        self.shop_message = ""
+        self.shop_message_timer = 0.0
+        self.deliveries_made = 0
+        self.extra_time_bought = 0
+        self.elapsed = 0.0
+        self.intro_instructions_expanded = False
+        self.delivered_customers = set()
+        self.rival_customers = set()
+        self.time_boosters_active = [True for _ in time_booster_positions]
+        self.last_encounter_tile = None
+        self.moves_since_encounter = 0
+        self.player.__init__()
+        # A prepared run is popped, so this state takes over its objects without copying them
+        with _cache_lock:
+            run = _prepared_runs.pop(upcoming_run(self), None)
+        if run is None:
+            self.roll_city()
+            return
+        self.map_rng, self.roam_rng = run.map_rng, run.roam_rng
+        self.map_seed, self.game_map, self.routes = run.map_seed, run.game_map, run.routes
+        self.roamers, self.rivals = run.roamers, run.rivals
+
+    def roll_city(self):
+        """Map, routes, roamers and rivals of a fresh run; draws from map_rng and roam_rng only."""
+        self.map_seed = self.map_rng.getrandbits(32)
+        self.game_map = generate_map(self.map_seed)
+        self.routes = routes_for(self.map_seed, self.game_map)
+        if ROAMING_ENEMIES:
+            self.roamers.populate(self)
+        self.rivals.populate(self, RIVAL_COUNT if RIVAL_DRIVERS else 0)
+
+def time_remaining(state):
+    return max(0, base_time_limit + state.extra_time_bought - state.elapsed)
+
+def player_tile(state):
+    return (state.player.x // TILE_SIZE, state.player.y // TILE_SIZE)
+
+# ==========================
+# RULES
+# ==========================
+def step(state, action, dt=SIM_DT):
+    """Apply one action to ``state`` and return the events it produced.
+
+    ``TICK`` advances the clock, timers and combat by ``dt`` seconds, which
+    front ends keep fixed at ``SIM_DT`` so balance does not depend on the
+    frame rate; every other action is a player input and is ignored when it
+    does not apply to the current screen. Events are ``(kind, value)``
+    tuples the front end uses for sounds and effects.
+    """
+    events = []
+    if action == TICK:
+        tick(state, dt, events)
+    elif action in MOVES:
+        if state.state == "overworld":
+            move(state, *MOVES[action], events)
+    elif action == OPEN_SHOP:
+        if state.state in ("overworld", "combat"):
+            state.previous_state = state.state
+            state.state = "shop"
+    elif action == CLOSE_SHOP:
+        if state.state == "shop":
+            state.state = state.previous_state or "overworld"
+    elif action == BUY:
+        if state.state == "shop" and state.player.pepperonis >= health_replenish_cost:
+            state.player.pepperonis -= health_replenish_cost
+            state.player.health = state.player.max_health
+            state.shop_message = "Health Fully Restored!"
+            state.shop_message_timer = SHOP_MESSAGE_SECONDS
+            events.append(("buy", health_replenish_cost))
+    elif action == THROW:
+        if state.state == "combat":
+            state.pizzas.spawn(*PIZZA_START, PIZZA_SPEED)
+            events.append(("throw", len(state.pizzas)))
+    elif action == RUN:
+        if state.state == "combat":
+            escaped = state.combat_rng.random() < RUN_AWAY_CHANCE
+            if escaped:
+                state.state = "overworld"
+                state.current_enemy = None
+                state.pizzas.clear()
+                state.moves_since_encounter = 0
+            events.append(("run", escaped))
+    elif action == START:
+        if state.state == "intro":
+            state.state = "overworld"
+            events.append(("start", None))
+    elif action == TOGGLE_INSTRUCTIONS:
+        if state.state == "intro":
+            state.intro_instructions_expanded = not state.intro_instructions_expanded
+    elif action == RESTART:
+        if state.state in ("victory", "gameover"):
+            state.new_run()
+            events.append(("restart", None))
+    return events
+
+def move(state, dx, dy, events):
+    player = state.player
+    old_tile = player_tile(state)
+    player.x = max(0, min(player.x + dx * TILE_SIZE, (MAP_WIDTH - 1) * TILE_SIZE))
+    player.y = max(0, min(player.y + dy * TILE_SIZE, (MAP_HEIGHT - 1) * TILE_SIZE))
+    current_tile = player_tile(state)
+    tile_x, tile_y = current_tile
+
+    if current_tile != old_tile:
+        state.moves_since_encounter += 1
+
+    if state.game_map[tile_y][tile_x] == 3 and current_tile not in state.delivered_customers:
+        state.deliveries_made += 1
+        state.delivered_customers.add(current_tile)
+        events.append(("deliver", current_tile))
+        if state.deliveries_made >= deliveries_needed:
+            state.state = "victory"
+            events.append(("victory", time_remaining(state)))
+            return
+
+    # Time booster pickup
+    for i, booster in enumerate(time_booster_positions):
+        if current_tile == booster and state.time_boosters_active[i]:
+            state.extra_time_bought += TIME_BOOST_SECONDS
+            state.time_boosters_active[i] = False
+            state.shop_message = "Time Booster Collected +3s!"
+            state.shop_message_timer = SHOP_MESSAGE_SECONDS
+            events.append(("time_boost", booster))
+
+    if state.moves_since_encounter < ENCOUNTER_COOLDOWN_MOVES or current_tile in important_tiles:
+        return
+    rival = state.rivals.at(tile_x, tile_y)
+    if rival is not None:
+        # Catching a rival on the road means a fight; its van goes back to the pizzeria
+        start_combat(state, "Driver", events)
+        state.rivals.send_home(rival)
+    elif ROAMING_ENEMIES:
+        roamer = state.roamers.at(tile_x, tile_y)
+        if roamer is not None:
+            encounter(state, roamer, events)
+    elif state.encounter_rng.random() < ENEMY_ENCOUNTER_CHANCE:
+        key = state.encounter_rng.choice(list(enemy_templates.keys()))
+        start_combat(state, key, events)
+
+def encounter(state, roamer, events):
+    """Fight the roamer on the player's tile; it leaves the streets and another like it appears elsewhere."""
+    start_combat(state, state.roamers.kinds[roamer], events)
+    state.roamers.respawn(state, roamer)
+
+def start_combat(state, key, events):
+    enemy = Enemy(enemy_templates[key])
+    state.current_enemy = enemy
+    state.state = "combat"
+    state.pizzas.clear()
+    state.last_encounter_tile = player_tile(state)
+    state.moves_since_encounter = 0
+    events.append(("encounter", enemy.name))
+
+def tick(state, dt, events):
+    # Timer - only runs in overworld and combat, so the shop pauses it
+    if state.state in ("overworld", "combat"):
+        state.elapsed += dt
+        if state.elapsed > base_time_limit + state.extra_time_bought:
+            state.state = "gameover"
+            events.append(("gameover", "time"))
+            return
+
+    if state.state == "overworld":
+        state.rivals.step(state, events)
+        if ROAMING_ENEMIES:
+            contact = state.roamers.step(state)
+            if contact is not None and state.moves_since_encounter >= ENCOUNTER_COOLDOWN_MOVES:
+                encounter(state, contact, events)
+        return
+
+    if state.state == "shop":
+        state.shop_message_timer = max(0.0, state.shop_message_timer - dt)
+        return
+
+    if state.state != "combat":
+        return
+
+    enemy = state.current_enemy
+    state.screen_shake = max(0.0, state.screen_shake - dt)
+    enemy.flash = max(0.0, enemy.flash - dt)
+
+    # Enemy attack, as a per-step chance of the per-second rate
+    if not state.pizzas and state.combat_rng.random() < ENEMY_ATTACK_RATE * dt:
+        dmg = enemy.attack
+        state.player.health -= dmg
+        state.screen_shake = DAMAGE_SHAKE
+        state.combat_message = f"-{dmg} HP!"
+        state.combat_message_timer = MESSAGE_SECONDS
+        events.append(("damage", dmg))
+        if state.player.health <= 0:
+            state.state = "gameover"
+            events.append(("gameover", "health"))
+            return
+
+    for i in state.pizzas.advance(dt, PIZZA_HIT_X):
+        state.pizzas.kill(i)
+        damage = state.combat_rng.randint(*PIZZA_DAMAGE)
+        enemy.health -= damage
+        enemy.flash = HIT_FLASH
+        state.screen_shake = HIT_SHAKE
+        state.combat_message = f"-{damage}!"
+        state.combat_message_timer = MESSAGE_SECONDS
+        events.append(("hit", damage))
+
+        if enemy.health <= 0:
+            reward = enemy.pepperonis
+            state.player.pepperonis += reward
+            state.combat_message = f"Defeated! +{reward} pepperonis!"
+            state.combat_message_timer = DEFEAT_MESSAGE_SECONDS
+            state.state = "overworld"
+            state.current_enemy = None
+            state.pizzas.clear()
+            events.append(("defeat", reward))
+            return
+
+    state.combat_message_timer = max(0.0, state.combat_message_timer - dt)
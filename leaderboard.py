@@ -0,0 +1,158 @@
+"""Slice City leaderboard: every finished run in a local SQLite file.
+
+``submit`` only puts the result on a bounded queue; a background thread
+takes whatever has piled up and inserts it in one transaction, so the
+frame loop never waits on the disk. Results not yet in the file are merged
+into ``top`` from memory, which makes a run show up on its own end screen
+before it is written. The lock shared with the frame loop only ever
+guards that in-memory list: the writer commits without it, and each
+pending result remembers the row id it was committed under, so ``top``
+(which reads in one snapshot together with the highest row id) counts it
+either from the file or from memory, never both. ``top`` walks an index on (pepperonis, time left),
+or on (map seed, pepperonis, time left) for one city, and stops after K
+rows, so it costs the same with a hundred stored runs or millions.
+
+Browsers have no threads: there ``Leaderboard(path, threaded=False)``
+writes from ``pump``, which the game calls once per frame.
+"""
+import collections
+import queue
+import sqlite3
+import threading
+import time
+
+WRITE_QUEUE_SIZE = 256  # results waiting for the writer before new ones are dropped
+WRITE_BATCH = 64  # most results per transaction
+
+RunResult = collections.namedtuple("RunResult", "pepperonis time_left deliveries health map_seed victory")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    pepperonis INTEGER NOT NULL,
+    time_left REAL NOT NULL,
+    deliveries INTEGER NOT NULL,
+    health INTEGER NOT NULL,
+    map_seed INTEGER NOT NULL,
+    victory INTEGER NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_score ON runs (pepperonis DESC, time_left DESC);
+CREATE INDEX IF NOT EXISTS runs_by_seed ON runs (map_seed, pepperonis DESC, time_left DESC);
+"""
+COLUMNS = "pepperonis, time_left, deliveries, health, map_seed, victory"
+INSERT = f"INSERT INTO runs ({COLUMNS}, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)"
+TOP = f"SELECT {COLUMNS} FROM runs ORDER BY pepperonis DESC, time_left DESC LIMIT ?"
+TOP_FOR_SEED = f"SELECT {COLUMNS} FROM runs WHERE map_seed = ? ORDER BY pepperonis DESC, time_left DESC LIMIT ?"
+LAST_ID = "SELECT coalesce(max(id), 0) FROM runs"
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # Readers keep going while the writer commits; falls back quietly where WAL is unavailable
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def score_key(result):
+    return (result.pepperonis, result.time_left)
+
+class Leaderboard:
+    def __init__(self, path, threaded=True, queue_size=WRITE_QUEUE_SIZE):
+        self.path = path
+        self.queue = queue.Queue(queue_size)
+        self.pending = []  # [result, row id once committed], until top has seen the row; guarded by lock
+        self.lock = threading.Lock()
+        self.reader = connect(path)
+        self.writer_conn = None if threaded else self.reader
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self.write_loop, name="leaderboard-writer", daemon=True)
+            self.thread.start()
+
+    def submit(self, result):
+        """Queue ``result`` for writing; never blocks. Returns False when the queue is full and it was dropped."""
+        entry = [result, None]
+        with self.lock:
+            self.pending.append(entry)
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self.lock:
+                self.pending.remove(entry)
+            print("[WARNING] Leaderboard write queue is full, dropping a result")
+            return False
+        return True
+
+    def top(self, k=10, map_seed=None):
+        """Best ``k`` results as ``RunResult``s, best first, optionally only for one city."""
+        # One read transaction, so the rows and the last id come from the same snapshot
+        self.reader.execute("BEGIN")
+        try:
+            if map_seed is None:
+                rows = self.reader.execute(TOP, (k,)).fetchall()
+            else:
+                rows = self.reader.execute(TOP_FOR_SEED, (map_seed, k)).fetchall()
+            last_id = self.reader.execute(LAST_ID).fetchone()[0]
+        finally:
+            self.reader.execute("COMMIT")
+        with self.lock:
+            # Rows up to last_id are in every later snapshot too, so their entries can go
+            self.pending = [e for e in self.pending if e[1] is None or e[1] > last_id]
+            pending = [result for result, _ in self.pending if map_seed is None or result.map_seed == map_seed]
+        results = [RunResult(*row[:5], bool(row[5])) for row in rows] + pending
+        results.sort(key=score_key, reverse=True)
+        return results[:k]
+
+    def write(self, batch):
+        """Commit ``batch`` of pending entries; the frame loop's lock is only taken to record the row ids."""
+        now = time.time()
+        try:
+            with self.writer_conn:
+                ids = [self.writer_conn.execute(INSERT, (*result, now)).lastrowid for result, _ in batch]
+                # Before the commit: no snapshot can hold these ids until it lands
+                with self.lock:
+                    for entry, row_id in zip(batch, ids):
+                        entry[1] = row_id
+        except sqlite3.Error as e:
+            print(f"[ERROR] Could not save {len(batch)} leaderboard results: {e}")
+            with self.lock:
+                self.pending = [p for p in self.pending if all(p is not entry for entry in batch)]
+
+    def drain(self, batch):
+        """Add queued items to ``batch`` without waiting, up to ``WRITE_BATCH``."""
+        while len(batch) < WRITE_BATCH:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write_loop(self):
+        self.writer_conn = connect(self.path)
+        while True:
+            batch = self.drain([self.queue.get()])  # None asks the writer to stop
+            stop = None in batch
+            batch = [result for result in batch if result is not None]
+            if batch:
+                self.write(batch)
+            if stop:
+                break
+        self.writer_conn.close()
+
+    def pump(self):
+        """Without a writer thread, commit what is queued; with one, nothing to do."""
+        if self.thread is None:
+            batch = self.drain([])
+            if batch:
+                self.write(batch)
+
+    def close(self):
+        """Write everything still queued, then close the file."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+        else:
+            while not self.queue.empty():
+                self.pump()
+        self.reader.close()
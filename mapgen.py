@@ -0,0 +1,243 @@
+"""Seeded city map generation on NumPy arrays.
+
+``generate_map`` scatters buildings at random, then makes sure the
+pizzeria, every customer and every time booster sit in one connected
+street network, carving a street through the buildings for any that do
+not. Tiles use the game's codes: 0 street, 1 building, 2 pizzeria,
+3 customer. ``distance_field`` / ``flow_field`` give routes toward one
+tile over the streets and ``repair_fields`` patches them after edits.
+
+    python mapgen.py --check-repair 200   # repaired fields vs a full recompute after random edits
+"""
+import argparse
+import heapq
+import sys
+
+import numpy as np
+
+STREET, BUILDING, PIZZERIA, CUSTOMER = 0, 1, 2, 3
+
+def label_components(open_mask):
+    """Label 4-connected regions of ``open_mask``; blocked tiles get -1.
+
+    Each horizontal run of open tiles is one node from the start (a cumsum
+    over run starts), so only vertical contacts between runs are edges.
+    Those are joined with vectorised hook-and-compress (Shiloach-Vishkin
+    style): every round, each edge still joining two different trees hooks
+    the larger root under the smaller one, then pointer jumping flattens
+    the forest. Rounds grow logarithmically with the map, not with the
+    length of its streets.
+    """
+    starts = open_mask.copy()
+    starts[:, 1:] &= ~open_mask[:, :-1]
+    run = np.cumsum(starts, axis=None, dtype=np.int32).reshape(open_mask.shape) - 1
+    down = open_mask[:-1, :] & open_mask[1:, :]
+    u = run[:-1, :][down]
+    v = run[1:, :][down]
+    # Neighbouring columns usually repeat the same pair of runs
+    fresh = np.ones(len(u), dtype=bool)
+    fresh[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    u, v = u[fresh], v[fresh]
+    parent = np.arange(int(starts.sum()), dtype=np.int32)
+
+    while len(u):
+        pu = parent[u]
+        pv = parent[v]
+        joined = pu != pv
+        # Edges inside one tree stay that way, so they never need looking at again
+        u, v, pu, pv = u[joined], v[joined], pu[joined], pv[joined]
+        if not len(u):
+            break
+        np.minimum.at(parent, np.maximum(pu, pv), np.minimum(pu, pv))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    labels = np.full(open_mask.shape, -1, dtype=np.int32)
+    labels[open_mask] = parent[run[open_mask]]
+    return labels
+
+def carve_street(grid, start, end):
+    """Clear buildings along an L-shaped path: across from ``start``, then down/up to ``end``."""
+    (x0, y0), (x1, y1) = start, end
+    row = grid[y0, min(x0, x1):max(x0, x1) + 1]
+    row[row == BUILDING] = STREET
+    column = grid[min(y0, y1):max(y0, y1) + 1, x1]
+    column[column == BUILDING] = STREET
+
+def generate_map(seed, width, height, pizzeria, customers, boosters=(), density=0.45):
+    """Build a ``height`` x ``width`` uint8 map in which every important tile is reachable."""
+    rng = np.random.default_rng(seed)
+    grid = (rng.random((height, width), dtype=np.float32) < density).astype(np.uint8)
+
+    keep_clear = [pizzeria, *customers, *boosters]
+    xs = np.array([x for x, _ in keep_clear])
+    ys = np.array([y for _, y in keep_clear])
+    grid[ys, xs] = STREET
+    grid[pizzeria[1], pizzeria[0]] = PIZZERIA
+    for cx, cy in customers:
+        grid[cy, cx] = CUSTOMER
+
+    labels = label_components(grid != BUILDING)
+    home = labels[pizzeria[1], pizzeria[0]]
+    cut_off = [tile for tile, label in zip(keep_clear, labels[ys, xs]) if label != home]
+    for tile in cut_off:
+        carve_street(grid, tile, pizzeria)
+    return grid
+
+def reachable_from(grid, tile):
+    """Boolean mask of the tiles connected to ``tile`` through non-building tiles."""
+    labels = label_components(grid != BUILDING)
+    return labels == labels[tile[1], tile[0]]
+
+# ==========================
+# DISTANCE AND FLOW FIELDS
+# ==========================
+DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+NO_STEP = 255  # flow value at the target itself and wherever it cannot be reached
+FAR = np.iinfo(np.int32).max // 2  # distance of tiles that cannot reach the target
+
+def distance_field(grid, target):
+    """Steps from every non-building tile to ``target`` along the streets; ``FAR`` where cut off.
+
+    A breadth-first search whose frontier is an index array, so each ring
+    is a handful of vectorised operations and the whole field costs one
+    pass over the reachable tiles.
+    """
+    h, w = grid.shape
+    open_flat = (grid != BUILDING).ravel()
+    dist = np.full(h * w, FAR, dtype=np.int32)
+    frontier = np.array([target[1] * w + target[0]])
+    dist[frontier] = 0
+    d = 0
+    while len(frontier):
+        d += 1
+        x = frontier % w
+        nbrs = np.concatenate((frontier[x < w - 1] + 1, frontier[x > 0] - 1,
+                               frontier[frontier >= w] - w, frontier[frontier < (h - 1) * w] + w))
+        nbrs = np.unique(nbrs[open_flat[nbrs] & (dist[nbrs] == FAR)])
+        dist[nbrs] = d
+        frontier = nbrs
+    return dist.reshape(h, w)
+
+def flow_field(dist, rect=None):
+    """Index into ``DIRECTIONS`` of the neighbour one step closer to the target, per tile.
+
+    With ``rect`` = (x0, y0, x1, y1), exclusive ends, only that block is
+    computed; the result then covers just the block.
+    """
+    h, w = dist.shape
+    x0, y0, x1, y1 = rect or (0, 0, w, h)
+    padded = np.full((h + 2, w + 2), FAR, dtype=np.int32)
+    padded[1:-1, 1:-1] = dist
+    block = padded[y0 + 1:y1 + 1, x0 + 1:x1 + 1]
+    neighbours = np.stack([padded[y0 + 1 + dy:y1 + 1 + dy, x0 + 1 + dx:x1 + 1 + dx] for dx, dy in DIRECTIONS])
+    flow = np.argmin(neighbours, axis=0).astype(np.uint8)
+    stuck = (block == 0) | (block >= FAR) | (neighbours.min(axis=0) != block - 1)
+    flow[stuck] = NO_STEP
+    return flow
+
+def repair_fields(grid, dist, flow, changed):
+    """Bring ``dist`` and ``flow`` (updated in place) up to date after the tiles in ``changed`` changed.
+
+    Only tiles whose route ran through a changed tile are reset; they and
+    anything a newly opened tile brings closer are relaxed outward from
+    the intact tiles around them, so the work is proportional to the
+    region that actually moved. Returns that region as (x0, y0, x1, y1).
+    """
+    h, w = grid.shape
+    # Everything whose route passed through a changed tile: walk the flow tree backwards
+    affected = set(changed)
+    stack = list(changed)
+    while stack:
+        x, y = stack.pop()
+        for i, (dx, dy) in enumerate(DIRECTIONS):
+            nx, ny = x - dx, y - dy
+            if 0 <= nx < w and 0 <= ny < h and (nx, ny) not in affected and flow[ny, nx] == i:
+                affected.add((nx, ny))
+                stack.append((nx, ny))
+    targets = [(x, y) for x, y in affected if dist[y, x] == 0 and grid[y, x] != BUILDING]
+    for x, y in affected:
+        dist[y, x] = FAR
+    queue = []
+    for x, y in targets:
+        dist[y, x] = 0
+        queue.append((0, x, y))
+    for x, y in affected:
+        if grid[y, x] == BUILDING or dist[y, x] == 0:
+            continue
+        best = FAR
+        for dx, dy in DIRECTIONS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < w and 0 <= ny < h and grid[ny, nx] != BUILDING and (nx, ny) not in affected:
+                best = min(best, int(dist[ny, nx]) + 1)
+        if best < FAR:
+            dist[y, x] = best
+            queue.append((best, x, y))
+    heapq.heapify(queue)
+
+    touched = set(affected)
+    while queue:
+        d, x, y = heapq.heappop(queue)
+        if d > dist[y, x]:
+            continue
+        for dx, dy in DIRECTIONS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < w and 0 <= ny < h and grid[ny, nx] != BUILDING and dist[ny, nx] > d + 1:
+                dist[ny, nx] = d + 1
+                touched.add((nx, ny))
+                heapq.heappush(queue, (d + 1, nx, ny))
+
+    xs = [x for x, _ in touched]
+    ys = [y for _, y in touched]
+    # Flow also changes for the neighbours of every tile whose distance moved
+    rect = (max(min(xs) - 1, 0), max(min(ys) - 1, 0), min(max(xs) + 2, w), min(max(ys) + 2, h))
+    x0, y0, x1, y1 = rect
+    flow[y0:y1, x0:x1] = flow_field(dist, rect)
+    return rect
+
+# ==========================
+# REPAIR CHECK - PATCHED FIELDS MUST MATCH FIELDS BUILT FROM SCRATCH
+# ==========================
+def check_repair(maps, seed=0, width=40, height=30, rounds=6, max_edits=8):
+    """Flip random tiles between street and building on ``maps`` random maps, repairing after
+    each round; returns (rounds whose fields differ from a full recompute, rounds played)."""
+    rng = np.random.default_rng(seed)
+    mismatches = played = 0
+    for _ in range(maps):
+        grid = generate_map(int(rng.integers(2 ** 32)), width, height, (1, 1), [])
+        open_ys, open_xs = (grid != BUILDING).nonzero()
+        pick = int(rng.integers(len(open_xs)))
+        target = (int(open_xs[pick]), int(open_ys[pick]))
+        dist = distance_field(grid, target)
+        flow = flow_field(dist)
+        for _ in range(rounds):
+            changed = set()
+            for _ in range(int(rng.integers(1, max_edits + 1))):
+                x, y = int(rng.integers(width)), int(rng.integers(height))
+                if (x, y) != target and grid[y, x] in (STREET, BUILDING):
+                    grid[y, x] = BUILDING - grid[y, x]
+                    changed.add((x, y))
+            if not changed:
+                continue
+            repair_fields(grid, dist, flow, list(changed))
+            played += 1
+            full = distance_field(grid, target)
+            if not (np.array_equal(dist, full) and np.array_equal(flow, flow_field(full))):
+                mismatches += 1
+                dist, flow = full, flow_field(full)
+    return mismatches, played
+
+def main():
+    parser = argparse.ArgumentParser(description="Self-checks for Slice City map generation and routing.")
+    parser.add_argument("--check-repair", type=int, default=200, metavar="MAPS",
+                        help="random maps to edit and repair, comparing with full recomputes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    mismatches, played = check_repair(args.check_repair, args.seed)
+    print(f"repair_fields: {mismatches} of {played} edit rounds on {args.check_repair} maps differ from a full recompute")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
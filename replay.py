@@ -0,0 +1,119 @@
+"""Slice City session recording and replay.
+
+A session is the seed its ``GameState`` started from plus every action
+the player produced, each stamped with the fixed simulation tick it was
+applied before. Since ``game_core`` rolls only from seeded streams and
+always steps ``SIM_DT``, that is enough to play the session back exactly,
+at any speed and with or without a display.
+
+Files are little-endian struct records, no text:
+
+    header  4s magic "SCRP", H version, H SIM_HZ, Q seed
+    input   I tick, B action           (one per action, ticks ascending)
+    end     I tick, B 255              (the tick the session stopped at)
+
+Record a session with ``SLICE_CITY_RECORD=session.scr python slice_city.py``, then:
+
+    python replay.py session.scr                  # headless, as fast as game_core runs
+    python replay.py sessions/*.scr --render --trace replay_trace.json
+"""
+import argparse
+import struct
+import sys
+import time
+
+import game_core as core
+
+MAGIC = b"SCRP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQ")
+RECORD = struct.Struct("<IB")
+END = 255
+
+class Recording:
+    def __init__(self, seed, inputs=None, ticks=0):
+        self.seed = seed
+        self.inputs = inputs if inputs is not None else []  # (tick, action), in the order applied
+        self.ticks = ticks
+
+    def record(self, tick, action):
+        self.inputs.append((tick, action))
+
+    def save(self, path):
+        body = [HEADER.pack(MAGIC, VERSION, core.SIM_HZ, self.seed)]
+        body += [RECORD.pack(tick, action) for tick, action in self.inputs]
+        body.append(RECORD.pack(self.ticks, END))
+        with open(path, "wb") as f:
+            f.write(b"".join(body))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, sim_hz, seed = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} Slice City recording")
+        if sim_hz != core.SIM_HZ:
+            raise ValueError(f"{path} was recorded at {sim_hz} Hz, the rules now step at {core.SIM_HZ} Hz")
+        records = list(RECORD.iter_unpack(data[HEADER.size:]))
+        if not records or records[-1][1] != END:
+            raise ValueError(f"{path} is truncated")
+        return cls(seed, records[:-1], records[-1][0])
+
+def replay(recording, state=None, on_events=None, on_tick=None):
+    """Play ``recording`` through ``game_core`` without waiting on any clock; returns the final state.
+
+    ``on_events(events)`` sees the events of every step and ``on_tick(tick)``
+    runs after every ``TICK``, which is where a front end draws.
+    """
+    state = state or core.GameState(recording.seed)
+    inputs = recording.inputs
+    i = 0
+    for tick in range(recording.ticks + 1):
+        while i < len(inputs) and inputs[i][0] == tick:
+            events = core.step(state, inputs[i][1])
+            if on_events:
+                on_events(events)
+            i += 1
+        if tick == recording.ticks:
+            break
+        events = core.step(state, core.TICK, core.SIM_DT)
+        if on_events:
+            on_events(events)
+        if on_tick:
+            on_tick(tick)
+    return state
+
+def summary(state):
+    return (f"{state.state:<9} deliveries {state.deliveries_made}  pepperonis {state.player.pepperonis:4d}"
+            f"  health {state.player.health:4d}  clock {state.elapsed:6.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Slice City sessions.")
+    parser.add_argument("paths", nargs="+", help="recordings written with SLICE_CITY_RECORD")
+    parser.add_argument("--render", action="store_true", help="draw every tick through slice_city (uncapped)")
+    parser.add_argument("--trace", help="with --render, write the frame profiler buffer here as a Chrome trace")
+    args = parser.parse_args()
+
+    if args.render:
+        import slice_city as game
+        game.load_assets()
+
+    total_ticks = 0
+    start = time.perf_counter()
+    for path in args.paths:
+        recording = Recording.load(path)
+        if args.render:
+            state = game.replay_session(recording)
+        else:
+            state = replay(recording)
+        total_ticks += recording.ticks
+        print(f"{path}: {recording.ticks} ticks, {len(recording.inputs)} inputs -> {summary(state)}")
+    elapsed = time.perf_counter() - start
+    print(f"{len(args.paths)} sessions, {total_ticks} ticks in {elapsed:.2f}s ({total_ticks / elapsed:,.0f} ticks/s)")
+
+    if args.render and args.trace:
+        game.profiler.write_trace(args.trace)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""Slice City multi-session server: many independent runs in one asyncio process.
+
+Every connection gets its own ``game_core.GameState``, so nothing is
+shared between players but the process. The server loop is the same
+fixed-timestep accumulator as ``slice_city.main``: each server frame runs
+every tick that is due for all sessions together, then sends each client
+one message with only what changed since its last one, so a booth full
+of stations costs one loop and one write per station per frame.
+
+Wire format, little-endian. Clients send raw action bytes (``game_core``
+action ids, one byte each; ``TICK`` is ignored). The server sends
+messages of ``I length, B type`` followed by ``length`` payload bytes:
+
+    map    B "M"  I session, Q seed, I map seed, H width, H height,
+                  I roamers, I rivals, B kind per roamer, B tile per map cell
+    frame  B "F"  I tick, H changed-field mask, i per changed field (FIELDS order),
+                  I moved actors, (I actor, H x, H y) each,
+                  I events, (B kind, i value) each
+
+A map message comes first and again whenever the run restarts on a new
+city; the frame after it carries every field. Actors are the roamers
+followed by the rivals; roamers grow with the map's area, so their
+counts and ids are 32-bit. Event values are a tile as ``y * width + x``, an
+enemy or game-over cause as an index into ``EVENT_NAMES``, seconds as
+milliseconds, otherwise the number itself.
+
+    python server.py                                 # port 8765, 20 frames per second
+    python server.py --port 9000 --send-hz 30 --record-dir sessions
+"""
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+
+import game_core as core
+from replay import Recording
+
+DEFAULT_PORT = 8765
+SEND_HZ = 20  # server frames (and messages per client) per second; the rules still step at SIM_HZ
+MAX_FRAME_TIME = 0.25  # a longer stall is dropped, as in slice_city
+MAX_CLIENT_BUFFER = 1 << 20  # bytes queued for one client before it is dropped as stuck
+MAX_INPUTS = 32  # action bytes a session takes per server frame; the rest waits in the socket
+STATS_SECONDS = 10
+
+STATES = ("intro", "overworld", "combat", "shop", "victory", "gameover")
+FIELDS = ("state", "player_x", "player_y", "health", "max_health", "pepperonis", "deliveries",
+          "time_left_cs", "enemy", "enemy_health", "pizzas", "delivered", "boosters")
+EVENT_KINDS = ("start", "restart", "deliver", "time_boost", "stolen", "encounter", "damage", "hit",
+               "defeat", "throw", "run", "buy", "victory", "gameover")
+EVENT_NAMES = [template["name"] for template in core.enemy_templates.values()] + ["time", "health"]
+ENEMY_KINDS = list(core.enemy_templates)
+
+HEADER = struct.Struct("<IB")
+MAP_HEADER = struct.Struct("<IQIHHII")
+FRAME_HEADER = struct.Struct("<IH")
+MOVE = struct.Struct("<IHH")
+EVENT = struct.Struct("<Bi")
+
+# ==========================
+# STATE ENCODING
+# ==========================
+def snapshot(state):
+    """The values of ``FIELDS`` for ``state``, all ints."""
+    player = state.player
+    enemy = state.current_enemy
+    delivered = sum(1 << i for i, tile in enumerate(core.customer_positions) if tile in state.delivered_customers)
+    boosters = sum(1 << i for i, active in enumerate(state.time_boosters_active) if active)
+    return (STATES.index(state.state), player.x, player.y, player.health, player.max_health, player.pepperonis,
+            state.deliveries_made, round(core.time_remaining(state) * 100),
+            EVENT_NAMES.index(enemy.name) if enemy else -1, enemy.health if enemy else 0,
+            len(state.pizzas), delivered, boosters)
+
+def actor_tiles(state):
+    rivals = state.rivals
+    return list(zip(state.roamers.xs, state.roamers.ys)) + list(zip(rivals.xs.tolist(), rivals.ys.tolist()))
+
+def event_value(value):
+    if value is None:
+        return 0
+    if isinstance(value, tuple):
+        return value[1] * core.MAP_WIDTH + value[0]
+    if isinstance(value, str):
+        return EVENT_NAMES.index(value)
+    if isinstance(value, float):
+        return round(value * 1000)
+    return int(value)
+
+def message(kind, payload):
+    return HEADER.pack(len(payload), kind) + payload
+
+def encode_map(session_id, state):
+    roamers = state.roamers
+    payload = MAP_HEADER.pack(session_id, state.seed, state.map_seed, core.MAP_WIDTH, core.MAP_HEIGHT,
+                              len(roamers), len(state.rivals))
+    kinds = bytes(ENEMY_KINDS.index(kind) for kind in roamers.kinds)
+    return message(ord("M"), payload + kinds + state.game_map.tobytes())
+
+def encode_frame(tick, fields, old_fields, actors, old_actors, events):
+    """A frame message with what differs from ``old_*`` (``None`` sends everything), or None when nothing does."""
+    mask = 0
+    values = []
+    for i, value in enumerate(fields):
+        if old_fields is None or value != old_fields[i]:
+            mask |= 1 << i
+            values.append(value)
+    moved = [(i, x, y) for i, (x, y) in enumerate(actors) if old_actors is None or old_actors[i] != (x, y)]
+    coded = [(EVENT_KINDS.index(kind), event_value(value)) for kind, value in events if kind in EVENT_KINDS]
+    if not mask and not moved and not coded:
+        return None
+    body = [FRAME_HEADER.pack(tick, mask), struct.pack(f"<{len(values)}i", *values), struct.pack("<I", len(moved))]
+    body += [MOVE.pack(*move) for move in moved]
+    body.append(struct.pack("<I", len(coded)))
+    body += [EVENT.pack(*event) for event in coded]
+    return message(ord("F"), b"".join(body))
+
+# ==========================
+# SESSIONS
+# ==========================
+class Session:
+    __slots__ = ("id", "state", "writer", "inputs", "ticks", "events", "sent_fields", "sent_actors",
+                 "sent_map", "recording")
+
+    def __init__(self, session_id, state, writer, record):
+        self.id = session_id
+        self.state = state
+        self.writer = writer
+        self.inputs = bytearray()  # actions received since the last tick
+        self.ticks = 0
+        self.events = []  # produced since the last message
+        self.sent_fields = None
+        self.sent_actors = None
+        self.sent_map = None
+        self.recording = Recording(self.state.seed) if record else None
+
+    def advance(self):
+        """Apply the queued inputs, then one ``SIM_DT`` tick, exactly as the local game does."""
+        state = self.state
+        for action in self.inputs:
+            if action == core.TICK or action > core.RESTART:
+                continue
+            if self.recording:
+                self.recording.record(self.ticks, action)
+            self.events += core.step(state, action)
+        self.inputs.clear()
+        self.events += core.step(state, core.TICK, core.SIM_DT)
+        self.ticks += 1
+
+    def delta(self):
+        """Bytes to bring the client up to date, possibly empty."""
+        state = self.state
+        out = b""
+        if state.map_seed != self.sent_map:
+            out += encode_map(self.id, state)
+            self.sent_map = state.map_seed
+            self.sent_fields = self.sent_actors = None
+        fields = snapshot(state)
+        actors = actor_tiles(state)
+        frame = encode_frame(self.ticks, fields, self.sent_fields, actors, self.sent_actors, self.events)
+        self.events.clear()
+        if frame:
+            out += frame
+            self.sent_fields, self.sent_actors = fields, actors
+        return out
+
+class Server:
+    def __init__(self, seed=None, send_hz=SEND_HZ, record_dir=None):
+        self.seed = seed
+        self.send_hz = send_hz
+        self.record_dir = record_dir
+        self.sessions = {}
+        self.next_id = 0
+        self.frames = 0
+        self.tick_seconds = 0.0
+
+    async def handle(self, reader, writer):
+        session_id = self.next_id
+        self.next_id += 1
+        seed = None if self.seed is None else self.seed + session_id
+        # Generating a city takes long enough on a big map to stall every other session
+        state = await asyncio.get_running_loop().run_in_executor(None, core.GameState, seed)
+        session = Session(session_id, state, writer, self.record_dir is not None)
+        self.sessions[session_id] = session
+        try:
+            while True:
+                room = MAX_INPUTS - len(session.inputs)
+                if room <= 0:
+                    # Unread input stays in the socket, so a flooding client only slows itself
+                    await asyncio.sleep(1.0 / self.send_hz)
+                    continue
+                data = await reader.read(room)
+                if not data:
+                    break
+                session.inputs += data
+        except ConnectionError:
+            pass
+        finally:
+            self.close(session)
+
+    def close(self, session):
+        if self.sessions.pop(session.id, None) is None:
+            return
+        session.writer.close()
+        if session.recording:
+            session.recording.ticks = session.ticks
+            path = os.path.join(self.record_dir, f"session-{session.id}-{session.state.seed}.scr")
+            try:
+                session.recording.save(path)
+            except OSError as e:
+                print(f"[WARNING] Could not save recording {path}: {e}")
+
+    def fail(self, session, doing, error):
+        """Drop one session whose rules or encoding raised; every other session carries on."""
+        print(f"[ERROR] Session {session.id} failed while {doing}, dropping it: {error!r}")
+        self.close(session)
+
+    def frame(self, ticks):
+        """Run ``ticks`` ticks of every session, then send every client its delta."""
+        start = time.perf_counter()
+        sessions = list(self.sessions.values())
+        for _ in range(ticks):
+            for session in sessions:
+                try:
+                    session.advance()
+                except Exception as e:
+                    self.fail(session, "stepping", e)
+            sessions = [session for session in sessions if session.id in self.sessions]
+        self.tick_seconds += time.perf_counter() - start
+        for session in sessions:
+            try:
+                out = session.delta()
+            except Exception as e:
+                self.fail(session, "encoding", e)
+                continue
+            if not out:
+                continue
+            if session.writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                print(f"[WARNING] Session {session.id} is not reading, dropping it")
+                self.close(session)
+                continue
+            session.writer.write(out)
+
+    async def run(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"[SERVER] listening on {host}:{port}, {core.SIM_HZ} Hz rules, {self.send_hz} frames/s")
+        frame_time = 1.0 / self.send_hz
+        accumulator = 0.0
+        last_time = time.perf_counter()
+        next_stats = last_time + STATS_SECONDS
+        async with server:
+            while True:
+                now = time.perf_counter()
+                accumulator += min(now - last_time, MAX_FRAME_TIME)
+                last_time = now
+                ticks = int(accumulator / core.SIM_DT)
+                accumulator -= ticks * core.SIM_DT
+                self.frame(ticks)
+                self.frames += 1
+                if now >= next_stats:
+                    self.print_stats()
+                    next_stats = now + STATS_SECONDS
+                await asyncio.sleep(max(0.0, frame_time - (time.perf_counter() - now)))
+
+    def print_stats(self):
+        frames = max(1, self.frames)
+        print(f"[SERVER] {len(self.sessions)} sessions, {self.tick_seconds / frames * 1000:.2f} ms of rules per frame")
+        self.frames = 0
+        self.tick_seconds = 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many Slice City sessions in one process.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--send-hz", type=int, default=SEND_HZ, help="server frames per second")
+    parser.add_argument("--seed", type=int, help="session n plays seed + n (default: random seeds)")
+    parser.add_argument("--record-dir", help="save every session here as a replay.py recording when it ends")
+    args = parser.parse_args()
+
+    if max(core.MAP_WIDTH, core.MAP_HEIGHT) > 0xFFFF:
+        print(f"[ERROR] The wire format holds map sides up to 65535 tiles, not {core.MAP_WIDTH}x{core.MAP_HEIGHT}")
+        return 1
+    if args.record_dir:
+        os.makedirs(args.record_dir, exist_ok=True)
+    server = Server(args.seed, args.send_hz, args.record_dir)
+    try:
+        asyncio.run(server.run(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
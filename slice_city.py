@@ -5,22 +5,64 @@ import os
 import time
 import math
 import asyncio  # Required for pygbag browser compatibility
-
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import sqlite3
+import struct
+import threading
+
+import numpy as np
+
+from game_core import (
+    TILE_SIZE, MAP_WIDTH, MAP_HEIGHT, time_booster_positions,
+    deliveries_needed, health_replenish_cost, GameState, time_remaining, step, SIM_DT, PIZZA_SPIN, enemy_templates,
+    RIVAL_STEAL_SECONDS, PIZZA_START, PIZZA_HIT_X,
+    upcoming_run, build_run, add_prepared_run, run_is_prepared, PREPARED_RUNS, Player, player_tile,
+    TICK, START, TOGGLE_INSTRUCTIONS, MOVE_LEFT, MOVE_RIGHT, MOVE_UP, MOVE_DOWN,
+    THROW, RUN, OPEN_SHOP, CLOSE_SHOP, BUY, RESTART,
+)
+import mapgen
+from leaderboard import Leaderboard, RunResult
+from telemetry import Telemetry
+from replay import Recording, replay
+
+# Every Sound is converted to this format once, when it is loaded
+pygame.mixer.pre_init(44100, -16, 2, 512)
 pygame.init()
 
 # ==========================
 # EXTENSIVE CONSTANTS & GAME SETTINGS - DETAILED AND EXPANDED FOR CLARITY AND FLEXIBILITY
 # ==========================
+# The logical canvas every draw function works in, whatever the window size
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
-TILE_SIZE = 40
-MAP_WIDTH = 20
-MAP_HEIGHT = 15
 
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+# SLICE_CITY_WINDOW=1920x1080 or SLICE_CITY_FULLSCREEN=1 shows the canvas scaled up (see PRESENTATION)
+WINDOW_SIZE = os.environ.get("SLICE_CITY_WINDOW")
+FULLSCREEN = os.environ.get("SLICE_CITY_FULLSCREEN") == "1"
+
+if FULLSCREEN:
+    window = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+elif WINDOW_SIZE:
+    window = pygame.display.set_mode(tuple(int(n) for n in WINDOW_SIZE.split("x")), pygame.RESIZABLE)
+else:
+    window = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+# At the native size the game draws straight into the window, as it always has
+screen = window if window.get_size() == (SCREEN_WIDTH, SCREEN_HEIGHT) and not WINDOW_SIZE else \
+    pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
 pygame.display.set_caption("Slice City - Extreme Night Shift Rush!")
 clock = pygame.time.Clock()
 
+# Redraw cap in frames per second (0 = uncapped); the rules always step at game_core.SIM_HZ
+RENDER_FPS = int(os.environ.get("SLICE_CITY_FPS", "60"))
+# A longer stall (tab in the background, a breakpoint) is dropped instead of replayed
+MAX_FRAME_TIME = 0.25
+# How far between the last two simulation steps the current frame is drawn, 0..1
+render_alpha = 1.0
+
 # Comprehensive color palette for all visual elements, effects, and states
 RED = (255, 0, 0)
 PIZZA_ORANGE = (255, 100, 0)
@@ -67,205 +109,1266 @@ prompt_font = pygame.font.Font(None, 52)
 # ==========================
 # ASSET LOADING WITH ROBUST ERROR HANDLING AND FALLBACKS
 # ==========================
-def load_image(path, scale=None):
-    full_path = "assets/" + path
-    if os.path.exists(full_path):
+ASSET_DIRS = ("assets", ".")  # the OGGs and time_boost.png only ship at the project root
+ASSET_CACHE_DIR = ".asset_cache"
+ASSET_CACHE_MAGIC = b"SCIMG1"
+ASSET_BUNDLE_PATH = "slice_city.bundle"  # written by build_bundle.py; loose files are the fallback
+ASSET_BUNDLE_MAGIC = b"SCBNDL"
+ASSET_BUNDLE_VERSION = 1
+ASSET_BUNDLE_URL = ASSET_BUNDLE_PATH  # relative to the page; build_bundle.py --web serves it beside index.html
+BUNDLE_FETCH_BYTES = 512 * 1024  # bytes per HTTP range request while the bundle streams in
+BUNDLE_POLL_SECONDS = 0.02
+# Resident decoded images, in MB; past it the least recently drawn ones are dropped and reloaded when next needed
+TEXTURE_BUDGET_BYTES = int(float(os.environ.get("SLICE_CITY_TEXTURE_BUDGET", "8")) * 1024 * 1024)
+COLORKEY_CANDIDATES = ((255, 0, 255), (0, 255, 0), (1, 2, 3))  # first one no visible pixel uses
+IS_BROWSER = sys.platform == "emscripten"  # pygbag: no worker threads, in-memory filesystem
+
+class AssetBundle:
+    """Read-only view of a bundle file: every asset's bytes in one file, found through a table of contents.
+
+    Layout, little-endian: 6s magic, H version, I entry count; then per
+    entry H name length, the UTF-8 name, Q offset, Q size; then the data.
+    Offsets are from the start of the file, so ``read`` is one seek.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.lock = threading.Lock()  # worker threads share the one file handle
+        magic, version, count = struct.unpack("<6sHI", self.file.read(12))
+        if magic != ASSET_BUNDLE_MAGIC or version != ASSET_BUNDLE_VERSION:
+            self.file.close()
+            raise ValueError(f"{path} is not a version {ASSET_BUNDLE_VERSION} asset bundle")
+        self.entries = {}
+        try:
+            for _ in range(count):
+                (name_length,) = struct.unpack("<H", self.file.read(2))
+                name = self.file.read(name_length).decode("utf-8")
+                self.entries[name] = struct.unpack("<QQ", self.file.read(16))
+        except (struct.error, ValueError):
+            self.file.close()
+            raise
+        self.data_start = self.file.tell()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def pending(self, name):
+        """True while ``name``'s bytes have not all reached a file that is still being downloaded."""
+        entry = self.entries.get(name)
+        return entry is not None and entry[0] + entry[1] > os.fstat(self.file.fileno()).st_size
+
+    def total_size(self):
+        return max((offset + size for offset, size in self.entries.values()), default=self.data_start)
+
+    def read(self, name):
+        offset, size = self.entries[name]
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+def write_asset_bundle(path, files):
+    """Pack ``{name: bytes}`` into a bundle at ``path``, data in the order of ``files``."""
+    names = list(files)
+    toc_size = 12 + sum(2 + len(name.encode("utf-8")) + 16 for name in names)
+    toc = [struct.pack("<6sHI", ASSET_BUNDLE_MAGIC, ASSET_BUNDLE_VERSION, len(names))]
+    offset = toc_size
+    for name in names:
+        encoded = name.encode("utf-8")
+        toc.append(struct.pack("<H", len(encoded)) + encoded + struct.pack("<QQ", offset, len(files[name])))
+        offset += len(files[name])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(toc))
+        for name in names:
+            f.write(files[name])
+    os.replace(tmp_path, path)
+
+class BundleDownload:
+    """Streams the web build's bundle into ``path`` front to back, one HTTP range request at a time.
+
+    pygbag's archive has to arrive whole before any Python runs, so the web
+    build serves the bundle beside the page instead. Entries are stored in
+    the order the game loads them, so the title art can be read by offset
+    after the first ranges while the rest is still on its way.
+    ``fetch(url, start, end)`` returns those bytes, or the whole file from a
+    server that ignores ranges.
+    """
+    def __init__(self, url, path, fetch, chunk=BUNDLE_FETCH_BYTES):
+        self.url = url
+        self.path = path
+        self.fetch = fetch
+        self.chunk = chunk
+        self.bundle = None  # an AssetBundle once the table of contents is in
+        self.finished = False
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        try:
+            await self.download()
+        except Exception as e:
+            print(f"[ERROR] Asset bundle download from {self.url} failed: {e}")
+        if self.bundle is None:
+            print(f"[WARNING] No usable asset bundle at {self.url}, using procedural fallbacks")
+        self.finished = True
+
+    async def download(self):
+        received = 0
+        total = None
+        with open(self.path, "wb") as f:
+            while total is None or received < total:
+                end = received + self.chunk if total is None else min(received + self.chunk, total)
+                data = await self.fetch(self.url, received, end)
+                f.write(data)
+                f.flush()
+                received += len(data)
+                if self.bundle is None:
+                    try:
+                        self.bundle = AssetBundle(self.path)
+                        total = self.bundle.total_size()
+                    except (struct.error, ValueError):
+                        pass  # the table of contents has not all arrived yet
+                if received < end:
+                    break  # the file ended early
+
+async def fetch_range(url, start, end):
+    """Bytes ``start``..``end - 1`` of ``url`` through pygbag's JavaScript bridge; browser only."""
+    import platform  # pygbag replaces the standard module with one that reaches the page
+    flags = platform.ffi({"redirect": "follow", "credentials": "omit",
+                          "headers": {"Range": f"bytes={start}-{end - 1}"}})
+    path = await platform.jsiter(platform.window.cross_file(url, f"/tmp/bundle-{start}", flags))
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+def alpha_format(pixels):
+    """How to store RGBA ``pixels``: ("opaque", None), ("colorkey", (pixels, key)) or ("alpha", None).
+
+    Runs on the worker threads. Fully opaque images become plain ``convert``
+    surfaces and images whose pixels are either fully on or fully off become
+    RLE colorkey surfaces; both blit without per-pixel blending.
+    """
+    rgba = np.frombuffer(pixels, dtype=np.uint8).reshape(-1, 4)
+    alpha = rgba[:, 3]
+    if alpha.min() == 255:
+        return "opaque", None
+    hidden = alpha == 0
+    if not np.all(hidden | (alpha == 255)):
+        return "alpha", None
+    shown = rgba[~hidden, :3]
+    for key in COLORKEY_CANDIDATES:
+        if not np.any(np.all(shown == key, axis=1)):
+            keyed = rgba.copy()
+            keyed[hidden] = (*key, 255)
+            return "colorkey", (keyed.tobytes(), key)
+    return "alpha", None
+
+def surface_bytes(surf):
+    return surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+class TextureCache:
+    """Display-format images, least recently used dropped first past ``budget_bytes``.
+
+    Keyed by (path, scale) for assets; ``TextCache`` keys lines by (font,
+    text, colour). ``pinned`` keys (the module-global sprites, which are
+    referenced for the whole run anyway) are counted but never dropped.
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.surfaces = collections.OrderedDict()
+        self.bytes = 0
+        self.pinned = set()
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.surfaces
+
+    def get(self, key):
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+        return surf
+
+    def put(self, key, surf):
+        self.drop(key)
+        self.surfaces[key] = surf
+        self.bytes += surface_bytes(surf)
+        for old_key in list(self.surfaces):
+            if self.bytes <= self.budget_bytes:
+                break
+            if old_key in self.pinned or old_key == key:
+                continue
+            self.drop(old_key)
+            self.evictions += 1
+
+    def drop(self, key):
+        surf = self.surfaces.pop(key, None)
+        if surf is not None:
+            self.bytes -= surface_bytes(surf)
+
+class AssetManager:
+    """Loads every image, sound and music file exactly once.
+
+    Image files are read, decoded, rescaled and sorted into opaque,
+    colorkey or per-pixel alpha on a thread pool; only the conversion to
+    display format runs on the main thread. Rescaled pixels are cached on
+    disk under a hash of the source bytes and target size, so a warm start
+    skips both the PNG decode and the rescale. Decoded images live in a
+    ``TextureCache``: ones that were dropped to stay under the budget are
+    loaded again by the next ``load_image``. Per-asset load times are kept
+    in ``timings`` and printed by ``report``.
+    """
+    def __init__(self, cache_dir=ASSET_CACHE_DIR, workers=4, bundle_path=ASSET_BUNDLE_PATH,
+                 texture_budget=TEXTURE_BUDGET_BYTES):
+        self.cache_dir = None if IS_BROWSER else cache_dir
+        self.workers = 1 if IS_BROWSER else workers
+        self.bundle_path = bundle_path
+        self.bundle = None
+        self.download = None  # a BundleDownload while the bundle streams in
+        if os.path.exists(bundle_path):
+            try:
+                self.bundle = AssetBundle(bundle_path)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"[WARNING] Ignoring asset bundle {bundle_path}: {e}")
+        self.images = TextureCache(texture_budget)
+        self.unavailable = set()  # (path, scale) keys that failed to load; not retried
+        self.formats = {}  # (path, scale) -> "opaque", "colorkey" or "alpha"
+        self.sounds = {}
+        self.music_name = None  # pygame.mixer.music streams one file at a time
+        self.music_buffer = None
+        self.timings = []  # (file, milliseconds, how it was obtained)
+
+    def find(self, path):
+        for folder in ASSET_DIRS:
+            full_path = os.path.join(folder, path)
+            if os.path.exists(full_path):
+                return full_path
+        return None
+
+    def read(self, path):
+        """(bytes, where they came from) for ``path``, from the bundle if it has it; (None, None) if missing."""
+        # An entry still pending after its download stopped is cut short, so it counts as missing
+        if self.bundle and path in self.bundle and not self.bundle.pending(path):
+            return self.bundle.read(path), f"{self.bundle.path}:{path}"
+        full_path = self.find(path)
+        if full_path is None:
+            return None, None
+        with open(full_path, "rb") as f:
+            return f.read(), full_path
+
+    def _cache_file(self, data, scale):
+        digest = hashlib.sha1(data)
+        digest.update(repr(scale).encode())
+        return os.path.join(self.cache_dir, digest.hexdigest() + ".rgba")
+
+    def _decode_image(self, path, scale):
+        """Worker-thread half of an image load: returns ((pixels, size, format, colorkey), source, seconds)."""
+        start = time.perf_counter()
+        full_path = path
         try:
-            img = pygame.image.load(full_path).convert_alpha()
+            data, full_path = self.read(path)
+            if data is None:
+                return None, "missing", time.perf_counter() - start
+            cache_file = self._cache_file(data, scale) if self.cache_dir else None
+            if cache_file and os.path.exists(cache_file):
+                with open(cache_file, "rb") as f:
+                    cached = f.read()
+                if cached[:6] == ASSET_CACHE_MAGIC:
+                    size = struct.unpack_from("<II", cached, 6)
+                    return self._classify(cached[14:], size), "cache", time.perf_counter() - start
+            img = pygame.image.load(io.BytesIO(data), path)
             if scale:
                 img = pygame.transform.scale(img, scale)
-            return img
-        except pygame.error as e:
+            pixels = pygame.image.tobytes(img, "RGBA")
+            if cache_file:
+                self._write_cache(cache_file, pixels, img.get_size())
+            return self._classify(pixels, img.get_size()), "decode", time.perf_counter() - start
+        except (pygame.error, OSError) as e:
             print(f"[ERROR] Failed to load image {full_path}: {e}")
-    print(f"[WARNING] Image not found: {full_path} - using procedural fallback")
-    return None
+            return None, "error", time.perf_counter() - start
 
-def load_sound(path, volume=0.7):
-    full_path = "assets/" + path
-    if os.path.exists(full_path):
-        try:
-            sound = pygame.mixer.Sound(full_path)
-            sound.set_volume(volume)
-            return sound
-        except pygame.error as e:
-            print(f"[ERROR] Failed to load sound {full_path}: {e}")
-    print(f"[WARNING] Sound not found: {full_path} - action will be silent")
-    return None
+    def _classify(self, pixels, size):
+        kind, keyed = alpha_format(pixels)
+        if keyed:
+            pixels, key = keyed
+            return pixels, size, kind, key
+        return pixels, size, kind, None
 
-def load_music(path):
-    full_path = os.path.join("assets", path)
-    if os.path.exists(full_path):
+    def _write_cache(self, cache_file, pixels, size):
         try:
-            pygame.mixer.music.load(full_path)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = cache_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(ASSET_CACHE_MAGIC + struct.pack("<II", *size))
+                f.write(pixels)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print(f"[WARNING] Could not write asset cache {cache_file}: {e}")
+
+    def load_images(self, requests):
+        """Load many (path, scale) pairs at once; returns {(path, scale): Surface or None}."""
+        loaded = {key: self.images.get(key) for key in requests}
+        pending = [key for key, img in loaded.items() if img is None and key not in self.unavailable]
+        if self.workers > 1 and len(pending) > 1:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                results = list(pool.map(lambda key: self._decode_image(*key), pending))
+        else:
+            results = [self._decode_image(*key) for key in pending]
+
+        for key, result in zip(pending, results):
+            loaded[key] = self._finish_image(key, result)
+        return loaded
+
+    def stream_bundle(self, url, fetch):
+        """Start downloading the bundle from ``url``; loads wait in ``arrival`` for the entries they read."""
+        self.download = BundleDownload(url, self.bundle_path, fetch)
+
+    async def arrival(self, path):
+        """Wait until ``path`` can be read; only a bundle still streaming in makes this wait."""
+        download = self.download
+        if download is None:
+            return
+        while not download.finished and (download.bundle is None or download.bundle.pending(path)):
+            await asyncio.sleep(BUNDLE_POLL_SECONDS)
+        self.bundle = download.bundle
+
+    async def load_images_async(self, requests, on_image=None):
+        """``load_images`` that hands control back to the event loop between images, so frames keep drawing.
+
+        ``on_image(key, surface)`` runs as each one becomes available; each
+        image also waits for its bytes if the bundle is still streaming in.
+        """
+        loaded = {key: self.images.get(key) for key in requests}
+        pending = [key for key, img in loaded.items() if img is None and key not in self.unavailable]
+        if self.workers > 1 and len(pending) > 1:
+            for path, _ in pending:
+                await self.arrival(path)
+            loop = asyncio.get_running_loop()
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                futures = [loop.run_in_executor(pool, self._decode_image, *key) for key in pending]
+                for key, future in zip(pending, futures):
+                    loaded[key] = self._finish_image(key, await future)
+                    if on_image:
+                        on_image(key, loaded[key])
+        else:
+            for key in pending:
+                await self.arrival(key[0])
+                loaded[key] = self._finish_image(key, self._decode_image(*key))
+                if on_image:
+                    on_image(key, loaded[key])
+                await asyncio.sleep(0)
+        return loaded
+
+    def _finish_image(self, key, result):
+        """Main-thread half of an image load: wrap the pixels in a display-format Surface in the cache."""
+        path, scale = key
+        decoded, source, seconds = result
+        start = time.perf_counter()
+        img = None
+        if decoded:
+            pixels, size, kind, colorkey = decoded
+            img = pygame.image.frombytes(pixels, size, "RGBA")
+            if kind == "alpha":
+                img = img.convert_alpha()
+            else:
+                img = img.convert()
+                if kind == "colorkey":
+                    img.set_colorkey(colorkey, pygame.RLEACCEL)
+            self.formats[key] = kind
+            self.images.put(key, img)
+        else:
+            if source == "missing":
+                print(f"[WARNING] Image not found: {path} - using procedural fallback")
+            self.unavailable.add(key)
+        self.timings.append((path, (seconds + time.perf_counter() - start) * 1000, source))
+        return img
+
+    def load_image(self, path, scale=None):
+        img = self.images.get((path, scale))
+        if img is not None:
+            return img
+        return self.load_images([(path, scale)])[(path, scale)]
+
+    def load_sound(self, path, volume=0.7):
+        if path in self.sounds:
+            return self.sounds[path]
+        start = time.perf_counter()
+        data, full_path = self.read(path)
+        sound = None
+        if data is not None:
+            try:
+                sound = pygame.mixer.Sound(file=io.BytesIO(data))
+                sound.set_volume(volume)
+            except pygame.error as e:
+                print(f"[ERROR] Failed to load sound {full_path}: {e}")
+        else:
+            print(f"[WARNING] Sound not found: {path} - action will be silent")
+        self.sounds[path] = sound
+        self.timings.append((path, (time.perf_counter() - start) * 1000, "sound" if sound else "missing"))
+        return sound
+
+    def load_music(self, path):
+        if self.music_name == path:
             return True
-        except pygame.error as e:
-            print(f"[ERROR] Failed to load music {full_path}: {e}")
-    print(f"[WARNING] Music not found: {full_path}")
-    return False
-
-# Load visual assets
-background = load_image("nyc_background.png", (SCREEN_WIDTH, SCREEN_HEIGHT))
-player_img = load_image("chef.png", (TILE_SIZE + 8, TILE_SIZE + 20))
-pizza_img = load_image("pizza_slice.png", (80, 80))
-pizzeria_img = load_image("pizzeria.png", (TILE_SIZE*3, TILE_SIZE*3))
-shop_img = load_image("shop.png", (TILE_SIZE*2, TILE_SIZE*2))
-time_boost_img = load_image("time_boost.png", (TILE_SIZE, TILE_SIZE))
-
-enemy_images = {
-    "Street Thug": load_image("thug.png", (180, 180)),
-    "Rival Driver": load_image("delivery_guy.png", (180, 180)),
-    "Gang Enforcer": load_image("gangster.png", (180, 180)),
-    "Rat King": load_image("rat_king.png", (220, 220)),
-}
+        start = time.perf_counter()
+        data, full_path = self.read(path)
+        if data is not None:
+            try:
+                # The mixer streams from this buffer for as long as the track plays
+                self.music_buffer = io.BytesIO(data)
+                pygame.mixer.music.load(self.music_buffer, path)
+                self.music_name = path
+                self.timings.append((path, (time.perf_counter() - start) * 1000, "music"))
+                return True
+            except pygame.error as e:
+                print(f"[ERROR] Failed to load music {full_path}: {e}")
+        print(f"[WARNING] Music not found: {path}")
+        return False
+
+    def report(self, wall_ms):
+        total = sum(ms for _, ms, _ in self.timings)
+        print(f"[ASSETS] {len(self.timings)} assets loaded in {wall_ms:.1f} ms ({total:.1f} ms summed per asset)")
+        for path, ms, source in sorted(self.timings, key=lambda t: -t[1]):
+            print(f"[ASSETS] {ms:8.1f} ms  {source:<7}  {path}")
+        kinds = collections.Counter(self.formats[key] for key in self.images.surfaces)
+        print(f"[ASSETS] {len(self.images.surfaces)} images resident, {self.images.bytes / 1024:.0f} of"
+              f" {self.images.budget_bytes / 1024:.0f} KB ({', '.join(f'{n} {kind}' for kind, n in kinds.items())})")
+
+assets = AssetManager()
 
-# Sound effects (OGG)
-throw_sound = load_sound("throw.ogg", 0.7)
-hit_sound = load_sound("hit.ogg", 0.8)
-deliver_sound = load_sound("deliver.ogg", 0.9)
-buy_sound = load_sound("buy.ogg", 0.6)
-run_sound = load_sound("run.ogg", 0.7)
-damage_sound = load_sound("damage.ogg", 0.8)
-time_boost_sound = load_sound("time_boost.ogg", 0.8)
+def load_image(path, scale=None):
+    return assets.load_image(path, scale)
 
-# Music files
-main_music_path = os.path.join("assets", "italian_music.ogg")
-victory_music_path = os.path.join("assets", "victory.ogg")
-loss_music_path = os.path.join("assets", "times_up.ogg")
+def load_sound(path, volume=0.7):
+    return assets.load_sound(path, volume)
 
-main_music_loaded = os.path.exists(main_music_path)
-victory_music_loaded = os.path.exists(victory_music_path)
-loss_music_loaded = os.path.exists(loss_music_path)
+def load_music(path):
+    return assets.load_music(path)
+
+IMAGE_ASSETS = {
+    "background": ("nyc_background.png", (SCREEN_WIDTH, SCREEN_HEIGHT)),
+    "player_img": ("chef.png", (TILE_SIZE + 8, TILE_SIZE + 20)),
+    "pizza_img": ("pizza_slice.png", (80, 80)),
+    "pizzeria_img": ("pizzeria.png", (TILE_SIZE*3, TILE_SIZE*3)),
+    "shop_img": ("shop.png", (TILE_SIZE*2, TILE_SIZE*2)),
+    "time_boost_img": ("time_boost.png", (TILE_SIZE, TILE_SIZE)),
+}
 
-# Start with main music
-if main_music_loaded:
-    pygame.mixer.music.load(main_music_path)
-    pygame.mixer.music.set_volume(0.45)
-    pygame.mixer.music.play(-1)
+ENEMY_IMAGE_ASSETS = {
+    "Street Thug": ("thug.png", (180, 180)),
+    "Rival Driver": ("delivery_guy.png", (180, 180)),
+    "Gang Enforcer": ("gangster.png", (180, 180)),
+    "Rat King": ("rat_king.png", (220, 220)),
+}
+
+SOUND_ASSETS = {
+    "throw_sound": ("throw.ogg", 0.7),
+    "hit_sound": ("hit.ogg", 0.8),
+    "deliver_sound": ("deliver.ogg", 0.9),
+    "buy_sound": ("buy.ogg", 0.6),
+    "run_sound": ("run.ogg", 0.7),
+    "damage_sound": ("damage.ogg", 0.8),
+    "time_boost_sound": ("time_boost.ogg", 0.8),
+}
+
+MAIN_MUSIC = "italian_music.ogg"
+
+# Filled in by load_assets() / stream_assets() once the game starts
+background = player_img = pizza_img = pizzeria_img = shop_img = time_boost_img = None
+throw_sound = hit_sound = deliver_sound = buy_sound = run_sound = damage_sound = time_boost_sound = None
+main_music_loaded = False
+assets_ready = False  # the intro will not start a run before this
+assets_progress = (0, 1)  # files loaded, files in total
+
+TITLE_IMAGES = ("background",)  # all draw_intro needs
+
+def asset_files():
+    """Every file the game loads, for build_bundle.py, in the order ``main`` loads them: title art first."""
+    paths = [IMAGE_ASSETS[name][0] for name in TITLE_IMAGES]
+    paths += [path for path, _ in list(IMAGE_ASSETS.values()) + list(ENEMY_IMAGE_ASSETS.values())]
+    paths += [path for path, _ in SOUND_ASSETS.values()] + [MAIN_MUSIC]
+    return list(dict.fromkeys(paths))
+
+assets.images.pinned.update(IMAGE_ASSETS.values())  # held in module globals for the whole run
+
+def publish_images(loaded):
+    for name, key in IMAGE_ASSETS.items():
+        if key in loaded:
+            globals()[name] = loaded[key]
+
+def alpha_surface(img):
+    """``img`` with per-pixel alpha, for blends and smoothscale that would smear a colorkey; a new surface."""
+    return img.convert_alpha() if img.get_colorkey() else img.copy()
+
+def enemy_image(name, flash=False):
+    """An enemy's combat sprite, or its red hit flash; loaded again if the texture cache dropped it."""
+    if name not in ENEMY_IMAGE_ASSETS:
+        return None
+    key = ENEMY_IMAGE_ASSETS[name]
+    if not flash:
+        return assets.load_image(*key)
+    flash_key = (key, "flash")
+    img = assets.images.get(flash_key)
+    if img is None:
+        img = assets.load_image(*key)
+        if img is None:
+            return None
+        img = alpha_surface(img)
+        img.fill(FLASH_RED, special_flags=pygame.BLEND_ADD)
+        assets.images.put(flash_key, img)
+        assets.formats[flash_key] = "alpha"
+    return img
+
+def load_assets():
+    """Load every asset the game uses, once, and publish them as module globals."""
+    global main_music_loaded, assets_ready
+    start = time.perf_counter()
+    publish_images(assets.load_images(list(IMAGE_ASSETS.values()) + list(ENEMY_IMAGE_ASSETS.values())))
+    for name, (path, volume) in SOUND_ASSETS.items():
+        globals()[name] = load_sound(path, volume)
+        sfx.add(name, globals()[name])
+    main_music_loaded = load_music(MAIN_MUSIC)
+    build_combat_sprites()
+    assets_ready = True
+    assets.report((time.perf_counter() - start) * 1000)
+
+async def load_title_assets():
+    publish_images(await assets.load_images_async([IMAGE_ASSETS[name] for name in TITLE_IMAGES]))
+
+async def stream_assets():
+    """The rest of the assets in the background while the intro is up: sprites, enemies, sounds, then music."""
+    global main_music_loaded, assets_ready, assets_progress
+    start = time.perf_counter()
+    images = [key for name, key in IMAGE_ASSETS.items() if name not in TITLE_IMAGES]
+    images += list(ENEMY_IMAGE_ASSETS.values())
+    total = len(TITLE_IMAGES) + len(images) + len(SOUND_ASSETS) + 1
+    assets_progress = (len(TITLE_IMAGES), total)
+
+    def image_loaded(key, img):
+        global assets_progress
+        publish_images({key: img})
+        assets_progress = (assets_progress[0] + 1, total)
+
+    await assets.load_images_async(images, image_loaded)
+    for name, (path, volume) in SOUND_ASSETS.items():
+        await assets.arrival(path)
+        globals()[name] = load_sound(path, volume)
+        sfx.add(name, globals()[name])
+        assets_progress = (assets_progress[0] + 1, total)
+        await asyncio.sleep(0)
+    await assets.arrival(MAIN_MUSIC)
+    main_music_loaded = load_music(MAIN_MUSIC)
+    if main_music_loaded:
+        pygame.mixer.music.set_volume(0.45)
+        pygame.mixer.music.play(-1)
+    assets_progress = (total, total)
+    build_combat_sprites()
+    assets_ready = True
+    assets.report((time.perf_counter() - start) * 1000)
 
 # ==========================
-# TIME BOOSTERS ON MAP - Only one +3 second booster
+# TEXT - GLYPH ATLASES AND A LINE CACHE, SO A STATIC LINE IS RASTERIZED ONCE
 # ==========================
-time_booster_positions = [(10, 8)]
-time_boosters_active = [True]
-
-def draw_time_booster(x, y):
-    tx = x * TILE_SIZE
-    ty = y * TILE_SIZE
-    if time_boost_img:
-        screen.blit(time_boost_img, (tx, ty))
-    else:
-        pygame.draw.circle(screen, TIME_BOOST_COLOR, (tx + 20, ty + 20), 18)
-        pygame.draw.circle(screen, TIME_BOOST_GLOW, (tx + 20, ty + 20), 25, 5)
-        clock_text = small_font.render("+3s", True, WHITE)
-        screen.blit(clock_text, (tx + 8, ty + 12))
+TEXT_CACHE_BYTES = 4 * 1024 * 1024  # memory cap for laid-out lines and their colour variants
+ATLAS_CHARS = "".join(chr(c) for c in range(32, 127))  # rasterized up front; anything else on first use
+
+class GlyphAtlas:
+    """One font's glyphs, rasterized once in white side by side in a single surface.
+
+    ``layout`` builds a line from sub-rect blits out of the atlas. Pen
+    positions come from ``font.size`` of each prefix, so spacing and
+    kerning match ``font.render``.
+    """
+    def __init__(self, font, chars=ATLAS_CHARS):
+        self.font = font
+        self.surface = None
+        self.glyphs = {}  # char -> (rect in the atlas, x offset for glyphs that start left of the pen)
+        self.add(chars)
+
+    def add(self, chars):
+        new = [ch for ch in dict.fromkeys(chars) if ch not in self.glyphs]
+        if not new:
+            return
+        rendered = [(ch, self.font.render(ch, True, WHITE)) for ch in new]
+        x = self.surface.get_width() if self.surface else 0
+        width = x + sum(glyph.get_width() for _, glyph in rendered)
+        height = max([glyph.get_height() for _, glyph in rendered] + [self.surface.get_height() if self.surface else 0])
+        atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+        if self.surface:
+            atlas.blit(self.surface, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        for ch, glyph in rendered:
+            metrics = self.font.metrics(ch)[0]
+            atlas.blit(glyph, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.glyphs[ch] = (pygame.Rect(x, 0, glyph.get_width(), glyph.get_height()), min(metrics[0], 0) if metrics else 0)
+            x += glyph.get_width()
+        self.surface = atlas.convert_alpha()
+
+    def layout(self, text):
+        """``text`` in white with per-pixel alpha, the same size as ``font.render`` makes it."""
+        self.add(text)
+        size = self.font.size
+        line = pygame.Surface(size(text), pygame.SRCALPHA)
+        blits = []
+        for i, ch in enumerate(text):
+            if ch != " ":
+                rect, offset = self.glyphs[ch]
+                blits.append((self.surface, (size(text[:i])[0] + offset, 0), rect, pygame.BLEND_RGBA_MAX))
+        line.blits(blits, doreturn=False)
+        return line
+
+class TextCache(TextureCache):
+    """Lines of text keyed by (font, text, colour), least recently used dropped first.
+
+    A line is laid out once in white from its font's ``GlyphAtlas``; every
+    other colour, shadows and glows included, is a tinted copy of that
+    white line instead of another FreeType render.
+    """
+    def __init__(self, budget_bytes):
+        super().__init__(budget_bytes)
+        self.atlases = {}
+
+    def render(self, font, text, color):
+        """``font.render(text, True, color)``, from the cache."""
+        color = tuple(color)
+        key = (font, text, color)
+        line = self.get(key)
+        if line is not None:
+            return line
+        white_key = (font, text, WHITE)
+        white = self.get(white_key)
+        if white is None:
+            atlas = self.atlases.get(font)
+            if atlas is None:
+                atlas = self.atlases[font] = GlyphAtlas(font)
+            white = atlas.layout(text)
+            self.put(white_key, white)
+        if color == WHITE:
+            return white
+        # Multiplying by a solid blit keeps the alpha; Surface.fill's blend modes take a much slower path
+        line = white.copy()
+        tint = pygame.Surface(line.get_size()).convert()
+        tint.fill(color)
+        line.blit(tint, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+        self.put(key, line)
+        return line
+
+text_cache = TextCache(TEXT_CACHE_BYTES)
+
+def render_text(font, text, color):
+    return text_cache.render(font, text, color)
 
 # ==========================
-# CUSTOMER DELIVERY TRACKING
+# COMBAT SPRITES - EVERY VARIANT draw_combat NEEDS, BUILT ONCE AFTER LOADING
 # ==========================
-pizzeria_pos = (7, 10)
-customer_positions = [(3,5), (12,13), (5,12), (15,8), (10,3)]
-important_tiles = [pizzeria_pos] + customer_positions
+PIZZA_ROTATION_STEP = 5  # degrees between precomputed pizza frames
+COMBAT_CHEF_SIZE = (260, 300)
+
+combat_background = combat_chef = None
+roamer_images = {}  # enemy_templates key -> sprite shrunk to a map tile
+pizza_frames = []
 
-delivered_customers = set()
+def build_combat_sprites():
+    global combat_background, combat_chef, roamer_images, pizza_frames
+    combat_background = None
+    if background:
+        # The old per-frame background.copy() + set_alpha(100) over black, baked
+        combat_background = pygame.Surface(background.get_size()).convert()
+        combat_background.fill(BLACK)
+        dark = background.copy()
+        dark.set_alpha(100)
+        combat_background.blit(dark, (0, 0))
+    combat_chef = pygame.transform.scale(player_img, COMBAT_CHEF_SIZE) if player_img else None
+    roamer_images = {}
+    for key, template in enemy_templates.items():
+        img = enemy_image(template["name"])
+        if img:
+            roamer_images[key] = pygame.transform.smoothscale(alpha_surface(img), ROAMER_SIZE)
+    pizza_frames = []
+    if pizza_img:
+        pizza_frames = [pygame.transform.rotate(pizza_img, angle) for angle in range(0, 360, PIZZA_ROTATION_STEP)]
 
 # ==========================
-# GAME MAP GENERATION
+# PARTICLES - HIT SPARKS, CHEESE, PEPPERONI AND DELIVERY BURSTS IN PREALLOCATED POOLS
 # ==========================
-game_map = [[0 for _ in range(MAP_WIDTH)] for _ in range(MAP_HEIGHT)]
+PARTICLE_POOL_SIZE = 4096  # live particles per pool; bursts past it are cut short
+PARTICLE_FRAMES = 8  # prerendered fade steps per kind
+PARTICLE_SPRITE_SIZE = 16
+PARTICLE_GRAVITY = 900.0  # pixels per second squared, for the kinds that fall
+
+# name: (colour, radius at birth, radius at death, falls)
+PARTICLE_KINDS = {
+    "spark": (NEON_YELLOW, 3, 1, False),
+    "cheese": (CHEESE_YELLOW, 6, 3, True),
+    "pepperoni": (RED, 7, 6, True),
+    "burst": (GREEN, 4, 1, False),
+}
+PARTICLE_KIND_INDEX = {name: i for i, name in enumerate(PARTICLE_KINDS)}
 
-for y in range(MAP_HEIGHT):
-    for x in range(MAP_WIDTH):
-        if (x, y) in important_tiles or (x, y) in time_booster_positions:
-            continue
-        if random.random() < 0.45:
-            game_map[y][x] = 1
+# game event: (kind, count, speed in pixels per second, lifetime in seconds) per burst
+PARTICLE_EFFECTS = {
+    "hit": (("spark", 28, 420, 0.35), ("cheese", 12, 260, 0.6)),
+    "damage": (("spark", 18, 320, 0.3),),
+    "deliver": (("burst", 48, 240, 0.5), ("cheese", 16, 160, 0.7)),
+}
+PEPPERONI_DROPS = 4  # pepperoni particles per pepperoni a defeated enemy gives
+COMBAT_CHEF_CENTER = (170, 370)
+
+def render_particle_sprites():
+    """Every kind's fade steps, indexed ``kind * PARTICLE_FRAMES + step``."""
+    sprites = []
+    center = (PARTICLE_SPRITE_SIZE // 2, PARTICLE_SPRITE_SIZE // 2)
+    for color, start_radius, end_radius, _ in PARTICLE_KINDS.values():
+        for frame in range(PARTICLE_FRAMES):
+            t = frame / (PARTICLE_FRAMES - 1)
+            sprite = pygame.Surface((PARTICLE_SPRITE_SIZE, PARTICLE_SPRITE_SIZE), pygame.SRCALPHA)
+            radius = round(start_radius + (end_radius - start_radius) * t)
+            pygame.draw.circle(sprite, (*color, round(255 * (1 - 0.8 * t))), center, radius)
+            if color == RED and radius > 4:
+                pygame.draw.circle(sprite, (*DEATH_RED, 255), (center[0] - 2, center[1] - 1), 1)
+                pygame.draw.circle(sprite, (*DEATH_RED, 255), (center[0] + 2, center[1] + 2), 1)
+            sprites.append(sprite.convert_alpha())
+    return sprites
+
+particle_sprites = render_particle_sprites()
+
+class ParticlePool:
+    """Short-lived effect sprites, one slot each in preallocated NumPy arrays.
+
+    Live particles stay packed at the front of the arrays: ``spawn`` writes
+    a whole burst past the end with slice assignments, and ``update`` moves,
+    ages and compacts every one in a single vectorised pass. A full pool
+    cuts new bursts short instead of growing, so a storm of hits costs a
+    bounded frame. ``draw`` refills one preallocated ``[sprite, [x, y]]``
+    list per slot rather than building a tuple per particle, which kept
+    the garbage collector busy and put 30 ms spikes in a full pool's frames.
+    """
+    __slots__ = ("x", "y", "vx", "vy", "age", "life", "gravity", "kind", "count", "rng", "blit_list")
+
+    def __init__(self, capacity=PARTICLE_POOL_SIZE, rng=None):
+        self.x = np.zeros(capacity, dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.float32)
+        self.vx = np.zeros(capacity, dtype=np.float32)
+        self.vy = np.zeros(capacity, dtype=np.float32)
+        self.age = np.zeros(capacity, dtype=np.float32)
+        self.life = np.ones(capacity, dtype=np.float32)
+        self.gravity = np.zeros(capacity, dtype=np.float32)
+        self.kind = np.zeros(capacity, dtype=np.intp)
+        self.count = 0
+        self.rng = rng or np.random.default_rng()  # cosmetic; never touches the game_core streams
+        self.blit_list = [[particle_sprites[0], [0, 0]] for _ in range(capacity)]
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    def spawn(self, kind, n, x, y, speed, life):
+        """``n`` particles of ``kind`` flying out of (x, y) in every direction."""
+        n = min(n, len(self.x) - self.count)
+        if n <= 0:
+            return
+        live = slice(self.count, self.count + n)
+        falls = PARTICLE_KINDS[kind][3]
+        angle = self.rng.uniform(0.0, 2 * math.pi, n)
+        velocity = speed * self.rng.uniform(0.3, 1.0, n)
+        self.x[live] = x
+        self.y[live] = y
+        self.vx[live] = np.cos(angle) * velocity
+        self.vy[live] = np.sin(angle) * velocity - (speed * 0.5 if falls else 0.0)  # tossed up, then falls
+        self.age[live] = 0.0
+        self.life[live] = life * self.rng.uniform(0.6, 1.0, n)
+        self.gravity[live] = PARTICLE_GRAVITY if falls else 0.0
+        self.kind[live] = PARTICLE_KIND_INDEX[kind]
+        self.count += n
+
+    def update(self, dt):
+        n = self.count
+        if not n or dt <= 0:
+            return
+        self.age[:n] += dt
+        self.vy[:n] += self.gravity[:n] * dt
+        self.x[:n] += self.vx[:n] * dt
+        self.y[:n] += self.vy[:n] * dt
+        keep = self.age[:n] < self.life[:n]
+        alive = int(np.count_nonzero(keep))
+        if alive < n:
+            for values in (self.x, self.y, self.vx, self.vy, self.age, self.life, self.gravity, self.kind):
+                values[:alive] = values[:n][keep]
+        self.count = alive
+
+    def draw(self, surface, ox=0, oy=0):
+        """Blit every live particle in one ``Surface.blits``; returns the rect they cover, or None."""
+        n = self.count
+        if not n:
+            return None
+        frames = np.minimum(self.age[:n] / self.life[:n] * PARTICLE_FRAMES, PARTICLE_FRAMES - 1).astype(np.intp)
+        frames += self.kind[:n] * PARTICLE_FRAMES
+        half = PARTICLE_SPRITE_SIZE // 2
+        xs = (self.x[:n] - (ox + half)).astype(np.intp)
+        ys = (self.y[:n] - (oy + half)).astype(np.intp)
+        sprites = particle_sprites
+        blit_list = self.blit_list
+        for item, f, x, y in zip(blit_list, frames.tolist(), xs.tolist(), ys.tolist()):
+            item[0] = sprites[f]
+            pos = item[1]
+            pos[0] = x
+            pos[1] = y
+        surface.blits(blit_list if n == len(blit_list) else blit_list[:n], doreturn=False)
+        left, top = int(xs.min()), int(ys.min())
+        return pygame.Rect(left, top, int(xs.max()) - left + PARTICLE_SPRITE_SIZE,
+                           int(ys.max()) - top + PARTICLE_SPRITE_SIZE)
+
+combat_particles = ParticlePool()  # combat screen coordinates
+city_particles = ParticlePool()  # world coordinates, drawn through the camera
+
+def spawn_effect(pool, event, x, y):
+    for kind, count, speed, life in PARTICLE_EFFECTS[event]:
+        pool.spawn(kind, count, x, y, speed, life)
+
+def update_particles(dt):
+    combat_particles.update(dt)
+    city_particles.update(dt)
 
-game_map[pizzeria_pos[1]][pizzeria_pos[0]] = 2
-for cx, cy in customer_positions:
-    game_map[cy][cx] = 3
+# ==========================
+# TIME BOOSTERS ON MAP - Only one +3 second booster
+# ==========================
+def draw_time_booster(surface, x, y, ox=0, oy=0):
+    tx = x * TILE_SIZE - ox
+    ty = y * TILE_SIZE - oy
+    if time_boost_img:
+        surface.blit(time_boost_img, (tx, ty))
+    else:
+        pygame.draw.circle(surface, TIME_BOOST_COLOR, (tx + 20, ty + 20), 18)
+        pygame.draw.circle(surface, TIME_BOOST_GLOW, (tx + 20, ty + 20), 25, 5)
+        clock_text = render_text(small_font, "+3s", WHITE)
+        surface.blit(clock_text, (tx + 8, ty + 12))
 
 # ==========================
-# PLAYER CLASS
+# CITY CHUNKS - THE MAP PRE-RENDERED IN FIXED-SIZE BLOCKS, ONLY VISIBLE ONES BLITTED
 # ==========================
-class Player:
-    def __init__(self):
-        self.x = pizzeria_pos[0] * TILE_SIZE
-        self.y = pizzeria_pos[1] * TILE_SIZE
-        self.health = 120
-        self.max_health = 120
-        self.pepperonis = 0
+CHUNK_TILES = 16  # chunk edge in tiles
+CHUNK_SIZE = CHUNK_TILES * TILE_SIZE
+CHUNK_CACHE_BYTES = 24 * 1024 * 1024  # memory cap for rendered chunk surfaces
+WINDOW_ANIM_INTERVAL = 600  # milliseconds between window light changes
+WINDOW_ANIM_FLIPS = 6  # tiles re-rolled per animation step, sampled from the visible area
+
+WORLD_WIDTH = MAP_WIDTH * TILE_SIZE
+WORLD_HEIGHT = MAP_HEIGHT * TILE_SIZE
+
+WINDOW_COLORS = (None, WINDOW_YELLOW, WINDOW_BLUE)
+
+class ChunkCache:
+    """Rendered chunk surfaces keyed by chunk coordinate, least recently used evicted first."""
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.surfaces = collections.OrderedDict()
+        self.bytes = 0
+
+    def get(self, key, pinned=()):
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+            return surf
+        surf = render_chunk(*key, game_state.game_map, lit_windows, city_sprites)
+        self.put(key, surf, pinned)
+        return surf
+
+    def put(self, key, surf, pinned=()):
+        self.surfaces[key] = surf
+        self.bytes += surf.get_width() * surf.get_height() * surf.get_bytesize()
+        # Never evict what is on screen this frame, even if the cap is set too small
+        for old_key in list(self.surfaces):
+            if self.bytes <= self.budget_bytes:
+                break
+            if old_key in pinned or old_key == key:
+                continue
+            self.drop(old_key)
+
+    def peek(self, key):
+        return self.surfaces.get(key)
+
+    def drop(self, key):
+        surf = self.surfaces.pop(key, None)
+        if surf is not None:
+            self.bytes -= surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+    def drop_rect(self, rect):
+        """Forget every cached chunk that overlaps a world-space rect."""
+        for key in chunks_in_rect(rect):
+            self.drop(key)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.bytes = 0
+
+chunk_cache = ChunkCache(CHUNK_CACHE_BYTES)
+city_sprites = []  # (draw order, image name, world rect) for landmarks that overlap tiles around them
+lit_windows = None  # per-tile index into WINDOW_COLORS, same shape as game_map
+# (seed, map seed) -> (game_map, lit_windows, city_sprites, {chunk: surface}) of a city the run preparer built ahead
+prepared_layers = collections.OrderedDict()
+fx_rng = random.Random()  # window lights and screen shake; never touches the game_core streams
+next_window_anim = 0
+check_img = None
+camera_x = camera_y = 0
+
+def chunks_in_rect(rect):
+    x0 = max(rect.left // CHUNK_SIZE, 0)
+    y0 = max(rect.top // CHUNK_SIZE, 0)
+    x1 = min((rect.right - 1) // CHUNK_SIZE, (WORLD_WIDTH - 1) // CHUNK_SIZE)
+    y1 = min((rect.bottom - 1) // CHUNK_SIZE, (WORLD_HEIGHT - 1) // CHUNK_SIZE)
+    return [(cx, cy) for cy in range(y0, y1 + 1) for cx in range(x0, x1 + 1)]
+
+def roll_window_light():
+    if fx_rng.random() < 0.4:
+        return 1 if fx_rng.random() < 0.6 else 2
+    return 0
+
+def roll_lit_windows(seed, map_seed, game_map):
+    """Every building's lights for a new city in one draw, with ``roll_window_light``'s odds."""
+    roll = np.random.default_rng([seed % 2 ** 64, map_seed]).random(game_map.shape)
+    lit = np.where(roll < 0.24, 1, np.where(roll < 0.4, 2, 0)).astype(np.uint8)
+    lit[game_map != 1] = 0
+    return lit
+
+def sprite_image(name):
+    return {"booster": time_boost_img, "pizzeria": pizzeria_img, "shop": shop_img, "check": check_img}[name]
+
+def reset_city_layer():
+    """Window lights, landmark sprites and chunks for the current map: prepared ahead if the run was, else rolled now."""
+    global lit_windows, check_img
+    if check_img is None:
+        check_img = medium_font.render("✓", True, GREEN)
+    game_map = game_state.game_map
+    fx_rng.seed(f"{game_state.seed}:fx:{game_state.map_seed}")
+    layer = prepared_layers.pop((game_state.seed, game_state.map_seed), None)
+    chunk_cache.clear()
+    if layer is None:
+        lit_windows = roll_lit_windows(game_state.seed, game_state.map_seed, game_map)
+        city_sprites[:] = landmark_sprites(game_map, game_state.time_boosters_active, game_state.delivered_customers)
+        return
+    _, lit_windows, city_sprites[:], chunks = layer
+    for key, surf in chunks.items():
+        chunk_cache.put(key, surf)
 
-player = Player()
+def landmark_sprites(game_map, boosters_active, delivered):
+    sprites = []
+    for i, (bx, by) in enumerate(time_booster_positions):
+        if boosters_active[i]:
+            # Boosters were always drawn underneath the buildings
+            sprites.append((-1, "booster", pygame.Rect(bx * TILE_SIZE, by * TILE_SIZE, TILE_SIZE, TILE_SIZE)))
+    ys, xs = (game_map >= 2).nonzero()
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        tx = x * TILE_SIZE
+        ty = y * TILE_SIZE
+        if game_map[y, x] == 2:
+            sprites.append((y * MAP_WIDTH + x, "pizzeria", pygame.Rect(tx - 40, ty - 70, TILE_SIZE * 3, TILE_SIZE * 3)))
+        else:
+            sprites.append((y * MAP_WIDTH + x, "shop", pygame.Rect(tx - 25, ty - 55, TILE_SIZE * 2, TILE_SIZE * 2)))
+            if (x, y) in delivered:
+                sprites.append((y * MAP_WIDTH + x, "check", check_img.get_rect(topleft=(tx + 10, ty + 5))))
+    return sprites
+
+def draw_tiled_background(surface, ox, oy):
+    """Fill ``surface`` with the backdrop as if it were repeated across the world from (0, 0)."""
+    if not background:
+        surface.fill(DARK_BLUE)
+        return
+    bw, bh = background.get_size()
+    start_x = -(ox % bw)
+    start_y = -(oy % bh)
+    for y in range(start_y, surface.get_height(), bh):
+        for x in range(start_x, surface.get_width(), bw):
+            surface.blit(background, (x, y))
+
+def draw_building_windows(surface, x, y, ox, oy, lit):
+    tx = x * TILE_SIZE - ox
+    ty = y * TILE_SIZE - oy
+    color = WINDOW_COLORS[lit[y, x]] or DARK_GRAY
+    pygame.draw.rect(surface, color, (tx + 10, ty + 12, 8, 10))
+    pygame.draw.rect(surface, color, (tx + 22, ty + 18, 8, 10))
+    return pygame.Rect(tx + 10, ty + 12, 20, 16)
+
+def render_chunk(cx, cy, game_map, lit, sprites):
+    """Composite backdrop, buildings and every landmark overlapping one chunk of a city."""
+    ox = cx * CHUNK_SIZE
+    oy = cy * CHUNK_SIZE
+    chunk_rect = pygame.Rect(ox, oy, min(CHUNK_SIZE, WORLD_WIDTH - ox), min(CHUNK_SIZE, WORLD_HEIGHT - oy))
+    surf = pygame.Surface(chunk_rect.size).convert()
+    draw_tiled_background(surf, ox, oy)
+
+    # Buildings and landmarks in map raster order so overlaps match across chunk edges
+    tx0, ty0 = cx * CHUNK_TILES, cy * CHUNK_TILES
+    block = game_map[ty0:ty0 + CHUNK_TILES, tx0:tx0 + CHUNK_TILES]
+    ys, xs = (block == 1).nonzero()
+    items = [((y + ty0) * MAP_WIDTH + x + tx0, 0, x + tx0, y + ty0) for x, y in zip(xs.tolist(), ys.tolist())]
+    items += [(order, 1, name, rect) for order, name, rect in sprites if rect.colliderect(chunk_rect)]
+    items.sort(key=lambda item: (item[0], item[1]))
+    for _, is_sprite, a, b in items:
+        if is_sprite:
+            img = sprite_image(a)
+            if img:
+                surf.blit(img, b.move(-ox, -oy))
+            elif a == "booster":
+                draw_time_booster(surf, b.x // TILE_SIZE, b.y // TILE_SIZE, ox, oy)
+        else:
+            pygame.draw.rect(surf, DARK_GRAY, (a * TILE_SIZE - ox + 6, b * TILE_SIZE - oy + 6, TILE_SIZE - 12, TILE_SIZE - 12))
+            if lit[b, a]:
+                draw_building_windows(surf, a, b, ox, oy, lit)
+    return surf
+
+def patch_city_delivery(x, y):
+    """Add the delivery checkmark for a newly served customer and re-render the chunks under it."""
+    rect = check_img.get_rect(topleft=(x * TILE_SIZE + 10, y * TILE_SIZE + 5))
+    city_sprites.append((y * MAP_WIDTH + x, "check", rect))
+    chunk_cache.drop_rect(rect)
+    dirty.invalidate()
+
+def remove_city_booster(x, y):
+    for sprite in city_sprites:
+        if sprite[1] == "booster" and sprite[2].topleft == (x * TILE_SIZE, y * TILE_SIZE):
+            city_sprites.remove(sprite)
+            chunk_cache.drop_rect(sprite[2])
+            dirty.invalidate()
+            return
+
+def visible_tile_rect():
+    return pygame.Rect(camera_x // TILE_SIZE, camera_y // TILE_SIZE,
+                       SCREEN_WIDTH // TILE_SIZE + 1, SCREEN_HEIGHT // TILE_SIZE + 1)
+
+def animate_city_windows():
+    """Re-roll a few on-screen buildings' lights on a slow schedule, patching cached chunks in place."""
+    global next_window_anim
+    now = pygame.time.get_ticks()
+    if now < next_window_anim:
+        return
+    next_window_anim = now + WINDOW_ANIM_INTERVAL
+    view = visible_tile_rect().clip(pygame.Rect(0, 0, MAP_WIDTH, MAP_HEIGHT))
+    for _ in range(WINDOW_ANIM_FLIPS * 2):
+        x = fx_rng.randrange(view.left, view.right)
+        y = fx_rng.randrange(view.top, view.bottom)
+        if game_state.game_map[y, x] != 1:
+            continue
+        lit_windows[y, x] = roll_window_light()
+        chunk = chunk_cache.peek((x // CHUNK_TILES, y // CHUNK_TILES))
+        if chunk is None:
+            continue
+        ox = x // CHUNK_TILES * CHUNK_SIZE
+        oy = y // CHUNK_TILES * CHUNK_SIZE
+        patched = draw_building_windows(chunk, x, y, ox, oy, lit_windows)
+        dirty.mark(patched.move(ox - camera_x, oy - camera_y))
+        # Sprites drawn after this tile covered its windows originally - restore them
+        order = y * MAP_WIDTH + x
+        chunk.set_clip(patched)
+        for sprite_order, name, rect in city_sprites:
+            img = sprite_image(name)
+            if img and sprite_order > order and rect.move(-ox, -oy).colliderect(patched):
+                chunk.blit(img, rect.move(-ox, -oy))
+        chunk.set_clip(None)
+
+def camera_for(p):
+    """Top-left of a view centred on player ``p``, clamped to the city edges."""
+    target_x = p.x + TILE_SIZE // 2 - SCREEN_WIDTH // 2
+    target_y = p.y + TILE_SIZE // 2 - SCREEN_HEIGHT // 2
+    return max(0, min(target_x, WORLD_WIDTH - SCREEN_WIDTH)), max(0, min(target_y, WORLD_HEIGHT - SCREEN_HEIGHT))
+
+def update_camera():
+    global camera_x, camera_y
+    camera_x, camera_y = camera_for(player)
+
+def draw_city():
+    view = pygame.Rect(camera_x, camera_y, SCREEN_WIDTH, SCREEN_HEIGHT)
+    if WORLD_WIDTH < SCREEN_WIDTH or WORLD_HEIGHT < SCREEN_HEIGHT:
+        screen.fill(DARK_BLUE)
+    visible = chunks_in_rect(view)
+    for key in visible:
+        screen.blit(chunk_cache.get(key, visible), (key[0] * CHUNK_SIZE - camera_x, key[1] * CHUNK_SIZE - camera_y))
 
 # ==========================
-# ENEMIES - Stronger
+# GAME STATE - RULES AND RUN STATE LIVE IN game_core
 # ==========================
-enemy_templates = {
-    "Thug": {"name": "Street Thug", "health": 96, "attack": 16, "pepperonis": 10},
-    "Driver": {"name": "Rival Driver", "health": 120, "attack": 21, "pepperonis": 18},
-    "Gangster": {"name": "Gang Enforcer", "health": 192, "attack": 32, "pepperonis": 40},
-    "Rat King": {"name": "Rat King", "health": 264, "attack": 40, "pepperonis": 90},
-}
+# SLICE_CITY_SEED replays a known city and dice; SLICE_CITY_RECORD=file.scr saves the session (see replay.py)
+RECORD_PATH = os.environ.get("SLICE_CITY_RECORD")
+game_state = player = None
 
-ENEMY_ENCOUNTER_CHANCE = 0.12
+def new_session(seed=None):
+    global game_state, player
+    game_state = GameState(seed)
+    player = game_state.player
+    reset_city_layer()
 
-# Enemy cooldown system - player must move at least 3 tiles before next encounter
-last_encounter_tile = None
-moves_since_encounter = 0
+new_session(int(os.environ["SLICE_CITY_SEED"]) if os.environ.get("SLICE_CITY_SEED") else None)
 
 # ==========================
-# GAME STATE MANAGER
+# RETAINED HUD WIDGETS - RE-RENDERED ONLY WHEN THEIR KEY CHANGES
 # ==========================
-class GameState:
+class Widget:
+    """Keeps the last surface built by ``render(key)`` and reuses it while the key is unchanged."""
+    def __init__(self, render):
+        self.render = render
+        self.key = None
+        self.surface = None
+
+    def get(self, key=None):
+        if self.surface is None or key != self.key:
+            self.surface = self.render(key)
+            self.key = key
+        return self.surface
+
+# ==========================
+# DIRTY RECTANGLES - ONLY CHANGED REGIONS REACH THE DISPLAY; SLICE_CITY_DIRTY_RECTS=0 FLIPS EVERY FRAME
+# ==========================
+DIRTY_RECTS = os.environ.get("SLICE_CITY_DIRTY_RECTS", "1") != "0"
+SCREEN_RECT = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+DIRTY_MAX_RECTS = 512
+
+class Viewport:
+    """Where the canvas lands in the window: one uniform scale, centred, black bars on the long side.
+
+    ``present`` scales the canvas (or just the given canvas rects) into
+    the window in one pass per rect and pushes the result, so the draw
+    code, the sprites and the retained widgets all stay at canvas size
+    and the window size only costs that final scale. Whole-number scales
+    use nearest-pixel scaling, which keeps edges crisp and is cheapest;
+    anything else is filtered with ``smoothscale``.
+    """
+    def __init__(self):
+        self.resize()
+
+    def resize(self):
+        global window
+        window = pygame.display.get_surface()
+        self.direct = window is screen
+        ww, wh = window.get_size()
+        self.scale = min(ww / SCREEN_WIDTH, wh / SCREEN_HEIGHT)
+        width, height = round(SCREEN_WIDTH * self.scale), round(SCREEN_HEIGHT * self.scale)
+        self.rect = pygame.Rect((ww - width) // 2, (wh - height) // 2, width, height)
+        self.smooth = self.scale != int(self.scale)
+        if not self.direct:
+            window.fill(BLACK)
+            self.target = window.subsurface(self.rect)
+
+    def to_window(self, rect):
+        s = self.scale
+        left, top = int(rect.left * s), int(rect.top * s)
+        return pygame.Rect(left, top, math.ceil(rect.right * s) - left, math.ceil(rect.bottom * s) - top)
+
+    def to_canvas(self, pos):
+        if self.direct:
+            return pos
+        return (int((pos[0] - self.rect.x) / self.scale), int((pos[1] - self.rect.y) / self.scale))
+
+    def scale_into(self, source, target):
+        if self.smooth:
+            pygame.transform.smoothscale(source, target.get_size(), target)
+        else:
+            pygame.transform.scale(source, target.get_size(), target)
+
+    def present(self, rects=None):
+        """Push the whole canvas, or only the canvas ``rects``, to the display."""
+        if self.direct:
+            if rects is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+            return
+        if rects is None:
+            self.scale_into(screen, self.target)
+            pygame.display.flip()
+            return
+        pushed = []
+        for rect in rects:
+            rect = pygame.Rect(rect)
+            if not rect.width or not rect.height:
+                continue
+            dest = self.to_window(rect).clip(self.target.get_rect())
+            self.scale_into(screen.subsurface(rect), self.target.subsurface(dest))
+            pushed.append(dest.move(self.rect.topleft))
+        pygame.display.update(pushed)
+
+viewport = Viewport()
+
+class DirtyRects:
+    """Screen regions drawn differently from the frame on the display, pushed with ``display.update``.
+
+    Draw code marks whatever it draws that can change from one frame to
+    the next; everything else on the screen is redrawn identically, so
+    leaving it out of the update is invisible. A region marked last frame
+    is pushed again so whatever moved off it gets erased. ``present``
+    flips the whole screen instead when the frame key (screen, camera,
+    shake) changes or something called ``invalidate``.
+    """
     def __init__(self):
-        self.state = "intro"
-        self.previous_state = None
-        self.current_enemy = None
-        self.pizza_projectiles = []
-        self.screen_shake = 0
-        self.combat_message = ""
-        self.combat_message_timer = 0
-        self.shop_message = ""
-        self.shop_message_timer = 0
-        self.deliveries_made = 0
-        self.extra_time_bought = 0
-        self.game_start_time = None
-        self.intro_instructions_expanded = False
-        self.timer_paused = False
-        self.pause_start_time = 0.0
-
-    def reset(self):
-        global delivered_customers, time_boosters_active, last_encounter_tile, moves_since_encounter, game_map
-        self.__init__()
-        delivered_customers = set()
-        time_boosters_active = [True]
-        last_encounter_tile = None
-        moves_since_encounter = 0
-        player.x = pizzeria_pos[0] * TILE_SIZE
-        player.y = pizzeria_pos[1] * TILE_SIZE
-        player.health = 120
-        player.pepperonis = 0
-        # Regenerate the game map for a fresh random layout on restart
-        game_map = [[0 for _ in range(MAP_WIDTH)] for _ in range(MAP_HEIGHT)]
-        for y in range(MAP_HEIGHT):
-            for x in range(MAP_WIDTH):
-                if (x, y) in important_tiles or (x, y) in time_booster_positions:
-                    continue
-                if random.random() < 0.45:
-                    game_map[y][x] = 1
-        game_map[pizzeria_pos[1]][pizzeria_pos[0]] = 2
-        for cx, cy in customer_positions:
-            game_map[cy][cx] = 3
-        if main_music_loaded:
-            pygame.mixer.music.load(main_music_path)
-            pygame.mixer.music.set_volume(0.45)
-            pygame.mixer.music.play(-1)
-
-game_state = GameState()
-
-deliveries_needed = 5
-base_time_limit = 20
-health_replenish_cost = 20
+        self.rects = []
+        self.previous = []
+        self.full = True
+        self.key = None
+        self.overflow = False  # marks were dropped this frame, so this one and the next flip
+        self.pixels = 0  # pushed by the last present
+
+    def mark(self, rect):
+        self.rects.append(rect)
+        if len(self.rects) > DIRTY_MAX_RECTS:
+            # Nothing is presenting (a benchmark), or so much moves that a flip is as cheap
+            self.rects.clear()
+            self.overflow = True
+        return rect
+
+    def invalidate(self):
+        self.full = True
+
+    def present(self, key):
+        if not DIRTY_RECTS or self.full or self.overflow or key != self.key:
+            viewport.present()
+            self.pixels = SCREEN_WIDTH * SCREEN_HEIGHT
+        else:
+            # A sprite standing still is marked in both frames; push it once
+            rects = list({tuple(r.clip(SCREEN_RECT)): None for r in self.rects + self.previous})
+            viewport.present(rects)
+            self.pixels = sum(w * h for _, _, w, h in rects)
+        self.previous, self.rects = self.rects, []
+        self.key = key
+        self.full = self.overflow
+        self.overflow = False
+        return self.pixels
+
+dirty = DirtyRects()
+
+def frame_key():
+    """What, when it changes, repaints the whole display."""
+    can_buy = game_state.state == "shop" and player.pepperonis >= health_replenish_cost  # picks the shop page
+    return (game_state.state, camera_x, camera_y, game_state.screen_shake > 0,
+            game_state.intro_instructions_expanded, profiler.visible, can_buy)
+
+def render_pepperoni_icon(_):
+    icon = pygame.Surface((36, 36), pygame.SRCALPHA)
+    pygame.draw.circle(icon, RED, (18, 18), 18)
+    for i in range(8):
+        angle = math.radians(i * 45)
+        pygame.draw.circle(icon, PIZZA_ORANGE, (18 + int(12 * math.cos(angle)), 18 + int(12 * math.sin(angle))), 5)
+    return icon
+
+def render_timer_icon(_):
+    icon = pygame.Surface((40, 40), pygame.SRCALPHA)
+    pygame.draw.circle(icon, WHITE, (20, 20), 20, 4)
+    return icon
+
+def render_shop_button(hover):
+    button = pygame.Surface(shop_button_rect.size, pygame.SRCALPHA)
+    local_rect = button.get_rect()
+    pygame.draw.rect(button, BUTTON_HOVER if hover else BUTTON_COLOR, local_rect, border_radius=20)
+    pygame.draw.rect(button, WHITE, local_rect, 5, border_radius=20)
+    text = small_font.render("SHOP (.)", True, BUTTON_TEXT_COLOR)
+    button.blit(text, text.get_rect(center=local_rect.center))
+    return button
+
+timer_icon_widget = Widget(render_timer_icon)
+timer_widget = Widget(lambda key: font.render(f"{key[0]:02}:{key[1]:02}", True, key[2]))
+pepperoni_icon_widget = Widget(render_pepperoni_icon)
+pepperoni_widget = Widget(lambda count: font.render(f" {count}", True, PIZZA_ORANGE))
+deliveries_widget = Widget(lambda made: font.render(f"Deliveries: {made}/{deliveries_needed}", True, CHEESE_YELLOW))
+guide_widget = Widget(lambda _: tiny_font.render("Reach each customer once → Deliver | Press . to open SHOP anytime", True, WHITE))
+shop_button_widget = Widget(render_shop_button)
 
 # ==========================
 # SHOP BUTTON - Larger
@@ -275,81 +1378,75 @@ shop_button_hover = False
 
 def draw_shop_button():
     global shop_button_hover
-    mouse_pos = pygame.mouse.get_pos()
+    mouse_pos = viewport.to_canvas(pygame.mouse.get_pos())
     shop_button_hover = shop_button_rect.collidepoint(mouse_pos)
-
-    color = BUTTON_HOVER if shop_button_hover else BUTTON_COLOR
-    pygame.draw.rect(screen, color, shop_button_rect, border_radius=20)
-    pygame.draw.rect(screen, WHITE, shop_button_rect, 5, border_radius=20)
-
-    text = small_font.render("SHOP (.)", True, BUTTON_TEXT_COLOR)
-    text_rect = text.get_rect(center=shop_button_rect.center)
-    screen.blit(text, text_rect)
+    dirty.mark(screen.blit(shop_button_widget.get(shop_button_hover), shop_button_rect))
 
 # ==========================
 # HUD WITH DETAILED ELEMENTS
 # ==========================
 def draw_hud():
-    if game_state.game_start_time is None:
-        return
-
-    # Calculate remaining time with pause handling
-    if game_state.timer_paused:
-        elapsed = game_state.pause_start_time - game_state.game_start_time
-    else:
-        elapsed = time.time() - game_state.game_start_time
-    remaining = max(0, base_time_limit + game_state.extra_time_bought - elapsed)
+    # The clock lives in game_core and stops while the shop is open
+    remaining = time_remaining(game_state)
     mins = int(remaining // 60)
     secs = int(remaining % 60)
     time_color = RED if remaining < 8 else NEON_YELLOW if remaining < 12 else WHITE
 
     # Timer
-    pygame.draw.circle(screen, WHITE, (35, 35), 20, 4)
-    time_text = font.render(f"{mins:02}:{secs:02}", True, time_color)
-    screen.blit(time_text, (70, 20))
+    screen.blit(timer_icon_widget.get(), (15, 15))
+    dirty.mark(screen.blit(timer_widget.get((mins, secs, time_color)), (70, 20)))
 
     # Pepperoni count
-    pygame.draw.circle(screen, RED, (35, 90), 18)
-    for i in range(8):
-        angle = i * 45
-        px = 35 + int(12 * math.cos(math.radians(angle)))
-        py = 90 + int(12 * math.sin(math.radians(angle)))
-        pygame.draw.circle(screen, PIZZA_ORANGE, (px, py), 5)
-    pep_text = font.render(f" {player.pepperonis}", True, PIZZA_ORANGE)
-    screen.blit(pep_text, (70, 80))
+    screen.blit(pepperoni_icon_widget.get(), (17, 72))
+    dirty.mark(screen.blit(pepperoni_widget.get(player.pepperonis), (70, 80)))
 
     # Delivery progress
-    del_text = font.render(f"Deliveries: {game_state.deliveries_made}/{deliveries_needed}", True, CHEESE_YELLOW)
-    screen.blit(del_text, (SCREEN_WIDTH - del_text.get_width() - 200, 20))
+    del_text = deliveries_widget.get(game_state.deliveries_made)
+    dirty.mark(screen.blit(del_text, (SCREEN_WIDTH - del_text.get_width() - 200, 20)))
 
     # Shop button
     if game_state.state in ("overworld", "combat"):
         draw_shop_button()
 
     if game_state.state == "overworld":
-        guide = tiny_font.render("Reach each customer once → Deliver | Press . to open SHOP anytime", True, WHITE)
+        guide = guide_widget.get()
         screen.blit(guide, (SCREEN_WIDTH//2 - guide.get_width()//2, SCREEN_HEIGHT - 35))
 
 # ==========================
 # DRAW FUNCTIONS - DETAILED AND POLISHED WITH PERFECT TITLE SCREEN FIT
 # ==========================
-def draw_intro():
-    screen.fill(DARK_BLUE)
-    if background:
-        dark = background.copy()
+def render_intro_backdrop(backdrop):
+    page = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+    page.fill(DARK_BLUE)
+    if backdrop:
+        dark = backdrop.copy()
         dark.set_alpha(70)
-        screen.blit(dark, (0, 0))
+        page.blit(dark, (0, 0))
 
     # Dark overlay for depth
     overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
     overlay.set_alpha(120)
     overlay.fill(INTRO_BG_OVERLAY)
-    screen.blit(overlay, (0, 0))
+    page.blit(overlay, (0, 0))
+    return page
+
+def render_instructions_overlay(_):
+    instructions_overlay = pygame.Surface((SCREEN_WIDTH - 100, SCREEN_HEIGHT - 200)).convert()
+    instructions_overlay.set_alpha(200)
+    instructions_overlay.fill(BLACK)
+    return instructions_overlay
+
+intro_backdrop_widget = Widget(render_intro_backdrop)
+instructions_overlay_widget = Widget(render_instructions_overlay)
+
+def draw_intro():
+    # The darkened city and overlay only change once, when the backdrop image streams in
+    screen.blit(intro_backdrop_widget.get(background), (0, 0))
 
     # Glowing title with multiple layers
-    title = title_font.render("SLICE CITY", True, PIZZA_ORANGE)
-    title_glow = title_font.render("SLICE CITY", True, TITLE_GLOW)
-    title_shadow = title_font.render("SLICE CITY", True, TITLE_SHADOW)
+    title = render_text(title_font, "SLICE CITY", PIZZA_ORANGE)
+    title_glow = render_text(title_font, "SLICE CITY", TITLE_GLOW)
+    title_shadow = render_text(title_font, "SLICE CITY", TITLE_SHADOW)
     title_x = SCREEN_WIDTH // 2 - title.get_width() // 2
     title_y = 80
     screen.blit(title_shadow, (title_x + 5, title_y + 5))
@@ -357,8 +1454,8 @@ def draw_intro():
     screen.blit(title, (title_x, title_y))
 
     # Subtitle with neon effect
-    subtitle = big_font.render("Extreme Night Shift Rush", True, NEON_YELLOW)
-    subtitle_shadow = big_font.render("Extreme Night Shift Rush", True, BLACK)
+    subtitle = render_text(big_font, "Extreme Night Shift Rush", NEON_YELLOW)
+    subtitle_shadow = render_text(big_font, "Extreme Night Shift Rush", BLACK)
     screen.blit(subtitle_shadow, (SCREEN_WIDTH // 2 - subtitle.get_width() // 2 + 3, title_y + 100 + 3))
     screen.blit(subtitle, (SCREEN_WIDTH // 2 - subtitle.get_width() // 2, title_y + 100))
 
@@ -377,18 +1474,15 @@ def draw_intro():
         if line == "":
             y_pos += line_height // 2
             continue
-        text = medium_font.render(line, True, WHITE)
-        text_shadow = medium_font.render(line, True, BLACK)
+        text = render_text(medium_font, line, WHITE)
+        text_shadow = render_text(medium_font, line, BLACK)
         screen.blit(text_shadow, (SCREEN_WIDTH // 2 - text.get_width() // 2 + 2, y_pos + 2))
         screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, y_pos))
         y_pos += line_height
 
     # Expanded instructions (only when toggled)
     if game_state.intro_instructions_expanded:
-        instructions_overlay = pygame.Surface((SCREEN_WIDTH - 100, SCREEN_HEIGHT - 200))
-        instructions_overlay.set_alpha(200)
-        instructions_overlay.fill(BLACK)
-        screen.blit(instructions_overlay, (50, 100))
+        screen.blit(instructions_overlay_widget.get(), (50, 100))
 
         instructions_lines = [
             "Night falls over the city...",
@@ -412,373 +1506,841 @@ def draw_intro():
             if line == "":
                 instr_y += instr_line_height // 2
                 continue
-            text = small_font.render(line, True, WHITE)
-            text_shadow = small_font.render(line, True, BLACK)
+            text = render_text(small_font, line, WHITE)
+            text_shadow = render_text(small_font, line, BLACK)
             screen.blit(text_shadow, (SCREEN_WIDTH // 2 - text.get_width() // 2 + 2, instr_y + 2))
             screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, instr_y))
             instr_y += instr_line_height
 
-    # Pulsing "Press SPACE" prompt at bottom
+    # Pulsing "Press SPACE" prompt at bottom, a loading count until the rest of the assets arrive
     pulse = 127 + int(128 * math.sin(pygame.time.get_ticks() / 300))
     prompt_color = (pulse, pulse, 255)
-    prompt = prompt_font.render("PRESS SPACE TO START", True, prompt_color)
-    prompt_shadow = prompt_font.render("PRESS SPACE TO START", True, BLACK)
+    prompt_text = "PRESS SPACE TO START" if assets_ready else "LOADING %d/%d" % assets_progress
+    prompt = prompt_font.render(prompt_text, True, prompt_color)  # a new shade every frame; cheaper than a tint
+    prompt_shadow = render_text(prompt_font, prompt_text, BLACK)
     prompt_y = SCREEN_HEIGHT - 100
-    screen.blit(prompt_shadow, (SCREEN_WIDTH // 2 - prompt.get_width() // 2 + 4, prompt_y + 4))
-    screen.blit(prompt, (SCREEN_WIDTH // 2 - prompt.get_width() // 2, prompt_y))
+    dirty.mark(screen.blit(prompt_shadow, (SCREEN_WIDTH // 2 - prompt.get_width() // 2 + 4, prompt_y + 4)))
+    dirty.mark(screen.blit(prompt, (SCREEN_WIDTH // 2 - prompt.get_width() // 2, prompt_y)))
+
+ROAMER_SIZE = (TILE_SIZE + 4, TILE_SIZE + 4)
+
+def draw_roamers():
+    """Patrolling enemies on screen, found through game_core's spatial hash rather than a scan of all of them."""
+    view = visible_tile_rect()
+    roamers = game_state.roamers
+    sprites = []
+    for i in roamers.in_rect(view.left, view.top, view.right - 1, view.bottom - 1):
+        x = roamers.xs[i] * TILE_SIZE - camera_x - 2
+        y = roamers.ys[i] * TILE_SIZE - camera_y - 4
+        img = roamer_images.get(roamers.kinds[i])
+        if img:
+            sprites.append((img, (x, y)))
+        else:
+            dirty.mark(pygame.draw.circle(screen, DEATH_RED, (x + TILE_SIZE // 2, y + TILE_SIZE // 2), TILE_SIZE // 3))
+    for rect in screen.blits(sprites):
+        dirty.mark(rect)
+
+RIVAL_RING = PIZZA_ORANGE
+ROUTE_HINT_TILES = 12
+ROUTE_HINT_COLOR = CHEESE_YELLOW
+RIVAL_NOTICE_SECONDS = 1.5
+
+route_hint_key = None
+route_hint = []  # tiles from next to the player toward the nearest open customer
+
+def route_hint_tiles():
+    """The next ``ROUTE_HINT_TILES`` tiles of the shortest street route to the nearest undelivered customer.
+
+    Read straight off game_core's flow fields and only redone when the
+    player changes tile or a delivery lands. From a building, which the
+    streets' fields do not cover, the route starts at the best open
+    neighbour.
+    """
+    global route_hint_key, route_hint
+    routes = game_state.routes
+    px, py = player.x // TILE_SIZE, player.y // TILE_SIZE
+    key = (px, py, len(game_state.delivered_customers), id(routes))
+    if key == route_hint_key:
+        return route_hint
+    route_hint_key = key
+    open_routes = [k for k in range(1, len(routes.targets)) if routes.targets[k] not in game_state.delivered_customers]
+    best = None
+    for extra, (x, y) in enumerate([(px, py)] + [(px + dx, py + dy) for dx, dy in mapgen.DIRECTIONS]):
+        if not (0 <= x < MAP_WIDTH and 0 <= y < MAP_HEIGHT):
+            continue
+        for k in open_routes:
+            d = int(routes.dist[k, y, x])
+            if d < mapgen.FAR and (best is None or d + min(extra, 1) < best[0]):
+                best = (d + min(extra, 1), k, (x, y))
+    route_hint = []
+    if best is not None:
+        _, k, tile = best
+        if tile != (px, py):
+            route_hint.append(tile)
+        while tile and len(route_hint) < ROUTE_HINT_TILES:
+            tile = routes.next_tile(k, *tile)
+            if tile:
+                route_hint.append(tile)
+    return route_hint
+
+def draw_route_hint():
+    for x, y in route_hint_tiles():
+        dirty.mark(pygame.draw.circle(screen, ROUTE_HINT_COLOR,
+                                      (x * TILE_SIZE + TILE_SIZE // 2 - camera_x, y * TILE_SIZE + TILE_SIZE // 2 - camera_y), 5))
+
+def draw_rivals():
+    rivals = game_state.rivals
+    img = roamer_images.get("Driver")
+    for x, y in zip(rivals.xs.tolist(), rivals.ys.tolist()):
+        cx = x * TILE_SIZE + TILE_SIZE // 2 - camera_x
+        cy = y * TILE_SIZE + TILE_SIZE // 2 - camera_y
+        if not (-TILE_SIZE < cx < SCREEN_WIDTH + TILE_SIZE and -TILE_SIZE < cy < SCREEN_HEIGHT + TILE_SIZE):
+            continue
+        dirty.mark(pygame.draw.circle(screen, RIVAL_RING, (cx, cy), TILE_SIZE // 2 + 2, 3))
+        if img:
+            dirty.mark(screen.blit(img, (cx - TILE_SIZE // 2 - 2, cy - TILE_SIZE // 2 - 4)))
+        else:
+            dirty.mark(pygame.draw.circle(screen, DEATH_RED, (cx, cy), TILE_SIZE // 3))
 
-def draw_overworld():
-    if background:
-        screen.blit(background, (0, 0))
-    else:
-        screen.fill(DARK_BLUE)
+rival_notice_until = 0.0  # game_state.elapsed at which the "beaten to it" notice goes away
+rival_notice_widget = Widget(lambda _: medium_font.render(
+    f"A rival got there first! -{RIVAL_STEAL_SECONDS:g}s", True, RIVAL_RING))
 
-    # Time boosters
-    for i, (bx, by) in enumerate(time_booster_positions):
-        if time_boosters_active[i]:
-            draw_time_booster(bx, by)
-
-    # Buildings
-    for y in range(MAP_HEIGHT):
-        for x in range(MAP_WIDTH):
-            tx = x * TILE_SIZE
-            ty = y * TILE_SIZE
-            tile = game_map[y][x]
-            if tile == 1:
-                pygame.draw.rect(screen, DARK_GRAY, (tx + 6, ty + 6, TILE_SIZE - 12, TILE_SIZE - 12))
-                if random.random() < 0.4:
-                    color = WINDOW_YELLOW if random.random() < 0.6 else WINDOW_BLUE
-                    pygame.draw.rect(screen, color, (tx + 10, ty + 12, 8, 10))
-                    pygame.draw.rect(screen, color, (tx + 22, ty + 18, 8, 10))
-            elif tile == 2 and pizzeria_img:
-                screen.blit(pizzeria_img, (tx - 40, ty - 70))
-            elif tile == 3 and shop_img:
-                screen.blit(shop_img, (tx - 25, ty - 55))
-                if (x, y) in delivered_customers:
-                    check = medium_font.render("✓", True, GREEN)
-                    screen.blit(check, (tx + 10, ty + 5))
+def draw_overworld():
+    update_camera()
+    animate_city_windows()
+    draw_city()
+    draw_route_hint()
+    draw_roamers()
+    draw_rivals()
 
     if player_img:
-        screen.blit(player_img, (player.x - 10, player.y - 25))
+        dirty.mark(screen.blit(player_img, (player.x - 10 - camera_x, player.y - 25 - camera_y)))
+
+    covered = city_particles.draw(screen, camera_x, camera_y)
+    if covered:
+        dirty.mark(covered)
+
+    if game_state.elapsed < rival_notice_until:
+        notice = rival_notice_widget.get()
+        dirty.mark(screen.blit(notice, (SCREEN_WIDTH // 2 - notice.get_width() // 2, 120)))
 
     draw_hud()
 
-def draw_shop():
-    screen.fill(BROWN)
+def render_shop_screen(can_buy):
+    page = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+    page.fill(BROWN)
     title = big_font.render("HEALTH REPLENISH SHOP", True, NEON_YELLOW)
-    screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 80))
+    page.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 80))
 
     item = font.render(f"Full Health Restore — Cost: {health_replenish_cost} pepperonis", True, WHITE)
-    screen.blit(item, (SCREEN_WIDTH // 2 - item.get_width() // 2, 200))
+    page.blit(item, (SCREEN_WIDTH // 2 - item.get_width() // 2, 200))
 
-    can_buy = player.pepperonis >= health_replenish_cost
     buy_prompt = font.render("Press SPACE to Buy" if can_buy else "Not enough pepperonis!", True, GREEN if can_buy else RED)
-    screen.blit(buy_prompt, (SCREEN_WIDTH // 2 - buy_prompt.get_width() // 2, 280))
+    page.blit(buy_prompt, (SCREEN_WIDTH // 2 - buy_prompt.get_width() // 2, 280))
 
     exit_text = small_font.render("Press . or ESC to Leave", True, WHITE)
-    screen.blit(exit_text, (SCREEN_WIDTH // 2 - exit_text.get_width() // 2, 400))
+    page.blit(exit_text, (SCREEN_WIDTH // 2 - exit_text.get_width() // 2, 400))
+    return page
+
+shop_screen_widget = Widget(render_shop_screen)
+shop_message_widget = Widget(lambda message: big_font.render(message, True, GREEN))
+
+def draw_shop():
+    screen.blit(shop_screen_widget.get(player.pepperonis >= health_replenish_cost), (0, 0))
 
     if game_state.shop_message_timer > 0:
-        msg = big_font.render(game_state.shop_message, True, GREEN)
-        screen.blit(msg, (SCREEN_WIDTH // 2 - msg.get_width() // 2, 350))
-        game_state.shop_message_timer -= 1
+        msg = shop_message_widget.get(game_state.shop_message)
+        dirty.mark(screen.blit(msg, (SCREEN_WIDTH // 2 - msg.get_width() // 2, 350)))
 
     draw_hud()
 
+enemy_name_widget = Widget(lambda name: medium_font.render(name, True, RED))
+combat_message_widget = Widget(lambda message: big_font.render(message, True, NEON_YELLOW))
+combat_instructions_widget = Widget(lambda _: medium_font.render("F = Throw Pizza Slice    |    R = Run Away", True, WHITE))
+
 def draw_combat():
-    shake_x = random.randint(-15, 15) if game_state.screen_shake > 0 else 0
-    shake_y = random.randint(-15, 15) if game_state.screen_shake > 0 else 0
-    if game_state.screen_shake > 0:
-        game_state.screen_shake -= 1
+    dirty.invalidate()  # the fight animates almost everywhere, so it always flips
+    shake_x = fx_rng.randint(-15, 15) if game_state.screen_shake > 0 else 0
+    shake_y = fx_rng.randint(-15, 15) if game_state.screen_shake > 0 else 0
 
     screen.fill(BLACK)
-    if background:
-        dark = background.copy()
-        dark.set_alpha(100)
-        screen.blit(dark, (shake_x, shake_y))
+    if combat_background:
+        screen.blit(combat_background, (shake_x, shake_y))
 
     enemy_x = SCREEN_WIDTH - 280 + shake_x
     enemy_y = 180 + shake_y
 
-    img = enemy_images.get(game_state.current_enemy["name"])
+    enemy = game_state.current_enemy
+    name = enemy.name
+    img = enemy_image(name, flash=enemy.flash > 0)
     if img:
-        enemy_surf = img.copy()
-        if game_state.current_enemy.get("flash", 0) > 0:
-            enemy_surf.fill(FLASH_RED, special_flags=pygame.BLEND_ADD)
-            game_state.current_enemy["flash"] -= 1
-        screen.blit(enemy_surf, (enemy_x, enemy_y))
+        screen.blit(img, (enemy_x, enemy_y))
 
     health_bar_y = enemy_y - 50
     pygame.draw.rect(screen, HEALTH_BAR_BG, (enemy_x - 20, health_bar_y, 220, 30))
-    health_ratio = max(game_state.current_enemy["health"] / game_state.current_enemy["max_health"], 0)
+    health_ratio = max(enemy.health / enemy.max_health, 0)
     pygame.draw.rect(screen, GREEN, (enemy_x - 20, health_bar_y, int(220 * health_ratio), 30))
     pygame.draw.rect(screen, HEALTH_BAR_BORDER, (enemy_x - 20, health_bar_y, 220, 30), 4)
 
-    name_text = medium_font.render(game_state.current_enemy["name"], True, RED)
+    name_text = enemy_name_widget.get(name)
     screen.blit(name_text, (SCREEN_WIDTH // 2 - name_text.get_width() // 2, health_bar_y - 40))
 
     pygame.draw.rect(screen, HEALTH_BAR_BG, (40, 490, 300, 45))
     pygame.draw.rect(screen, GREEN, (40, 490, int(300 * player.health / player.max_health), 45))
     pygame.draw.rect(screen, HEALTH_BAR_BORDER, (40, 490, 300, 45), 4)
 
-    if player_img:
-        screen.blit(pygame.transform.scale(player_img, (260, 300)), (40 + shake_x, 220 + shake_y))
-
-    for p in game_state.pizza_projectiles[:]:
-        p["pos"][0] += p["vel"]
-        if pizza_img:
-            rot = pygame.transform.rotate(pizza_img, -p["pos"][0] * 7)
-            screen.blit(rot, (p["pos"][0] - 45 + shake_x, p["pos"][1] - 45 + shake_y))
-
-        if p["pos"][0] > 650:
-            game_state.pizza_projectiles.remove(p)
-            damage = random.randint(30, 50)
-            game_state.current_enemy["health"] -= damage
-            game_state.current_enemy["flash"] = 18
-            game_state.screen_shake = 25
-            if hit_sound:
-                hit_sound.play()
-            game_state.combat_message = f"-{damage}!"
-            game_state.combat_message_timer = 90
-
-            if game_state.current_enemy["health"] <= 0:
-                reward = game_state.current_enemy["pepperonis"]
-                player.pepperonis += reward
-                game_state.combat_message = f"Defeated! +{reward} pepperonis!"
-                game_state.combat_message_timer = 160
-                game_state.state = "overworld"
-                game_state.current_enemy = None
-                game_state.pizza_projectiles.clear()
+    if combat_chef:
+        screen.blit(combat_chef, (40 + shake_x, 220 + shake_y))
+
+    # Projectiles move and hit in game_core; this only draws them, between their last two steps
+    pizzas = game_state.pizzas
+    if pizza_frames and len(pizzas):
+        live = pizzas.live()
+        x = pizzas.prev_x[live] + (pizzas.x[live] - pizzas.prev_x[live]) * render_alpha
+        angle = pizzas.angle[live] + PIZZA_SPIN * (pizzas.x[live] - x)
+        frames = (angle % 360 // PIZZA_ROTATION_STEP).astype(int).tolist()
+        screen.blits([(pizza_frames[f], (px - 45 + shake_x, py - 45 + shake_y))
+                      for f, px, py in zip(frames, x.tolist(), pizzas.y[live].tolist())], doreturn=False)
+
+    combat_particles.draw(screen, -shake_x, -shake_y)
 
     if game_state.combat_message_timer > 0:
-        msg = big_font.render(game_state.combat_message, True, NEON_YELLOW)
+        msg = combat_message_widget.get(game_state.combat_message)
         screen.blit(msg, (SCREEN_WIDTH // 2 - msg.get_width() // 2, 160))
-        game_state.combat_message_timer -= 1
 
-    instr = medium_font.render("F = Throw Pizza Slice    |    R = Run Away", True, WHITE)
-    screen.blit(instr, (40, 560))
+    screen.blit(combat_instructions_widget.get(), (40, 560))
 
     draw_hud()
 
-def draw_victory():
-    screen.fill((0, 70, 0))
+def render_victory_screen(pepperonis):
+    page = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+    page.fill((0, 70, 0))
     win = title_font.render("VICTORY!", True, VICTORY_GOLD)
-    screen.blit(win, (SCREEN_WIDTH // 2 - win.get_width() // 2, 120))
+    page.blit(win, (SCREEN_WIDTH // 2 - win.get_width() // 2, 120))
     msg = big_font.render("You delivered to all 5 customers in 20 seconds!", True, WHITE)
-    screen.blit(msg, (SCREEN_WIDTH // 2 - msg.get_width() // 2, 220))
-    score = big_font.render(f"Final Pepperonis: {player.pepperonis}", True, PIZZA_ORANGE)
-    screen.blit(score, (SCREEN_WIDTH // 2 - score.get_width() // 2, 300))
+    page.blit(msg, (SCREEN_WIDTH // 2 - msg.get_width() // 2, 220))
+    score = big_font.render(f"Final Pepperonis: {pepperonis}", True, PIZZA_ORANGE)
+    page.blit(score, (SCREEN_WIDTH // 2 - score.get_width() // 2, 300))
     restart = font.render("Press R to Rush Again", True, WHITE)
-    screen.blit(restart, (SCREEN_WIDTH // 2 - restart.get_width() // 2, 400))
+    page.blit(restart, (SCREEN_WIDTH // 2 - restart.get_width() // 2, 400))
+    return page
 
-def draw_gameover():
-    screen.fill(BLACK)
+def render_gameover_screen(pepperonis):
+    page = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+    page.fill(BLACK)
     over = title_font.render("YOU GOT WHACKED!", True, DEATH_RED)
-    screen.blit(over, (SCREEN_WIDTH // 2 - over.get_width() // 2, 120))
-    final = big_font.render(f"Pepperonis Earned: {player.pepperonis}", True, PIZZA_ORANGE)
-    screen.blit(final, (SCREEN_WIDTH // 2 - final.get_width() // 2, 240))
+    page.blit(over, (SCREEN_WIDTH // 2 - over.get_width() // 2, 120))
+    final = big_font.render(f"Pepperonis Earned: {pepperonis}", True, PIZZA_ORANGE)
+    page.blit(final, (SCREEN_WIDTH // 2 - final.get_width() // 2, 240))
     restart = font.render("Press R to Try Again", True, WHITE)
-    screen.blit(restart, (SCREEN_WIDTH // 2 - restart.get_width() // 2, 380))
+    page.blit(restart, (SCREEN_WIDTH // 2 - restart.get_width() // 2, 380))
+    return page
+
+victory_screen_widget = Widget(render_victory_screen)
+gameover_screen_widget = Widget(render_gameover_screen)
+
+# ==========================
+# LEADERBOARD - SLICE_CITY_LEADERBOARD=file.db, WRITTEN BEHIND THE FRAME LOOP (see leaderboard.py)
+# ==========================
+LEADERBOARD_PATH = os.environ.get("SLICE_CITY_LEADERBOARD", "slice_city_scores.db")
+LEADERBOARD_ROWS = 5
+LEADERBOARD_Y = 440
+
+leaderboard = None  # opened by main, so replays and benchmarks never record runs
+standings = None  # (top runs, best run on this city, this run) for the end screen
+
+def open_leaderboard():
+    global leaderboard
+    try:
+        leaderboard = Leaderboard(LEADERBOARD_PATH, threaded=not IS_BROWSER)
+    except sqlite3.Error as e:
+        print(f"[WARNING] Leaderboard unavailable ({LEADERBOARD_PATH}): {e}")
+
+def finish_run():
+    """Store the run that just ended and look up what the end screen shows; both return at once."""
+    global standings
+    result = RunResult(player.pepperonis, round(time_remaining(game_state), 2), game_state.deliveries_made,
+                       player.health, game_state.map_seed, game_state.state == "victory")
+    leaderboard.submit(result)
+    standings = (tuple(leaderboard.top(LEADERBOARD_ROWS)), tuple(leaderboard.top(1, game_state.map_seed)), result)
+
+def render_leaderboard(standings):
+    top, city_best, result = standings
+    lines = [("TOP RUNS", NEON_YELLOW)]
+    marked = False
+    for rank, run in enumerate(top, 1):
+        mine = run == result and not marked
+        marked = marked or mine
+        lines.append((f"{rank}. {run.pepperonis:4d} pepperonis   {run.time_left:5.1f}s left   "
+                      f"{run.deliveries}/{deliveries_needed} delivered   city {run.map_seed:08x}",
+                      PIZZA_ORANGE if mine else WHITE))
+    if city_best:
+        lines.append((f"Best on this city: {city_best[0].pepperonis} pepperonis", CHEESE_YELLOW))
+    rendered = [tiny_font.render(text, True, color) for text, color in lines]
+    page = pygame.Surface((max(r.get_width() for r in rendered), 22 * len(rendered)), pygame.SRCALPHA)
+    for i, text in enumerate(rendered):
+        page.blit(text, (page.get_width() // 2 - text.get_width() // 2, 22 * i))
+    return page
+
+leaderboard_widget = Widget(render_leaderboard)
+
+def draw_standings():
+    if standings:
+        board = leaderboard_widget.get(standings)
+        screen.blit(board, (SCREEN_WIDTH // 2 - board.get_width() // 2, LEADERBOARD_Y))
+
+def draw_victory():
+    screen.blit(victory_screen_widget.get(player.pepperonis), (0, 0))
+    draw_standings()
+
+def draw_gameover():
+    screen.blit(gameover_screen_widget.get(player.pepperonis), (0, 0))
+    draw_standings()
+
+# ==========================
+# FRAME PROFILER - F3 OVERLAY, SLICE_CITY_TRACE=file.json WRITES A CHROME TRACE ON EXIT
+# ==========================
+PROFILE_PHASES = ("events", "update", "draw", "profiler", "flip", "tick")
+PROFILE_FRAMES = 600  # ring buffer length, 10 s at 60 fps
+PROFILE_TRACE_PATH = os.environ.get("SLICE_CITY_TRACE")
+PROFILER_KEY = pygame.K_F3
+PROFILE_GRAPH_FRAMES = 240
+PROFILE_GRAPH_MS = 50  # frame time at the top of the graph
+
+class FrameProfiler:
+    """Seconds spent in each phase of the last ``frames`` frames, kept in a ring buffer.
+
+    ``begin_frame`` starts a row and every ``mark(phase)`` charges the time
+    since the previous mark to ``phase``, so the phases of a frame are
+    back to back and sum to the whole frame.
+    """
+    def __init__(self, frames=PROFILE_FRAMES):
+        self.starts = [0.0] * frames
+        self.samples = [[0.0] * len(PROFILE_PHASES) for _ in range(frames)]
+        self.phase_index = {phase: i for i, phase in enumerate(PROFILE_PHASES)}
+        self.frame = 0
+        self.row = self.samples[0]
+        self.last = 0.0
+        self.visible = False
+
+    def begin_frame(self):
+        self.last = time.perf_counter()
+        slot = self.frame % len(self.starts)
+        self.starts[slot] = self.last
+        self.row = self.samples[slot]
+        for i in range(len(self.row)):
+            self.row[i] = 0.0
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.row[self.phase_index[phase]] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        self.frame += 1
+
+    def recent(self):
+        """Indices of the completed frames still in the buffer, oldest first."""
+        size = len(self.starts)
+        return [i % size for i in range(max(0, self.frame - size), self.frame)]
+
+    def percentiles(self, quantiles=(50, 95, 99)):
+        """Milliseconds per phase (and "frame" for the total) at each of ``quantiles``."""
+        rows = [self.samples[i] for i in self.recent()]
+        if not rows:
+            return {}
+        result = {}
+        columns = list(zip(*rows)) + [[sum(row) for row in rows]]
+        for name, column in zip(PROFILE_PHASES + ("frame",), columns):
+            ordered = sorted(column)
+            result[name] = [ordered[min(len(ordered) - 1, len(ordered) * q // 100)] * 1000 for q in quantiles]
+        return result
+
+    def trace_events(self):
+        """The buffer as Chrome trace-event "complete" events (chrome://tracing, Perfetto)."""
+        events = []
+        for i in self.recent():
+            ts = self.starts[i] * 1e6
+            row = self.samples[i]
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1, "ts": ts, "dur": sum(row) * 1e6})
+            for phase, seconds in zip(PROFILE_PHASES, row):
+                if seconds:
+                    events.append({"name": phase, "ph": "X", "pid": 1, "tid": 1, "ts": ts, "dur": seconds * 1e6})
+                    ts += seconds * 1e6
+        return events
+
+    def write_trace(self, path):
+        try:
+            with open(path, "w") as f:
+                json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+            print(f"[PROFILE] wrote {min(self.frame, len(self.starts))} frames to {path}")
+        except OSError as e:
+            print(f"[WARNING] Could not write frame trace {path}: {e}")
+
+profiler = FrameProfiler()
+
+def render_profiler_table(_):
+    stats = profiler.percentiles()
+    panel = pygame.Surface((250, 20 + 16 * (len(stats) + 1)), pygame.SRCALPHA)
+    panel.fill((0, 0, 0, 190))
+    panel.blit(micro_font.render("ms", True, WHITE), (8, 6))
+    for col, label in enumerate(("p50", "p95", "p99")):
+        panel.blit(micro_font.render(label, True, WHITE), (96 + 56 * col, 6))
+    for row, (phase, values) in enumerate(stats.items(), 1):
+        color = NEON_YELLOW if phase == "frame" else WHITE
+        panel.blit(micro_font.render(phase, True, color), (8, 6 + 16 * row))
+        for col, ms in enumerate(values):
+            panel.blit(micro_font.render(f"{ms:6.2f}", True, color), (84 + 56 * col, 6 + 16 * row))
+    return panel
+
+profiler_table_widget = Widget(render_profiler_table)
+
+def draw_profiler():
+    # The table only needs to refresh a couple of times a second
+    table = profiler_table_widget.get(profiler.frame // 30)
+    x = SCREEN_WIDTH - table.get_width() - 10
+    y = SCREEN_HEIGHT - table.get_height() - 90
+    screen.blit(table, (x, y))
+
+    graph = pygame.Rect(x, y + table.get_height() + 4, table.get_width(), 70)
+    dirty.mark(pygame.Rect(x, y, table.get_width(), graph.bottom - y))
+    pygame.draw.rect(screen, BLACK, graph)
+    budget_y = graph.bottom - int(graph.height * 1000 / 60 / PROFILE_GRAPH_MS)
+    pygame.draw.line(screen, GREEN, (graph.left, budget_y), (graph.right - 1, budget_y))
+    frames = profiler.recent()[-PROFILE_GRAPH_FRAMES:]
+    if len(frames) > 1:
+        step_x = graph.width / PROFILE_GRAPH_FRAMES
+        points = []
+        for n, i in enumerate(frames):
+            ms = min(sum(profiler.samples[i]) * 1000, PROFILE_GRAPH_MS)
+            points.append((graph.left + n * step_x, graph.bottom - 1 - ms * (graph.height - 1) / PROFILE_GRAPH_MS))
+        pygame.draw.lines(screen, NEON_YELLOW, False, points)
+
+# ==========================
+# TELEMETRY - SLICE_CITY_TELEMETRY=directory, WRITTEN BEHIND THE FRAME LOOP (see telemetry.py)
+# ==========================
+TELEMETRY_DIR = os.environ.get("SLICE_CITY_TELEMETRY")  # off unless set
+
+telemetry = None  # opened by main, like the leaderboard
+
+def open_telemetry():
+    global telemetry
+    if not TELEMETRY_DIR:
+        return
+    try:
+        telemetry = Telemetry(TELEMETRY_DIR, threaded=not IS_BROWSER)
+    except OSError as e:
+        print(f"[WARNING] Telemetry unavailable ({TELEMETRY_DIR}): {e}")
+
+def record_events(events):
+    """One telemetry record per game event, with the run it belongs to and when in the run it happened."""
+    for kind, value in events:
+        fields = {"seed": game_state.seed, "map_seed": game_state.map_seed, "elapsed": round(game_state.elapsed, 3)}
+        if kind in ("deliver", "time_boost", "stolen"):
+            fields["x"], fields["y"] = value
+        elif kind == "encounter":
+            fields["enemy"] = value
+            fields["x"], fields["y"] = player_tile(game_state)
+        elif kind in ("hit", "damage"):
+            fields["damage"] = value
+        elif kind == "throw":
+            fields["in_flight"] = value
+        elif kind == "run":
+            fields["escaped"] = bool(value)
+        elif kind == "defeat":
+            fields["reward"] = value
+        elif kind == "buy":
+            fields["cost"] = value
+        elif kind == "victory":
+            fields["time_left"] = round(value, 3)
+        elif kind == "gameover":
+            fields["cause"] = value
+        telemetry.emit(kind, **fields)
+
+def record_frame():
+    """The frame the profiler just finished, whole and without the wait for the FPS cap."""
+    row = profiler.row
+    frame_ms = sum(row) * 1000
+    telemetry.frame(game_state.state, frame_ms, frame_ms - row[profiler.phase_index["tick"]] * 1000)
+
+# ==========================
+# SOUND EFFECTS - RESERVED CHANNEL GROUPS, VOICE LIMITS, ONE TRIGGER PER SOUND PER FRAME
+# ==========================
+SOUND_GROUPS = {"combat": 5, "world": 2, "ui": 1}  # mixer channels reserved per group
+SOUND_SETTINGS = {  # sound: (group, most copies playing at once)
+    "throw_sound": ("combat", 2),
+    "hit_sound": ("combat", 2),
+    "damage_sound": ("combat", 1),
+    "run_sound": ("combat", 1),
+    "deliver_sound": ("world", 1),
+    "time_boost_sound": ("world", 1),
+    "buy_sound": ("ui", 1),
+}
+
+class SoundBoard:
+    """Plays effects on a fixed set of reserved channels, so the mixer never does more than that.
+
+    ``trigger`` only queues a sound; ``flush`` starts the queue once per
+    frame, so a sound triggered twice in one frame plays once. A sound at
+    its voice limit restarts on its own oldest channel, and a full group
+    hands over the channel that started longest ago. ``pygame.mixer.Sound``
+    has already decoded each file to the mixer's format at load time, so
+    starting one is a buffer hand-off.
+    """
+    def __init__(self):
+        self.sounds = {}
+        self.groups = {}
+        self.voices = collections.defaultdict(collections.deque)  # sound name -> its channels, oldest first
+        self.started = {}  # channel -> frame it last started on
+        self.pending = []
+        self.frame = 0
+
+    def setup(self):
+        if not pygame.mixer.get_init():
+            return
+        total = sum(SOUND_GROUPS.values())
+        pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)  # keep Sound.play() elsewhere off these channels
+        first = 0
+        for group, count in SOUND_GROUPS.items():
+            self.groups[group] = [pygame.mixer.Channel(i) for i in range(first, first + count)]
+            first += count
+
+    def add(self, name, sound):
+        if sound:
+            self.sounds[name] = sound
+
+    def trigger(self, name):
+        if name in self.sounds and name not in self.pending:
+            self.pending.append(name)
+
+    def flush(self):
+        for name in self.pending:
+            self._start(name)
+        self.pending.clear()
+        self.frame += 1
+
+    def _start(self, name):
+        sound = self.sounds[name]
+        group, max_voices = SOUND_SETTINGS[name]
+        channels = self.groups.get(group)
+        if not channels:
+            return
+        voices = self.voices[name]
+        for channel in list(voices):
+            # Finished, or taken over by another sound in the group
+            if not channel.get_busy() or channel.get_sound() is not sound:
+                voices.remove(channel)
+        if len(voices) >= max_voices:
+            channel = voices.popleft()
+        else:
+            channel = next((c for c in channels if not c.get_busy()), None)
+            if channel is None:
+                channel = min(channels, key=lambda c: self.started.get(c, -1))
+        channel.play(sound)
+        voices.append(channel)
+        self.started[channel] = self.frame
+
+sfx = SoundBoard()
+sfx.setup()
+
+# ==========================
+# NEXT CITY - BUILT WHILE THE END SCREEN IS UP, SO RESTART ONLY SWAPS IT IN
+# ==========================
+class RunPreparer:
+    """Builds the next run ahead of time with ``game_core.build_run``, plus its window lights.
+
+    On the desktop the build runs on one worker thread; in the browser,
+    which has none, ``pump`` builds it in one frame instead. Finished runs
+    are handed to game_core from ``pump`` on the main thread, which then
+    renders one chunk of the new city's first view per frame, so RESTART
+    only swaps the city, roamers, rivals, lights and chunks in. The chunks
+    stay on the main thread because they blit the same art the end screen
+    is drawing with.
+    """
+    def __init__(self):
+        self.pool = None
+        self.pending = collections.OrderedDict()  # upcoming_run key -> Future, or None for a browser build
+
+    def request(self, state):
+        """Start on ``state``'s next run unless it is built or building already."""
+        key = upcoming_run(state)
+        if key in self.pending or run_is_prepared(key):
+            return
+        if IS_BROWSER:
+            self.pending[key] = None
+            return
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="run-prep")
+        self.pending[key] = self.pool.submit(prepare_run, key)
+
+    def pump(self):
+        for key, future in list(self.pending.items()):
+            if future is None:
+                self.add(key, prepare_run(key))
+                del self.pending[key]
+                break  # one build per frame
+            if future.done():
+                del self.pending[key]
+                try:
+                    self.add(key, future.result())
+                except Exception as e:
+                    print(f"[WARNING] Could not prepare the next run: {e}")
+        self.render_ahead()
+
+    def add(self, key, prepared):
+        run, lit = prepared
+        add_prepared_run(key, run)
+        sprites = landmark_sprites(run.game_map, [True] * len(time_booster_positions), ())
+        prepared_layers[(run.seed, run.map_seed)] = (run.game_map, lit, sprites, {})
+        while len(prepared_layers) > PREPARED_RUNS:
+            prepared_layers.popitem(last=False)
+
+    def render_ahead(self):
+        """Render one chunk of the newest prepared city's first view, if any is missing."""
+        if not prepared_layers or not assets_ready:
+            return  # chunks would be cached with the fallback art
+        game_map, lit, sprites, chunks = prepared_layers[next(reversed(prepared_layers))]
+        camera = camera_for(Player())
+        for key in chunks_in_rect(pygame.Rect(camera, (SCREEN_WIDTH, SCREEN_HEIGHT))):
+            if key not in chunks:
+                chunks[key] = render_chunk(*key, game_map, lit, sprites)
+                return
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+def prepare_run(key):
+    """(run, lit windows) for an ``upcoming_run`` key; touches no pygame state, so it may run on a worker."""
+    run = build_run(key)
+    return run, roll_lit_windows(run.seed, run.map_seed, run.game_map)
+
+run_preparer = RunPreparer()
+
+def prerender_city():
+    """While the title screen is up, render one chunk the first overworld frame will show."""
+    if not assets_ready:
+        return  # chunks would be cached with the fallback art
+    update_camera()
+    visible = chunks_in_rect(pygame.Rect(camera_x, camera_y, SCREEN_WIDTH, SCREEN_HEIGHT))
+    for key in visible:
+        if chunk_cache.peek(key) is None:
+            chunk_cache.get(key, visible)
+            return
+
+# ==========================
+# INPUT AND GAME EVENTS - KEYS BECOME game_core ACTIONS, EVENTS BECOME SOUNDS
+# ==========================
+MOVE_KEYS = {
+    pygame.K_LEFT: MOVE_LEFT, pygame.K_a: MOVE_LEFT,
+    pygame.K_RIGHT: MOVE_RIGHT, pygame.K_d: MOVE_RIGHT,
+    pygame.K_UP: MOVE_UP, pygame.K_w: MOVE_UP,
+    pygame.K_DOWN: MOVE_DOWN, pygame.K_s: MOVE_DOWN,
+}
+
+def action_for_key(key):
+    state = game_state.state
+    # Global shop access - the game_core clock pauses while the shop is open
+    if key == pygame.K_PERIOD and state in ("overworld", "combat"):
+        return OPEN_SHOP
+    if state == "intro":
+        # Toggle expanded instructions with M key; SPACE waits for the streamed assets
+        if key == pygame.K_SPACE:
+            return START if assets_ready else None
+        return TOGGLE_INSTRUCTIONS if key == pygame.K_m else None
+    if state in ("victory", "gameover"):
+        return RESTART if key == pygame.K_r else None
+    if state == "overworld":
+        return MOVE_KEYS.get(key)
+    if state == "combat":
+        return {pygame.K_f: THROW, pygame.K_r: RUN}.get(key)
+    if state == "shop":
+        if key == pygame.K_SPACE:
+            return BUY
+        if key in (pygame.K_ESCAPE, pygame.K_PERIOD):
+            return CLOSE_SHOP
+    return None
+
+def apply_game_events(events):
+    global rival_notice_until
+    if telemetry and events:
+        record_events(events)
+    for kind, value in events:
+        if kind == "deliver":
+            sfx.trigger("deliver_sound")
+            patch_city_delivery(*value)
+            spawn_effect(city_particles, "deliver", (value[0] + 0.5) * TILE_SIZE, (value[1] + 0.5) * TILE_SIZE)
+        elif kind == "time_boost":
+            sfx.trigger("time_boost_sound")
+            remove_city_booster(*value)
+        elif kind == "throw":
+            sfx.trigger("throw_sound")
+        elif kind == "hit":
+            sfx.trigger("hit_sound")
+            spawn_effect(combat_particles, "hit", PIZZA_HIT_X, PIZZA_START[1])
+        elif kind == "damage":
+            sfx.trigger("damage_sound")
+            spawn_effect(combat_particles, "damage", *COMBAT_CHEF_CENTER)
+        elif kind == "defeat":
+            # Back on the map already; the reward spills out around the chef
+            city_particles.spawn("pepperoni", value * PEPPERONI_DROPS, player.x + TILE_SIZE // 2, player.y,
+                                 200, 0.9)
+        elif kind == "encounter":
+            combat_particles.clear()
+        elif kind == "run" and value:
+            sfx.trigger("run_sound")
+        elif kind == "buy":
+            sfx.trigger("buy_sound")
+        elif kind in ("victory", "gameover"):
+            run_preparer.request(game_state)
+            if leaderboard:
+                finish_run()
+        elif kind == "stolen":
+            rival_notice_until = game_state.elapsed + RIVAL_NOTICE_SECONDS
+            sfx.trigger("run_sound")
+        elif kind == "restart":
+            reset_city_layer()
+            city_particles.clear()
+            if main_music_loaded:
+                pygame.mixer.music.play(-1)
 
 # ==========================
 # MAIN GAME LOOP
 # ==========================
+def draw_screen():
+    if game_state.state == "intro":
+        draw_intro()
+    elif game_state.state == "overworld":
+        draw_overworld()
+    elif game_state.state == "combat":
+        draw_combat()
+    elif game_state.state == "shop":
+        draw_shop()
+    elif game_state.state == "victory":
+        draw_victory()
+    elif game_state.state == "gameover":
+        draw_gameover()
+
 async def main():
-    global background, player_img, pizza_img, pizzeria_img, shop_img, time_boost_img
-    global enemy_images, throw_sound, hit_sound, deliver_sound, buy_sound, run_sound
-    global damage_sound, time_boost_sound, moves_since_encounter
-
-    # Load all images and sounds inside the async main function
-    background = load_image("nyc_background.png", (SCREEN_WIDTH, SCREEN_HEIGHT))
-    player_img = load_image("chef.png", (TILE_SIZE + 8, TILE_SIZE + 20))
-    pizza_img = load_image("pizza_slice.png", (80, 80))
-    pizzeria_img = load_image("pizzeria.png", (TILE_SIZE*3, TILE_SIZE*3))
-    shop_img = load_image("shop.png", (TILE_SIZE*2, TILE_SIZE*2))
-    time_boost_img = load_image("time_boost.png", (TILE_SIZE, TILE_SIZE))
-
-    enemy_images = {
-        "Street Thug": load_image("thug.png", (180, 180)),
-        "Rival Driver": load_image("delivery_guy.png", (180, 180)),
-        "Gang Enforcer": load_image("gangster.png", (180, 180)),
-        "Rat King": load_image("rat_king.png", (220, 220)),
-    }
-
-    throw_sound = load_sound("throw.ogg", 0.7)
-    hit_sound = load_sound("hit.ogg", 0.8)
-    deliver_sound = load_sound("deliver.ogg", 0.9)
-    buy_sound = load_sound("buy.ogg", 0.6)
-    run_sound = load_sound("run.ogg", 0.7)
-    damage_sound = load_sound("damage.ogg", 0.8)
-    time_boost_sound = load_sound("time_boost.ogg", 0.8)
-
-    # Load and play the main music
-    try:
-        pygame.mixer.music.load("assets/italian_music.ogg")
-        pygame.mixer.music.set_volume(0.45)
-        pygame.mixer.music.play(-1)
-    except pygame.error:
-        print("[WARNING] Could not load/play main music")
+    global render_alpha
+    if IS_BROWSER and assets.bundle is None:
+        # The web build serves the bundle beside the page; the title art is read as soon as its bytes are in
+        assets.stream_bundle(ASSET_BUNDLE_URL, fetch_range)
+    # The intro only needs its backdrop; everything else streams in while it is up
+    await load_title_assets()
+    loader = asyncio.create_task(stream_assets())
+
+    open_leaderboard()
+    open_telemetry()
 
     running = True
-    current_time = time.time()
+    accumulator = 0.0
+    last_time = time.perf_counter()
+    sim_ticks = 0
+    recording = Recording(game_state.seed) if RECORD_PATH else None
 
     while running:
-        current_time = time.time()
-
+        profiler.begin_frame()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
 
-            if event.type == pygame.KEYDOWN:
-                # Global shop access - pause timer when opening
-                if event.key == pygame.K_PERIOD and game_state.state in ("overworld", "combat"):
-                    game_state.previous_state = game_state.state
-                    game_state.state = "shop"
-                    game_state.timer_paused = True
-                    game_state.pause_start_time = current_time
-                    continue
-
-                # Toggle expanded instructions with M key
-                if event.key == pygame.K_m and game_state.state == "intro":
-                    game_state.intro_instructions_expanded = not game_state.intro_instructions_expanded
-                    continue
-
-                if game_state.state in ("victory", "gameover"):
-                    if event.key == pygame.K_r:
-                        game_state.reset()
-                        continue
-
-                if game_state.state == "intro":
-                    if event.key == pygame.K_SPACE:
-                        game_state.state = "overworld"
-                        game_state.game_start_time = time.time()
-
-                elif game_state.state == "overworld":
-                    old_tile_x = player.x // TILE_SIZE
-                    old_tile_y = player.y // TILE_SIZE
-
-                    if event.key in (pygame.K_LEFT, pygame.K_a):
-                        player.x -= TILE_SIZE
-                    elif event.key in (pygame.K_RIGHT, pygame.K_d):
-                        player.x += TILE_SIZE
-                    elif event.key in (pygame.K_UP, pygame.K_w):
-                        player.y -= TILE_SIZE
-                    elif event.key in (pygame.K_DOWN, pygame.K_s):
-                        player.y += TILE_SIZE
-
-                    player.x = max(0, min(player.x, (MAP_WIDTH - 1) * TILE_SIZE))
-                    player.y = max(0, min(player.y, (MAP_HEIGHT - 1) * TILE_SIZE))
-
-                    tile_x = player.x // TILE_SIZE
-                    tile_y = player.y // TILE_SIZE
-                    current_tile = (tile_x, tile_y)
-
-                    if (tile_x, tile_y) != (old_tile_x, old_tile_y):
-                        moves_since_encounter += 1
-
-                    if game_map[tile_y][tile_x] == 3 and current_tile not in delivered_customers:
-                        game_state.deliveries_made += 1
-                        delivered_customers.add(current_tile)
-                        if deliver_sound:
-                            deliver_sound.play()
-                        if game_state.deliveries_made >= deliveries_needed:
-                            game_state.state = "victory"
-
-                    # Time booster pickup
-                    for i, (bx, by) in enumerate(time_booster_positions):
-                        if current_tile == (bx, by) and time_boosters_active[i]:
-                            game_state.extra_time_bought += 3
-                            time_boosters_active[i] = False
-                            if time_boost_sound:
-                                time_boost_sound.play()
-                            game_state.shop_message = "Time Booster Collected +3s!"
-                            game_state.shop_message_timer = 120
-
-                    if moves_since_encounter >= 3 and random.random() < ENEMY_ENCOUNTER_CHANCE and current_tile not in important_tiles:
-                        key = random.choice(list(enemy_templates.keys()))
-                        game_state.current_enemy = enemy_templates[key].copy()
-                        game_state.current_enemy["max_health"] = game_state.current_enemy["health"]
-                        game_state.current_enemy["flash"] = 0
-                        game_state.state = "combat"
-                        game_state.pizza_projectiles.clear()
-                        last_encounter_tile = current_tile
-                        moves_since_encounter = 0
-
-                elif game_state.state == "combat":
-                    if event.key == pygame.K_f:
-                        game_state.pizza_projectiles.append({"pos": [80, 340], "vel": 32})
-                        if throw_sound:
-                            throw_sound.play()
-                    elif event.key == pygame.K_r:
-                        if random.random() < 0.7:
-                            if run_sound:
-                                run_sound.play()
-                            game_state.state = "overworld"
-                            game_state.current_enemy = None
-                            game_state.pizza_projectiles.clear()
-                            moves_since_encounter = 0
-
-                elif game_state.state == "shop":
-                    if event.key == pygame.K_SPACE and player.pepperonis >= health_replenish_cost:
-                        player.pepperonis -= health_replenish_cost
-                        player.health = player.max_health
-                        game_state.shop_message = "Health Fully Restored!"
-                        game_state.shop_message_timer = 120
-                        if buy_sound:
-                            buy_sound.play()
-                    elif event.key in (pygame.K_ESCAPE, pygame.K_PERIOD):
-                        # Resume timer when leaving shop
-                        if game_state.timer_paused:
-                            pause_duration = current_time - game_state.pause_start_time
-                            game_state.extra_time_bought += pause_duration
-                            game_state.timer_paused = False
-                        game_state.state = game_state.previous_state or "overworld"
-
-            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            action = None
+            if event.type == pygame.KEYDOWN and event.key == PROFILER_KEY:
+                profiler.visible = not profiler.visible
+            elif event.type == pygame.KEYDOWN:
+                action = action_for_key(event.key)
+            elif event.type == pygame.WINDOWEXPOSED:
+                dirty.invalidate()
+            elif event.type == pygame.VIDEORESIZE:
+                viewport.resize()
+                dirty.invalidate()
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 if shop_button_hover and game_state.state in ("overworld", "combat"):
-                    game_state.previous_state = game_state.state
-                    game_state.state = "shop"
-                    game_state.timer_paused = True
-                    game_state.pause_start_time = current_time
-
-        # Timer - only runs in overworld and combat
-        if game_state.game_start_time and game_state.state in ("overworld", "combat"):
-            elapsed = time.time() - game_state.game_start_time
-            if elapsed > base_time_limit + game_state.extra_time_bought:
-                game_state.state = "gameover"
-
-        # Enemy attack
-        if game_state.state == "combat" and random.random() < 0.035 and not game_state.pizza_projectiles:
-            dmg = game_state.current_enemy["attack"]
-            player.health -= dmg
-            game_state.screen_shake = 30
-            game_state.combat_message = f"-{dmg} HP!"
-            game_state.combat_message_timer = 90
-            if damage_sound:
-                damage_sound.play()
-            if player.health <= 0:
-                game_state.state = "gameover"
-
-        # Draw current state
+                    action = OPEN_SHOP
+            if action is not None:
+                if recording:
+                    recording.record(sim_ticks, action)
+                apply_game_events(step(game_state, action))
+        profiler.mark("events")
+
+        # Timer, enemy attacks and projectiles, in fixed steps whatever the frame rate
+        now = time.perf_counter()
+        accumulator += min(now - last_time, MAX_FRAME_TIME)
+        last_time = now
+        frame_ticks = 0
+        while accumulator >= SIM_DT:
+            apply_game_events(step(game_state, TICK, SIM_DT))
+            accumulator -= SIM_DT
+            frame_ticks += 1
+        sim_ticks += frame_ticks
+        render_alpha = accumulator / SIM_DT
+        update_particles(frame_ticks * SIM_DT)
+        sfx.flush()
+        if leaderboard:
+            leaderboard.pump()
+        run_preparer.pump()
+        if telemetry:
+            telemetry.pump()
         if game_state.state == "intro":
-            draw_intro()
-        elif game_state.state == "overworld":
-            draw_overworld()
-        elif game_state.state == "combat":
-            draw_combat()
-        elif game_state.state == "shop":
-            draw_shop()
-        elif game_state.state == "victory":
-            draw_victory()
-        elif game_state.state == "gameover":
-            draw_gameover()
-
-        pygame.display.flip()
-        clock.tick(60)
+            prerender_city()
+        profiler.mark("update")
+
+        draw_screen()
+        profiler.mark("draw")
+
+        if profiler.visible:
+            draw_profiler()
+        profiler.mark("profiler")
+
+        dirty.present(frame_key())
+        profiler.mark("flip")
+        clock.tick(RENDER_FPS)
         await asyncio.sleep(0)
+        profiler.mark("tick")
+        profiler.end_frame()
+        if telemetry:
+            record_frame()
+
+    if not loader.done():
+        loader.cancel()
+    if leaderboard:
+        leaderboard.close()
+    run_preparer.close()
+    if telemetry:
+        telemetry.close()
+    if recording:
+        recording.ticks = sim_ticks
+        try:
+            recording.save(RECORD_PATH)
+            print(f"[REPLAY] recorded {sim_ticks} ticks, {len(recording.inputs)} inputs to {RECORD_PATH}")
+        except OSError as e:
+            print(f"[WARNING] Could not save recording {RECORD_PATH}: {e}")
+    if PROFILE_TRACE_PATH:
+        profiler.write_trace(PROFILE_TRACE_PATH)
+
+def replay_session(recording, render=True):
+    """Play a recorded session back through this front end, one drawn frame per tick, uncapped."""
+    new_session(recording.seed)
+
+    def frame(tick):
+        sfx.flush()
+        update_particles(SIM_DT)
+        profiler.mark("update")
+        if render:
+            draw_screen()
+            profiler.mark("draw")
+            dirty.present(frame_key())
+            profiler.mark("flip")
+        profiler.end_frame()
+        profiler.begin_frame()
+
+    profiler.begin_frame()
+    return replay(recording, game_state, apply_game_events, frame)
 
 if __name__ == "__main__":
     asyncio.run(main())
-
-pygame.quit()
-sys.exit()
+    pygame.quit()
+    sys.exit()
@@ -0,0 +1,151 @@
+"""Slice City telemetry: gameplay events as gzipped JSON lines, written behind the frame loop.
+
+``emit`` appends a record to a bounded deque and returns at once. Under
+the GIL ``append``, ``len`` and ``popleft`` are each atomic, so the frame
+loop and the writer thread never take a lock; when the deque is full the
+record is dropped and counted instead. A background thread wakes every
+``FLUSH_SECONDS``, takes whatever has piled up and appends it to the
+current file, which is closed for a new one once it holds
+``ROTATE_BYTES`` of JSON or a new UTC day starts.
+
+Every line is one JSON object with ``ts`` (Unix seconds), ``session``
+(one per process), ``type`` and the fields of that type. Frame times are
+not one record per frame: ``frame`` counts them into per-screen
+histograms of ``FRAME_BIN_MS`` bins, sent once a second as a "frames"
+record with sparse ``[bin, count]`` pairs for the whole frame and for the
+work in it (the frame minus the wait for the FPS cap). A "dropped"
+record says how many records the full queue turned away.
+``telemetry_report.py`` reads the files back.
+
+Browsers have no threads: there ``Telemetry(directory, threaded=False)``
+writes from ``pump``, which the game calls once per frame.
+"""
+import collections
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+
+QUEUE_SIZE = 4096  # records waiting for the writer before new ones are dropped
+FLUSH_SECONDS = 1.0
+ROTATE_BYTES = 8 * 1024 * 1024  # uncompressed JSON per file
+FRAME_BIN_MS = 0.5
+FRAME_BINS = 200  # the histogram covers 0-100 ms; slower frames count in the last bin
+
+def frame_bin(ms):
+    return min(int(ms / FRAME_BIN_MS), FRAME_BINS - 1)
+
+class Telemetry:
+    def __init__(self, directory, threaded=True, queue_size=QUEUE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.session = uuid.uuid4().hex[:12]
+        self.queue = collections.deque()
+        self.queue_size = queue_size
+        self.dropped = 0  # only the frame loop writes this
+        self.reported_dropped = 0  # only the writer writes this
+        self.file = None
+        self.file_bytes = 0
+        self.file_day = None
+        self.file_index = 0
+        self.frames = {}  # screen -> ({bin: count} whole frames, {bin: count} work), this second
+        self.frame_second = None
+        self.last_pump = 0.0
+        self.stop = threading.Event()
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self.write_loop, name="telemetry-writer", daemon=True)
+            self.thread.start()
+
+    def emit(self, kind, **fields):
+        """Queue one record; never blocks. Returns False when the queue is full and it was dropped."""
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            return False
+        fields["ts"] = round(time.time(), 3)
+        fields["session"] = self.session
+        fields["type"] = kind
+        self.queue.append(fields)
+        return True
+
+    def frame(self, screen, frame_ms, work_ms):
+        """Count one frame drawn on ``screen``; the counts go out once a second."""
+        second = int(time.monotonic())
+        if second != self.frame_second:
+            self.flush_frames()
+            self.frame_second = second
+        whole, work = self.frames.setdefault(screen, ({}, {}))
+        b = frame_bin(frame_ms)
+        whole[b] = whole.get(b, 0) + 1
+        b = frame_bin(work_ms)
+        work[b] = work.get(b, 0) + 1
+
+    def flush_frames(self):
+        for screen, (whole, work) in self.frames.items():
+            self.emit("frames", screen=screen, frame=sorted(whole.items()), work=sorted(work.items()))
+        self.frames = {}
+
+    def rotate(self, day):
+        if self.file:
+            self.file.close()
+        path = os.path.join(self.directory, f"telemetry-{day}-{self.session}-{self.file_index:03}.jsonl.gz")
+        self.file_index += 1
+        self.file = gzip.open(path, "wb")
+        self.file_day = day
+        self.file_bytes = 0
+
+    def write(self, records):
+        day = time.strftime("%Y%m%d", time.gmtime())
+        try:
+            if self.file is None or self.file_bytes >= ROTATE_BYTES or day != self.file_day:
+                self.rotate(day)
+            data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode()
+            self.file.write(data)
+            self.file.flush()  # a whole deflate block, so the file reads back even if the game is killed
+            self.file_bytes += len(data)
+        except OSError as e:
+            print(f"[ERROR] Could not write {len(records)} telemetry records: {e}")
+
+    def drain(self):
+        records = []
+        while self.queue:
+            records.append(self.queue.popleft())
+        dropped = self.dropped
+        if dropped != self.reported_dropped:
+            records.append({"ts": round(time.time(), 3), "session": self.session, "type": "dropped",
+                            "count": dropped - self.reported_dropped})
+            self.reported_dropped = dropped
+        return records
+
+    def write_loop(self):
+        while not self.stop.wait(FLUSH_SECONDS):
+            records = self.drain()
+            if records:
+                self.write(records)
+        records = self.drain()
+        if records:
+            self.write(records)
+
+    def pump(self):
+        """Without a writer thread, write what is queued once every ``FLUSH_SECONDS``; with one, nothing to do."""
+        now = time.monotonic()
+        if self.thread is None and now - self.last_pump >= FLUSH_SECONDS:
+            self.last_pump = now
+            records = self.drain()
+            if records:
+                self.write(records)
+
+    def close(self):
+        """Write everything still queued, then close the file."""
+        self.flush_frames()
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+        else:
+            self.last_pump = 0.0
+            self.pump()
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,198 @@
+"""Offline report over the telemetry files slice_city writes with SLICE_CITY_TELEMETRY=dir.
+
+Reads every record of every file given (directories are searched for
+``*.jsonl.gz``), gathers the fields it needs into NumPy arrays and prints
+encounter rates, combat and delivery numbers, the time-to-victory
+distribution and frame-time percentiles per screen. Files cut short by a
+killed game are read up to the last whole line.
+
+    python telemetry_report.py telemetry/
+    python telemetry_report.py booth1/ booth2/ --days 3
+"""
+import argparse
+import collections
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from telemetry import FRAME_BIN_MS, FRAME_BINS
+
+QUANTILES = (50, 95, 99)
+VICTORY_QUANTILES = (10, 25, 50, 75, 90)
+HOT_TILES = 5
+
+def find_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "**", "*.jsonl.gz"), recursive=True))
+        else:
+            files.append(path)
+    return files
+
+def read_records(path):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"[WARNING] {path}: skipping a damaged line")
+    except (EOFError, OSError, zlib.error) as e:
+        print(f"[WARNING] {path} ends early ({e}); using the records before that")
+
+class Report:
+    """Running totals over records fed to ``add``; ``print_report`` turns the lists into NumPy."""
+    def __init__(self):
+        self.records = 0
+        self.sessions = set()
+        self.dropped = 0
+        self.counts = collections.Counter()  # record type -> records
+        self.runs = collections.defaultdict(lambda: {"encounters": 0, "deliveries": 0, "end": None, "elapsed": 0.0})
+        self.runs_started = 0
+        self.encounters = {"enemy": [], "x": [], "y": []}
+        self.damage = {"hit": [], "damage": []}
+        self.escapes = []
+        self.deliveries = []  # elapsed seconds
+        self.victories = []  # elapsed seconds
+        self.causes = collections.Counter()
+        self.frames = collections.defaultdict(lambda: (np.zeros(FRAME_BINS, np.int64), np.zeros(FRAME_BINS, np.int64)))
+
+    def add(self, record):
+        self.records += 1
+        kind = record.get("type")
+        self.counts[kind] += 1
+        self.sessions.add(record.get("session"))
+        if kind == "frames":
+            whole, work = self.frames[record["screen"]]
+            for b, count in record["frame"]:
+                whole[b] += count
+            for b, count in record["work"]:
+                work[b] += count
+        elif kind == "dropped":
+            self.dropped += record["count"]
+        elif kind == "start":
+            self.runs_started += 1
+        elif kind == "encounter":
+            for name in ("enemy", "x", "y"):
+                self.encounters[name].append(record[name])
+            self.run(record)["encounters"] += 1
+        elif kind in ("hit", "damage"):
+            self.damage[kind].append(record["damage"])
+        elif kind == "run":
+            self.escapes.append(record["escaped"])
+        elif kind == "deliver":
+            self.deliveries.append(record["elapsed"])
+            self.run(record)["deliveries"] += 1
+        elif kind in ("victory", "gameover"):
+            run = self.run(record)
+            run["end"], run["elapsed"] = kind, record["elapsed"]
+            if kind == "victory":
+                self.victories.append(record["elapsed"])
+            else:
+                self.causes[record["cause"]] += 1
+
+    def run(self, record):
+        """Totals of the run ``record`` belongs to: one city of one seed in one session."""
+        return self.runs[(record["session"], record["seed"], record["map_seed"])]
+
+    def finished_rates(self, name):
+        """``name`` counted over finished runs only, per run and per minute of those runs."""
+        finished = [run for run in self.runs.values() if run["end"]]
+        if not finished:
+            return "n/a per finished run (no run finished)"
+        count = sum(run[name] for run in finished)
+        played = sum(run["elapsed"] for run in finished)
+        per_minute = f"{count / played * 60:.1f}" if played > 0 else "n/a"
+        return f"{count / len(finished):.2f} per finished run, {per_minute} per minute played"
+
+def histogram_percentiles(counts, quantiles):
+    """Upper bin edges in ms at each quantile of a ``FRAME_BIN_MS`` histogram."""
+    total = counts.sum()
+    cumulative = np.cumsum(counts)
+    return [(np.searchsorted(cumulative, total * q / 100) + 1) * FRAME_BIN_MS for q in quantiles]
+
+def print_report(report):
+    finished = sum(1 for run in report.runs.values() if run["end"])
+    wins = len(report.victories)
+    print(f"{report.records} records from {len(report.sessions)} sessions"
+          + (f", {report.dropped} dropped by a full queue" if report.dropped else ""))
+    print(f"Runs: {report.runs_started} started, {finished} finished, {wins} won"
+          + (f" ({wins / finished:.1%})" if finished else "")
+          + "".join(f", {n} lost on {cause}" for cause, n in report.causes.most_common()))
+
+    enemies = np.array(report.encounters["enemy"])
+    if len(enemies):
+        print(f"\nEncounters: {len(enemies)}, {report.finished_rates('encounters')}")
+        names, counts = np.unique(enemies, return_counts=True)
+        for i in np.argsort(-counts):
+            print(f"  {names[i]:<16} {counts[i]:8d}  {counts[i] / len(enemies):6.1%}")
+        tiles = np.array(report.encounters["x"]) * 10000 + np.array(report.encounters["y"])
+        spots, spot_counts = np.unique(tiles, return_counts=True)
+        hottest = np.argsort(-spot_counts)[:HOT_TILES]
+        print("  busiest tiles: " + ", ".join(f"({spots[i] // 10000}, {spots[i] % 10000}) x{spot_counts[i]}"
+                                              for i in hottest))
+
+    hits = np.array(report.damage["hit"], dtype=float)
+    throws = report.counts["throw"]
+    if throws or report.escapes:
+        escapes = np.array(report.escapes, dtype=bool)
+        print(f"\nCombat: {throws} throws, {len(hits)} hits"
+              + (f" ({len(hits) / throws:.1%})" if throws else "")
+              + (f", {hits.mean():.1f} damage per hit" if len(hits) else "")
+              + f", {len(report.damage['damage'])} times hurt"
+              + (f"; {len(escapes)} run-away attempts, {escapes.mean():.1%} escaped" if len(escapes) else ""))
+
+    deliveries = np.array(report.deliveries)
+    if len(deliveries):
+        p50, p90 = np.percentile(deliveries, (50, 90))
+        print(f"\nDeliveries: {len(deliveries)}, {report.finished_rates('deliveries')};"
+              f" median at {p50:.1f}s, 90% by {p90:.1f}s")
+    print(f"Shop: {report.counts['buy']} purchases; time boosters: {report.counts['time_boost']} picked up;"
+          f" rivals stole {report.counts['stolen']} customers")
+
+    victories = np.array(report.victories)
+    if len(victories):
+        values = np.percentile(victories, VICTORY_QUANTILES)
+        print("\nTime to victory: " + "  ".join(f"p{q} {v:.1f}s" for q, v in zip(VICTORY_QUANTILES, values)))
+        counts = np.bincount(victories.astype(int))
+        for second in np.flatnonzero(counts):
+            print(f"  {second:3d}-{second + 1:<3d}s {counts[second]:7d} {'#' * max(1, round(50 * counts[second] / counts.max()))}")
+
+    if report.frames:
+        print(f"\nFrame times per screen, ms (work = without the wait for the FPS cap; {FRAME_BIN_MS} ms bins)")
+        columns = [f"frame p{q}" for q in QUANTILES] + [f"work p{q}" for q in QUANTILES]
+        print(f"  {'screen':<10} {'frames':>9}" + "".join(f"{column:>11}" for column in columns))
+        for screen, (whole, work) in sorted(report.frames.items(), key=lambda item: -item[1][0].sum()):
+            values = histogram_percentiles(whole, QUANTILES) + histogram_percentiles(work, QUANTILES)
+            print(f"  {screen:<10} {whole.sum():9d}" + "".join(f"{v:11.1f}" for v in values))
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise Slice City telemetry logs.")
+    parser.add_argument("paths", nargs="+", help="telemetry .jsonl.gz files or directories holding them")
+    parser.add_argument("--days", type=float, help="only records from the last N days")
+    args = parser.parse_args()
+
+    files = find_files(args.paths)
+    if not files:
+        print("[ERROR] No telemetry files found")
+        return 1
+    since = time.time() - args.days * 86400 if args.days else None
+    start = time.perf_counter()
+    report = Report()
+    for path in files:
+        for record in read_records(path):
+            if since is None or record.get("ts", 0) >= since:
+                report.add(record)
+    print(f"Read {len(files)} files in {time.perf_counter() - start:.2f}s")
+    print_report(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())